@@ -0,0 +1,196 @@
+"""Running the external score-to-performance aligner (AlignmentTool_v2).
+
+Every call gets its own scratch working directory linking to the tool's script and
+programs, so several alignments can run at the same time, and align_corpus() drives many
+(score, performance) pairs through a process pool.
+"""
+from __future__ import division
+
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+ALIGN_TOOL_DIR = '/home/ilcobo2/AlignmentTool_v2'
+ALIGN_SCRIPT = 'MIDIToMIDIAlign.sh'
+
+# data the tool reads or writes in its working directory (inputs, outputs and intermediate
+# files like score_hmm.txt or perform_spr.txt left behind by runs inside the tool folder)
+_DATA_EXTENSIONS = ('.mid', '.txt')
+
+
+def output_paths(score_midi, perform_midi):
+  """Return the (fmt3x, match, corresp) paths the aligner results are moved to."""
+  score_folder = os.path.dirname(os.path.abspath(score_midi))
+  perform_midi = os.path.abspath(perform_midi)
+  return (os.path.join(score_folder, 'score_fmt3x.txt'),
+          perform_midi.replace('.mid', '_match.txt'),
+          perform_midi.replace('.mid', '_corresp.txt'))
+
+
+def is_up_to_date(score_midi, perform_midi):
+  """True if the _match.txt and _corresp.txt outputs exist and are newer than both inputs."""
+  _, match_path, corresp_path = output_paths(score_midi, perform_midi)
+  if not (os.path.isfile(match_path) and os.path.isfile(corresp_path)):
+    return False
+  input_time = max(os.path.getmtime(score_midi), os.path.getmtime(perform_midi))
+  return min(os.path.getmtime(match_path), os.path.getmtime(corresp_path)) >= input_time
+
+
+def has_alignment(perform_midi):
+  """True if the performance's own _match.txt and _corresp.txt exist and are newer than it.
+
+  Unlike is_up_to_date, the score MIDI is not compared: score.mid is (re)written next to
+  existing alignments, and content changes are left to align_corpus and AlignmentCache.
+  """
+  perform_midi = os.path.abspath(perform_midi)
+  match_path = perform_midi.replace('.mid', '_match.txt')
+  corresp_path = perform_midi.replace('.mid', '_corresp.txt')
+  if not (os.path.isfile(match_path) and os.path.isfile(corresp_path)):
+    return False
+  return min(os.path.getmtime(match_path), os.path.getmtime(corresp_path)) >= os.path.getmtime(perform_midi)
+
+
+def _tool_entries(align_tool_dir, script=ALIGN_SCRIPT):
+  """Names in the tool folder that scratch directories link to: the script, sub-folders and executables.
+
+  Anything else, in particular data files, would be written through the link into the
+  shared folder by concurrent jobs.
+  """
+  names = []
+  for name in sorted(os.listdir(align_tool_dir)):
+    path = os.path.join(align_tool_dir, name)
+    if name == script or os.path.isdir(path):
+      names.append(name)
+    elif os.access(path, os.X_OK) and not name.endswith(_DATA_EXTENSIONS):
+      names.append(name)
+  return names
+
+
+def _move(src, dst):
+  # move next to the destination first so the final rename is atomic; performances of
+  # the same piece share score_fmt3x.txt and may finish at the same time
+  tmp_dst = '{}.{}.tmp'.format(dst, os.getpid())
+  shutil.move(src, tmp_dst)
+  os.replace(tmp_dst, dst)
+
+
+def run_aligner(score_midi, perform_midi, align_tool_dir=ALIGN_TOOL_DIR, work_dir=None, use_sudo=True,
+                script=ALIGN_SCRIPT):
+  """Align perform_midi to score_midi and place the results next to the inputs.
+
+  The script, sub-folders and executables of the tool folder are linked into a fresh
+  scratch directory (under work_dir, or the system temp dir), the script is run there, and the scratch directory is removed
+  afterwards. Raises subprocess.CalledProcessError if the aligner fails.
+  """
+  score_midi = os.path.abspath(score_midi)
+  perform_midi = os.path.abspath(perform_midi)
+  align_tool_dir = os.path.abspath(align_tool_dir)
+  scratch = tempfile.mkdtemp(prefix='align_', dir=work_dir)
+  try:
+    for name in _tool_entries(align_tool_dir, script):
+      os.symlink(os.path.join(align_tool_dir, name), os.path.join(scratch, name))
+    shutil.copy(perform_midi, os.path.join(scratch, 'perform.mid'))
+    shutil.copy(score_midi, os.path.join(scratch, 'score.mid'))
+
+    command = ['sh', script, 'score', 'perform']
+    if use_sudo:
+      command = ['sudo'] + command
+    subprocess.check_call(command, cwd=scratch)
+
+    fmt3x_path, match_path, corresp_path = output_paths(score_midi, perform_midi)
+    _move(os.path.join(scratch, 'score_fmt3x.txt'), fmt3x_path)
+    _move(os.path.join(scratch, 'perform_match.txt'), match_path)
+    _move(os.path.join(scratch, 'perform_corresp.txt'), corresp_path)
+  finally:
+    shutil.rmtree(scratch, ignore_errors=True)
+
+
+class AlignResult(object):
+  def __init__(self, score_midi, perform_midi, status, seconds=0.0, error=None):
+    self.score_midi = score_midi
+    self.perform_midi = perform_midi
+    self.status = status  # 'aligned', 'skipped' or 'failed'
+    self.seconds = seconds
+    self.error = error
+
+  def __repr__(self):
+    return 'AlignResult({}, {}, {:.2f}s{})'.format(self.perform_midi, self.status, self.seconds,
+                                                   '' if self.error is None else ', ' + self.error)
+
+
+def _align_job(score_midi, perform_midi, align_tool_dir, work_dir, use_sudo, script):
+  start = time.time()
+  try:
+    run_aligner(score_midi, perform_midi, align_tool_dir, work_dir, use_sudo, script)
+  except Exception as e:
+    return AlignResult(score_midi, perform_midi, 'failed', time.time() - start, '{}: {}'.format(type(e).__name__, e))
+  return AlignResult(score_midi, perform_midi, 'aligned', time.time() - start)
+
+
+def align_corpus(pairs, num_workers=None, align_tool_dir=ALIGN_TOOL_DIR, work_dir=None, use_sudo=True,
+                 script=ALIGN_SCRIPT, force=False):
+  """Align a list of (score_midi, perform_midi) pairs with up to num_workers aligner processes.
+
+  Pairs whose outputs are already up to date are skipped unless force is set.
+  Returns one AlignResult per pair, in input order.
+  """
+  results = [None] * len(pairs)
+  futures = dict()
+  with ProcessPoolExecutor(max_workers=num_workers) as executor:
+    for i, (score_midi, perform_midi) in enumerate(pairs):
+      if not force and is_up_to_date(score_midi, perform_midi):
+        results[i] = AlignResult(score_midi, perform_midi, 'skipped')
+        continue
+      futures[i] = executor.submit(_align_job, score_midi, perform_midi, align_tool_dir, work_dir, use_sudo, script)
+    for i, future in futures.items():
+      results[i] = future.result()
+  return results
+
+
+def summarize(results):
+  counts = dict((status, 0) for status in ['aligned', 'skipped', 'failed'])
+  for result in results:
+    counts[result.status] += 1
+  aligned_seconds = [el.seconds for el in results if el.status == 'aligned']
+  lines = ['aligned: {aligned}, skipped: {skipped}, failed: {failed}'.format(**counts)]
+  if aligned_seconds:
+    lines.append('alignment time: total {:.1f}s, mean {:.2f}s, max {:.2f}s'.format(
+      sum(aligned_seconds), sum(aligned_seconds) / len(aligned_seconds), max(aligned_seconds)))
+  for result in results:
+    if result.status == 'failed':
+      lines.append('failed: {} ({})'.format(result.perform_midi, result.error))
+  return '\n'.join(lines)
+
+
+def find_corpus_pairs(data_path):
+  """Collect (score.mid, performance midi) pairs from every folder under data_path."""
+  pairs = []
+  for root, _, files in sorted(os.walk(data_path)):
+    if 'score.mid' not in files:
+      continue
+    score_midi = os.path.join(root, 'score.mid')
+    for name in sorted(files):
+      if name.endswith('.mid') and name != 'score.mid':
+        pairs.append((score_midi, os.path.join(root, name)))
+  return pairs
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--data_path", default='/dataset/chopin_cleaned')
+  parser.add_argument("--align_tool_dir", default=ALIGN_TOOL_DIR)
+  parser.add_argument("--work_dir", default=None)
+  parser.add_argument("--num_workers", type=int, default=None)
+  parser.add_argument("--no_sudo", action='store_true')
+  parser.add_argument("--force", action='store_true')
+  args = parser.parse_args()
+
+  corpus_results = align_corpus(find_corpus_pairs(args.data_path), args.num_workers, args.align_tool_dir,
+                                args.work_dir, not args.no_sudo, force=args.force)
+  for corpus_result in corpus_results:
+    print(corpus_result)
+  print(summarize(corpus_results))
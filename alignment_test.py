@@ -0,0 +1,84 @@
+import os
+import time
+import alignment
+
+STUB_SCRIPT = '''#!/bin/sh
+# stand-in for MIDIToMIDIAlign.sh: fails on performances whose content is "fail"
+grep -q fail "$2.mid" && exit 1
+cat "$1.mid" > "$1_fmt3x.txt"
+cat "$2.mid" > "$2_match.txt"
+echo $$ > "$2_corresp.txt"
+'''
+
+
+def make_corpus(tmp_path, perform_names):
+  tool_dir = tmp_path / 'tool'
+  tool_dir.mkdir()
+  (tool_dir / alignment.ALIGN_SCRIPT).write_text(STUB_SCRIPT)
+  piece_dir = tmp_path / 'piece'
+  piece_dir.mkdir()
+  (piece_dir / 'score.mid').write_text('score')
+  for name in perform_names:
+    (piece_dir / (name + '.mid')).write_text(name)
+  return str(tool_dir), alignment.find_corpus_pairs(str(tmp_path))
+
+
+def test_align_corpus_in_parallel(tmp_path):
+  tool_dir, pairs = make_corpus(tmp_path, ['a01', 'a02', 'a03', 'fail01'])
+  results = alignment.align_corpus(pairs, num_workers=3, align_tool_dir=tool_dir, use_sudo=False)
+
+  assert [os.path.basename(el.perform_midi) for el in results] == ['a01.mid', 'a02.mid', 'a03.mid', 'fail01.mid']
+  assert [el.status for el in results] == ['aligned', 'aligned', 'aligned', 'failed']
+  for result in results[:3]:
+    fmt3x_path, match_path, corresp_path = alignment.output_paths(result.score_midi, result.perform_midi)
+    with open(match_path) as f:
+      assert f.read() == os.path.basename(result.perform_midi)[:-4]
+    assert os.path.isfile(corresp_path)
+  with open(fmt3x_path) as f:
+    assert f.read() == 'score'
+  assert not os.path.exists(os.path.join(tool_dir, 'perform_match.txt'))
+  assert 'failed: 1' in alignment.summarize(results)
+
+
+def test_align_corpus_skips_up_to_date_outputs(tmp_path):
+  tool_dir, pairs = make_corpus(tmp_path, ['a01', 'a02'])
+  alignment.align_corpus(pairs, num_workers=2, align_tool_dir=tool_dir, use_sudo=False)
+  results = alignment.align_corpus(pairs, num_workers=2, align_tool_dir=tool_dir, use_sudo=False)
+  assert [el.status for el in results] == ['skipped', 'skipped']
+
+  future = time.time() + 10
+  os.utime(pairs[1][1], (future, future))
+  results = alignment.align_corpus(pairs, num_workers=2, align_tool_dir=tool_dir, use_sudo=False)
+  assert [el.status for el in results] == ['skipped', 'aligned']
+
+
+INTERMEDIATE_STUB_SCRIPT = '''#!/bin/sh
+# writes an intermediate file in the working directory and reads it back later, like the real tool
+./helper "$2.mid" > perform_spr.txt
+sleep 0.3
+cat "$1.mid" > "$1_fmt3x.txt"
+cat perform_spr.txt > "$2_match.txt"
+echo $$ > "$2_corresp.txt"
+'''
+
+
+def test_concurrent_jobs_keep_intermediate_files_apart(tmp_path):
+  tool_dir, pairs = make_corpus(tmp_path, ['a01', 'a02', 'a03', 'a04'])
+  with open(os.path.join(tool_dir, alignment.ALIGN_SCRIPT), 'w') as f:
+    f.write(INTERMEDIATE_STUB_SCRIPT)
+  helper = os.path.join(tool_dir, 'helper')
+  with open(helper, 'w') as f:
+    f.write('#!/bin/sh\ncat "$1"\n')
+  os.chmod(helper, 0o755)
+  # left over from a run inside the tool folder
+  with open(os.path.join(tool_dir, 'perform_spr.txt'), 'w') as f:
+    f.write('stale')
+
+  results = alignment.align_corpus(pairs, num_workers=4, align_tool_dir=tool_dir, use_sudo=False)
+  assert [el.status for el in results] == ['aligned'] * 4
+  for result in results:
+    _, match_path, _ = alignment.output_paths(result.score_midi, result.perform_midi)
+    with open(match_path) as f:
+      assert f.read() == os.path.basename(result.perform_midi)[:-4]
+  with open(os.path.join(tool_dir, 'perform_spr.txt')) as f:
+    assert f.read() == 'stale'
@@ -0,0 +1,529 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks over the bundled examples and synthetic inputs.
+
+  python benchmark.py xml_notes
+  python benchmark.py --update_baseline  # record pipeline throughput on this machine
+  python benchmark.py --check  # exit 1 if a pipeline stage got slower or uses more memory
+
+--check and --update_baseline run the pipeline stages only (see pipeline_results) and
+compare against or overwrite benchmark_baseline.json. Baselines are per machine.
+"""
+from __future__ import division
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import warnings
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'examples')
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+EXAMPLE_SCORES = [('ballade1', 'musicxml_cleaned.musicxml'),
+                  ('bps14-3', 'musicxml_cleaned.musicxml'),
+                  ('bps8-2', 'xml.xml'),
+                  ('chopin_nocturne', 'musicxml_cleaned.musicxml'),
+                  ('mozart545-1', 'xml.xml'),
+                  ('schumann', 'musicxml_cleaned.musicxml')]
+
+
+def example_score_paths():
+  return [(name, os.path.join(EXAMPLES_DIR, name, file_name)) for name, file_name in EXAMPLE_SCORES]
+
+
+def best_time(fn, setup=None, repeat=3):
+  """Best wall time of fn(setup()) over repeat runs; setup is excluded from the timing."""
+  best = None
+  result = None
+  for _ in range(repeat):
+    arg = setup() if setup is not None else None
+    start = time.perf_counter()
+    result = fn(arg) if setup is not None else fn()
+    elapsed = time.perf_counter() - start
+    if best is None or elapsed < best:
+      best = elapsed
+  return best, result
+
+
+def print_row(name, *columns):
+  print('{:<18}'.format(name) + ''.join('{:>14}'.format(el) for el in columns))
+
+
+def _legacy_mark_after_grace_note_to_chord_notes(notes):
+  after_grace_notes = [el for el in notes if el.note_duration.after_grace_note]
+  for note in after_grace_notes:
+    onset = note.note_duration.xml_position
+    voice = note.voice
+    chords = [el for el in notes if (el.note_duration.xml_position == onset and el.voice == voice)]
+    for chord_note in chords:
+      chord_note.note_duration.after_grace_note = True
+
+
+def _legacy_remove_tied_notes(notes):
+  removed_forward = []
+  for i in range(len(notes)):
+    current_note = notes[i]
+    if current_note.note_notations.tied_stop:
+      for j in reversed(range(len(removed_forward))):
+        if removed_forward[j].note_notations.tied_start and \
+           removed_forward[j].pitch[1] == current_note.pitch[1]:
+          removed_forward[j].note_duration.seconds += current_note.note_duration.seconds
+          removed_forward[j].note_duration.duration += current_note.note_duration.duration
+          removed_forward[j].note_duration.midi_ticks += current_note.note_duration.midi_ticks
+          break
+    else:
+      removed_forward.append(notes[i])
+  return removed_forward
+
+
+def bench_xml_notes(repeat=3):
+  """Tie removal and after-grace marking: the old quadratic passes against XmlNotes."""
+  from musicXML_parser.mxp import MusicXMLDocument
+  import xml_data
+
+  def fresh_notes(xml_doc):
+    processed = xml_data.XmlNotes.__new__(xml_data.XmlNotes)
+    processed.xml_doc = xml_doc
+    processed.notes, processed.rests = processed.read_notes()
+    return processed
+
+  def current(processed):
+    processed.mark_after_grace_note_to_chord_notes()
+    processed.remove_tied_notes()
+    return processed.notes
+
+  def legacy(processed):
+    _legacy_mark_after_grace_note_to_chord_notes(processed.notes)
+    return _legacy_remove_tied_notes(processed.notes)
+
+  def summary(notes):
+    return [(el.pitch[1], el.note_duration.xml_position, el.note_duration.duration,
+             el.note_duration.after_grace_note) for el in notes]
+
+  print_row('example', 'notes', 'legacy (s)', 'current (s)', 'speed-up', 'identical')
+  for name, path in example_score_paths():
+    # read_notes reorders grace note times in place, so every run needs its own document
+    legacy_time, legacy_notes = best_time(legacy, lambda: fresh_notes(MusicXMLDocument(path)), repeat)
+    current_time, current_notes = best_time(current, lambda: fresh_notes(MusicXMLDocument(path)), repeat)
+    print_row(name, len(current_notes), '{:.4f}'.format(legacy_time), '{:.4f}'.format(current_time),
+              '{:.1f}x'.format(legacy_time / max(current_time, 1e-9)),
+              summary(legacy_notes) == summary(current_notes))
+
+
+def bench_directions(repeat=3):
+  """Direction classification: per-keyword-list extraction against the single-pass classifier."""
+  from musicXML_parser.mxp import MusicXMLDocument
+  import constants
+  import utils
+  import xml_data
+
+  keyword_lists = [('abs_tempo', constants.ABS_TEMPOS),
+                   ('rel_tempo', constants.REL_TEMPOS),
+                   ('abs_dynamic', constants.ABS_DYNAMICS + ['dynamic']),
+                   ('rel_dynamic', constants.REL_DYNAMCIS)]
+
+  def legacy(directions):
+    return [utils.extract_directions_by_keywords(directions, keywords) for _, keywords in keyword_lists]
+
+  def current(directions):
+    categories = xml_data.DIRECTION_CLASSIFIER.classify_all(directions)
+    return [[el for el, tags in zip(directions, categories) if name in tags] for name, _ in keyword_lists]
+
+  print_row('example', 'directions', 'legacy (s)', 'current (s)', 'speed-up', 'identical')
+  for name, path in example_score_paths():
+    meta = xml_data.XmlMeta.__new__(xml_data.XmlMeta)
+    meta.xml_doc = MusicXMLDocument(path)
+    directions, _ = meta.extract_directions()
+    legacy_time, legacy_result = best_time(lambda: legacy(directions), repeat=repeat)
+    current_time, current_result = best_time(lambda: current(directions), repeat=repeat)
+    print_row(name, len(directions), '{:.4f}'.format(legacy_time), '{:.4f}'.format(current_time),
+              '{:.1f}x'.format(legacy_time / max(current_time, 1e-9)), legacy_result == current_result)
+
+
+def _legacy_pedal_filter(pedals):
+  for pedal in pedals:
+    if pedal.value < 75:
+      pedal.value = 0
+  pedals.sort(key=lambda x: x.time)
+  previous_off_time = 0
+  for pedal in pedals:
+    if pedal.time < 0.3:
+      continue
+    if pedal.value < 75:
+      previous_off_time = pedal.time
+    else:
+      time_passed = pedal.time - previous_off_time
+      if time_passed < 0.3:
+        pedals.remove(pedal)
+  return pedals
+
+
+def pedal_dense_events(num_events, seed=0):
+  """Sustain and soft pedal events every ~50ms on average, half of them presses."""
+  import pretty_midi
+  rng = random.Random(seed)
+  return [pretty_midi.ControlChange(number=rng.choice([64, 64, 64, 67]), value=rng.choice([0, 127]),
+                                    time=rng.uniform(0, num_events * 0.05))
+          for _ in range(num_events)]
+
+
+def bench_pedals(repeat=3):
+  """save_to_midi pedal post-processing: list.remove pass against pedal.filter_pedals.
+
+  The legacy pass skips the event after every removal, so 'kept' differs between the two.
+  """
+  import copy
+  import pedal
+
+  print_row('events', 'legacy (s)', 'current (s)', 'speed-up', 'legacy kept', 'current kept')
+  for num_events in [1000, 5000, 20000]:
+    events = pedal_dense_events(num_events)
+    legacy_time, legacy_kept = best_time(_legacy_pedal_filter, lambda: copy.deepcopy(events), repeat)
+    current_time, current_kept = best_time(lambda: pedal.filter_pedals(events), repeat=repeat)
+    print_row(num_events, '{:.4f}'.format(legacy_time), '{:.4f}'.format(current_time),
+              '{:.1f}x'.format(legacy_time / max(current_time, 1e-9)), len(legacy_kept), len(current_kept))
+
+
+def bench_dtw_alignment(repeat=3):
+  """dtw_alignment against the AlignmentTool_v2 output bundled for ballade1 / Ali01.
+
+  Score notes come from score_fmt3x.txt and performed notes from Ali01_match.txt, so the
+  in-process aligner sees the same notes as the external one did. Agreement is the share
+  of the reference's (performed note, score note) pairs that are reproduced, and
+  precision the share of the in-process pairs found in the reference. Extra notes count
+  as agreeing when both leave the performed note unmatched. The external tool is not
+  run here; its time is not part of the comparison.
+  """
+  import numpy as np
+  import dtw_alignment
+  import matching
+
+  example_dir = os.path.join(EXAMPLES_DIR, 'ballade1')
+  score = matching.read_fmt3x_columns(os.path.join(example_dir, 'score_fmt3x.txt'))
+  reference = matching.read_match_columns(os.path.join(example_dir, 'Ali01_match.txt'))
+  performed = reference.perform_ids >= 0
+  onsets = reference.onsets[performed]
+  pitches = reference.pitches[performed]
+  reference_ids = reference.score_ids[performed]
+
+  print_row('radius', 'notes', 'time (s)', 'notes/s', 'agreement', 'precision', 'extra agree')
+  for radius in [8, 16, 32]:
+    elapsed, perform_to_score = best_time(
+      lambda: dtw_alignment.align_notes(score.seconds, score.pitches, onsets, pitches, radius=radius), repeat=repeat)
+    ids = np.where(perform_to_score >= 0, score.ids[np.maximum(perform_to_score, 0)], -1)
+    same = ids == reference_ids
+    matched = reference_ids >= 0
+    print_row(radius, len(onsets), '{:.4f}'.format(elapsed), '{:.0f}'.format(len(onsets) / elapsed),
+              '{:.3f}'.format((same & matched).sum() / max(matched.sum(), 1)),
+              '{:.3f}'.format((same & (ids >= 0)).sum() / max((ids >= 0).sum(), 1)),
+              '{}/{}'.format((same & ~matched).sum(), (~matched).sum()))
+
+
+def bench_score_follower(repeat=3):
+  """Online following of ballade1 / Ali01 against the offline Ali01_match.txt pairs, fed back to back."""
+  import numpy as np
+  import pretty_midi
+  import matching
+  import score_follower
+
+  example_dir = os.path.join(EXAMPLES_DIR, 'ballade1')
+  score = matching.read_fmt3x_columns(os.path.join(example_dir, 'score_fmt3x.txt'))
+  reference = matching.read_match_columns(os.path.join(example_dir, 'Ali01_match.txt'))
+  performed = np.nonzero(reference.perform_ids >= 0)[0]
+  notes = [pretty_midi.Note(int(reference.velocities[i]), int(reference.pitches[i]), float(reference.onsets[i]),
+                            float(reference.offsets[i])) for i in performed]
+  reference_ids = dict(zip(reference.onsets[performed].tolist(), reference.score_ids[performed].tolist()))
+
+  def follow():
+    return score_follower.replay(score_follower.ScoreFollower(score.seconds, score.pitches), notes, speed=None)
+
+  elapsed, (pairs, summary) = best_time(follow, repeat=repeat)
+  ids = [-1 if el.score_note_idx is None else int(score.ids[el.score_note_idx]) for el in pairs]
+  agreement = np.mean([el == reference_ids[pair.perform_second] for el, pair in zip(ids, pairs)])
+  print_row('events', 'total (s)', 'p50 (ms)', 'p99 (ms)', 'max (ms)', 'agreement')
+  print_row(len(pairs), '{:.4f}'.format(elapsed), '{:.3f}'.format(summary['p50_ms']),
+            '{:.3f}'.format(summary['p99_ms']), '{:.3f}'.format(summary['max_ms']), '{:.3f}'.format(agreement))
+
+
+def bench_segmented_alignment(repeat=3):
+  """segmented_alignment against whole-piece dtw_alignment on ballade1 / Ali01.
+
+  fmt3x has no measure numbers, so segments here are fixed spans of score seconds. Peak
+  is the tracemalloc peak of one run, agreement as in the dtw_alignment benchmark.
+  """
+  import tracemalloc
+  import numpy as np
+  import dtw_alignment
+  import matching
+  import segmented_alignment
+
+  example_dir = os.path.join(EXAMPLES_DIR, 'ballade1')
+  score = matching.read_fmt3x_columns(os.path.join(example_dir, 'score_fmt3x.txt'))
+  reference = matching.read_match_columns(os.path.join(example_dir, 'Ali01_match.txt'))
+  performed = reference.perform_ids >= 0
+  onsets = reference.onsets[performed]
+  pitches = reference.pitches[performed]
+  reference_ids = reference.score_ids[performed]
+
+  print_row('segment (s)', 'time (s)', 'peak (MB)', 'agreement')
+  for segment_seconds in [None, 60, 30, 15]:
+    if segment_seconds is None:
+      def run():
+        return dtw_alignment.align_notes(score.seconds, score.pitches, onsets, pitches)
+    else:
+      segments = (score.seconds // segment_seconds).astype(np.int64)
+
+      def run():
+        return segmented_alignment.align_segmented(score.seconds, score.pitches, segments, onsets, pitches,
+                                                   num_workers=1)
+    elapsed, perform_to_score = best_time(run, repeat=repeat)
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    ids = np.where(perform_to_score >= 0, score.ids[np.maximum(perform_to_score, 0)], -1)
+    matched = reference_ids >= 0
+    print_row(segment_seconds or 'whole', '{:.4f}'.format(elapsed), '{:.2f}'.format(peak / 1e6),
+              '{:.3f}'.format(((ids == reference_ids) & matched).sum() / max(matched.sum(), 1)))
+
+
+def repeated_score(xml_path, times, save_path):
+  """Write the MusicXML at xml_path with every part's measures repeated times over, renumbered."""
+  import copy
+  import xml.etree.ElementTree as ET
+  tree = ET.parse(xml_path)
+  for part in tree.getroot().iter('part'):
+    measures = part.findall('measure')
+    for measure in measures:
+      part.remove(measure)
+    for i, measure in enumerate(copy.deepcopy(el) for _ in range(times) for el in measures):
+      measure.set('number', str(i + 1))
+      part.append(measure)
+  tree.write(save_path, encoding='UTF-8', xml_declaration=True)
+  return save_path
+
+
+def repeated_text(path, times, save_path, header_lines):
+  """Copy an aligner text file with its lines after header_lines repeated times over."""
+  with open(path, 'r') as f:
+    lines = f.readlines()
+  with open(save_path, 'w') as f:
+    f.writelines(lines[:header_lines] + lines[header_lines:] * times)
+  return save_path
+
+
+def performance_example(work_dir):
+  """ballade1 / Ali01 in work_dir, ready for PerformPair without running the external aligner.
+
+  Only the aligner outputs are bundled, so Ali01.mid is rebuilt from the performed rows of
+  Ali01_match.txt. score.mid and Ali01.mid are written before the aligner outputs are
+  copied, so the copies count as up to date. Returns (xml_path, perform_midi_path).
+  """
+  import shutil
+  import pretty_midi
+  import matching
+  import xml_data
+
+  example_dir = os.path.join(EXAMPLES_DIR, 'ballade1')
+  xml_path = os.path.join(work_dir, 'musicxml_cleaned.musicxml')
+  shutil.copy(os.path.join(example_dir, 'musicxml_cleaned.musicxml'), xml_path)
+  sequence = xml_data.XmlNoteSequence(xml_path)
+  sequence.save_to_midi(sequence.notes, os.path.join(work_dir, 'score.mid'))
+
+  match_columns = matching.read_match_columns(os.path.join(example_dir, 'Ali01_match.txt'))
+  performance = pretty_midi.PrettyMIDI()
+  instrument = pretty_midi.Instrument(program=0)
+  for i in (match_columns.perform_ids >= 0).nonzero()[0].tolist():
+    instrument.notes.append(pretty_midi.Note(int(match_columns.velocities[i]), int(match_columns.pitches[i]),
+                                             float(match_columns.onsets[i]), float(match_columns.offsets[i])))
+  performance.instruments.append(instrument)
+  perform_midi_path = os.path.join(work_dir, 'Ali01.mid')
+  performance.write(perform_midi_path)
+
+  for name in ['score_fmt3x.txt', 'Ali01_match.txt', 'Ali01_corresp.txt']:
+    shutil.copy(os.path.join(example_dir, name), work_dir)
+  return xml_path, perform_midi_path
+
+
+def measure(fn, num_notes, repeat=3):
+  """Best time of fn over repeat runs, notes/s and the tracemalloc peak of one more run."""
+  import tracemalloc
+  elapsed, result = best_time(fn, repeat=repeat)
+  tracemalloc.start()
+  try:
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+  finally:
+    tracemalloc.stop()
+  return {'notes': int(num_notes), 'seconds': elapsed, 'notes_per_s': num_notes / max(elapsed, 1e-9),
+          'peak_mb': peak / 1e6}, result
+
+
+def pipeline_results(repeat=3, scales=(1, 4)):
+  """Throughput and peak memory of every pipeline stage, keyed 'stage/input'.
+
+  Score stages (XmlNoteSequence, save_to_midi, PieceFeatures) run on every example and on
+  each example's measures repeated scale times ('name@x4'); the aligner file readers run
+  on ballade1's files with their rows repeated the same way. PerformPair (alignment
+  files read and every pair resolved) and ScoreFeatures on its score pairs run on
+  ballade1 / Ali01 only, since repeated aligner files no longer match a score.
+  """
+  import shutil
+  import tempfile
+  from collections import OrderedDict
+  import feature
+  import matching
+  import xml_data
+
+  results = OrderedDict()
+  work_dir = tempfile.mkdtemp(prefix='benchmark-')
+  try:
+    for name, path in example_score_paths():
+      for scale in scales:
+        label = name if scale == 1 else '{}@x{}'.format(name, scale)
+        xml_path = path if scale == 1 else repeated_score(path, scale, os.path.join(work_dir, label + '.musicxml'))
+        sequence = xml_data.XmlNoteSequence(xml_path)
+        results['xml_sequence/' + label], _ = measure(lambda: xml_data.XmlNoteSequence(xml_path),
+                                                      sequence.num_notes, repeat)
+        midi_path = os.path.join(work_dir, label + '.mid')
+        results['save_to_midi/' + label], _ = measure(lambda: sequence.save_to_midi(sequence.notes, midi_path),
+                                                      sequence.num_notes, repeat)
+        results['piece_features/' + label], _ = measure(lambda: feature.PieceFeatures(sequence),
+                                                        sequence.num_notes, repeat)
+
+    example_dir = os.path.join(EXAMPLES_DIR, 'ballade1')
+    readers = [('read_match', matching.read_match, 'Ali01_match.txt', 4),
+               ('read_corresp', matching.read_corresp, 'Ali01_corresp.txt', 1),
+               ('read_fmt3x', matching.read_fmt3x, 'score_fmt3x.txt', 2)]
+    for stage, reader, file_name, header_lines in readers:
+      for scale in scales:
+        label = 'ballade1' if scale == 1 else 'ballade1@x{}'.format(scale)
+        text_path = repeated_text(os.path.join(example_dir, file_name), scale,
+                                  os.path.join(work_dir, '{}-{}'.format(scale, file_name)), header_lines)
+        with open(text_path, 'r') as f:
+          num_rows = sum(1 for _ in f) - header_lines
+        results['{}/{}'.format(stage, label)], _ = measure(lambda: reader(text_path), num_rows, repeat)
+
+    pair_dir = os.path.join(work_dir, 'ballade1')
+    os.makedirs(pair_dir)
+    xml_path, perform_midi_path = performance_example(pair_dir)
+    sequence = xml_data.XmlNoteSequence(xml_path)
+
+    def resolve():
+      perform_pair = matching.PerformPair(sequence, perform_midi_path)
+      perform_pair.score_pairs
+      return perform_pair
+    # only reading and resolving the bundled alignment is timed; PerformPair swallows aligner
+    # errors, so calls are recorded and checked afterwards
+    align = matching.match
+    aligned = []
+    matching.match = lambda score_midi, perform_midi: aligned.append(perform_midi)
+    try:
+      perform_pair = resolve()
+      results['perform_pair/ballade1'], _ = measure(resolve, len(perform_pair.match_columns), repeat)
+    finally:
+      matching.match = align
+    assert not aligned, 'benchmark ran the external aligner on {}'.format(aligned[0])
+    score_pairs = perform_pair.score_pairs
+    results['score_features/ballade1'], _ = measure(lambda: feature.ScoreFeatures(sequence, score_pairs),
+                                                    len(score_pairs), repeat)
+  finally:
+    shutil.rmtree(work_dir, ignore_errors=True)
+  return results
+
+
+def print_results(results, baseline=None):
+  print('{:<32}{:>10}{:>12}{:>14}{:>12}{:>10}'.format('stage', 'notes', 'time (s)', 'notes/s', 'peak (MB)',
+                                                     'vs base'))
+  for name, result in results.items():
+    reference = (baseline or {}).get(name)
+    ratio = '' if reference is None else '{:.2f}x'.format(result['notes_per_s'] / reference['notes_per_s'])
+    print('{:<32}{:>10}{:>12.4f}{:>14.0f}{:>12.2f}{:>10}'.format(name, result['notes'], result['seconds'],
+                                                               result['notes_per_s'], result['peak_mb'], ratio))
+
+
+def bench_pipeline(repeat=3):
+  """Notes/s and peak memory of the score -> pair -> feature stages; see pipeline_results."""
+  print_results(pipeline_results(repeat))
+
+
+def regressions(results, baseline, tolerance=0.25):
+  """Stages slower (notes/s) or hungrier (peak memory) than baseline by more than tolerance."""
+  failures = []
+  for name, reference in baseline.items():
+    result = results.get(name)
+    if result is None:
+      failures.append('{}: missing from this run'.format(name))
+      continue
+    if result['notes_per_s'] < reference['notes_per_s'] * (1 - tolerance):
+      failures.append('{}: {:.0f} notes/s, baseline {:.0f}'.format(name, result['notes_per_s'],
+                                                                   reference['notes_per_s']))
+    if result['peak_mb'] > reference['peak_mb'] * (1 + tolerance):
+      failures.append('{}: peak {:.2f} MB, baseline {:.2f} MB'.format(name, result['peak_mb'], reference['peak_mb']))
+  return failures
+
+
+def read_baseline(path):
+  with open(path, 'r') as f:
+    saved = json.load(f)
+  if saved['machine'] != platform.platform():
+    print('Baseline was recorded on {}, this is {}'.format(saved['machine'], platform.platform()))
+  return saved['results']
+
+
+def write_baseline(path, results):
+  tmp_path = path + '.tmp'
+  with open(tmp_path, 'w') as f:
+    json.dump({'machine': platform.platform(), 'python': platform.python_version(), 'results': results}, f,
+              indent=1)
+  os.replace(tmp_path, path)
+
+
+BENCHMARKS = {'xml_notes': bench_xml_notes,
+              'directions': bench_directions,
+              'pedals': bench_pedals,
+              'dtw_alignment': bench_dtw_alignment,
+              'score_follower': bench_score_follower,
+              'segmented_alignment': bench_segmented_alignment,
+              'pipeline': bench_pipeline}
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument("benchmarks", nargs='*', help='any of {}; all when none are given'.format(
+    ', '.join(sorted(BENCHMARKS))))
+  parser.add_argument("--repeat", type=int, default=3)
+  parser.add_argument("--check", action='store_true',
+                      help='run the pipeline stages and exit 1 on regressions against the baseline')
+  parser.add_argument("--update_baseline", action='store_true', help='run the pipeline stages and save the baseline')
+  parser.add_argument("--baseline", default=BASELINE_PATH)
+  parser.add_argument("--tolerance", type=float, default=0.25,
+                      help='allowed notes/s drop and peak memory growth, as a fraction of the baseline')
+  parser.add_argument("--scales", type=int, nargs='+', default=[1, 4], help='score repeats for scaled-up inputs')
+  args = parser.parse_args()
+  unknown = [el for el in args.benchmarks if el not in BENCHMARKS]
+  if unknown:
+    parser.error('unknown benchmarks: {}'.format(', '.join(unknown)))
+
+  warnings.simplefilter('ignore', RuntimeWarning)
+  if args.update_baseline:
+    pipeline = pipeline_results(args.repeat, args.scales)
+    print_results(pipeline)
+    write_baseline(args.baseline, pipeline)
+    print('Baseline written to {}'.format(args.baseline))
+  elif args.check:
+    if not os.path.isfile(args.baseline):
+      sys.exit('No baseline at {}; record one with --update_baseline'.format(args.baseline))
+    baseline = read_baseline(args.baseline)
+    pipeline = pipeline_results(args.repeat, args.scales)
+    print_results(pipeline, baseline)
+    failures = regressions(pipeline, baseline, args.tolerance)
+    for failure in failures:
+      print('REGRESSION ' + failure)
+    sys.exit(1 if failures else 0)
+  else:
+    for benchmark_name in args.benchmarks or sorted(BENCHMARKS):
+      print('== {}'.format(benchmark_name))
+      BENCHMARKS[benchmark_name](repeat=args.repeat)
@@ -0,0 +1,161 @@
+"""Content-addressed cache for generated score MIDI files and aligner outputs.
+
+Each entry lives in its own folder under the cache directory, named by a key hashed
+from the contents of its inputs, and holds the cached files plus a manifest.json that
+records which inputs produced them. An entry only becomes visible once its manifest
+is written, so concurrent writers never expose half-copied files.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import alignment
+import profiling
+
+# bump when XmlNoteSequence.save_to_midi output changes for the same MusicXML
+SCORE_MIDI_VERSION = 2
+
+_MANIFEST = 'manifest.json'
+
+
+def file_hash(path, chunk_size=1 << 20):
+  sha = hashlib.sha1()
+  with open(path, 'rb') as f:
+    for chunk in iter(lambda: f.read(chunk_size), b''):
+      sha.update(chunk)
+  return sha.hexdigest()
+
+
+def aligner_version(align_tool_dir=alignment.ALIGN_TOOL_DIR, script=alignment.ALIGN_SCRIPT):
+  """Hash of the aligner entry script, or 'unknown' if the tool is not installed here."""
+  script_path = os.path.join(align_tool_dir, script)
+  if not os.path.isfile(script_path):
+    return 'unknown'
+  return file_hash(script_path)
+
+
+class ArtifactCache(object):
+  def __init__(self, cache_dir):
+    self.cache_dir = cache_dir
+    if not os.path.isdir(cache_dir):
+      os.makedirs(cache_dir)
+    self.hits = 0
+    self.misses = 0
+
+  @staticmethod
+  def make_key(kind, *parts):
+    sha = hashlib.sha1(kind.encode('utf-8'))
+    for part in parts:
+      sha.update(b'\0')
+      sha.update(str(part).encode('utf-8'))
+    return '{}-{}'.format(kind, sha.hexdigest())
+
+  def _entry_dir(self, key):
+    return os.path.join(self.cache_dir, key)
+
+  def _read_manifest(self, key):
+    manifest_path = os.path.join(self._entry_dir(key), _MANIFEST)
+    if not os.path.isfile(manifest_path):
+      return None
+    with open(manifest_path, 'r') as f:
+      return json.load(f)
+
+  def restore(self, key, targets):
+    """Copy cached files to targets ({cached name: destination path}).
+
+    Returns True on a hit; on a miss nothing is copied and False is returned.
+    """
+    manifest = self._read_manifest(key)
+    if manifest is None or not all(name in manifest['files'] for name in targets):
+      self.misses += 1
+      profiling.count('artifact_cache_misses')
+      return False
+    for name, destination in targets.items():
+      shutil.copy(os.path.join(self._entry_dir(key), name), destination)
+    self.hits += 1
+    profiling.count('artifact_cache_hits')
+    return True
+
+  def store(self, key, sources, inputs=None):
+    """Cache files ({cached name: source path}) under key.
+
+    inputs maps a label to the content hash of each input, and is what
+    invalidate_input() searches.
+    """
+    staging = tempfile.mkdtemp(prefix='.staging-', dir=self.cache_dir)
+    try:
+      for name, source in sources.items():
+        shutil.copy(source, os.path.join(staging, name))
+      with open(os.path.join(staging, _MANIFEST), 'w') as f:
+        json.dump({'key': key, 'files': sorted(sources), 'inputs': inputs or {}}, f, indent=1)
+      entry_dir = self._entry_dir(key)
+      if os.path.isdir(entry_dir):
+        shutil.rmtree(entry_dir)
+      os.rename(staging, entry_dir)
+    except:
+      shutil.rmtree(staging, ignore_errors=True)
+      raise
+
+  def keys(self):
+    return sorted(name for name in os.listdir(self.cache_dir)
+                  if os.path.isfile(os.path.join(self.cache_dir, name, _MANIFEST)))
+
+  def invalidate(self, key=None):
+    """Drop one entry, or every entry when key is None. Returns the number removed."""
+    keys = self.keys() if key is None else [key]
+    removed = 0
+    for entry_key in keys:
+      entry_dir = self._entry_dir(entry_key)
+      if os.path.isdir(entry_dir):
+        shutil.rmtree(entry_dir)
+        removed += 1
+    return removed
+
+  def invalidate_input(self, path):
+    """Drop every entry that was produced from the current content of the file at path."""
+    content_hash = file_hash(path)
+    removed = 0
+    for key in self.keys():
+      manifest = self._read_manifest(key)
+      if manifest is not None and content_hash in manifest['inputs'].values():
+        removed += self.invalidate(key)
+    return removed
+
+  def stats(self):
+    return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.keys())}
+
+
+class AlignmentCache(ArtifactCache):
+  """Caches XmlNoteSequence.save_to_midi output and AlignmentTool results.
+
+  Score MIDI entries are keyed on the MusicXML content; alignment entries on the
+  MusicXML content, the performance MIDI content and the aligner version.
+  """
+  def __init__(self, cache_dir, align_tool_dir=alignment.ALIGN_TOOL_DIR, use_sudo=True):
+    super(AlignmentCache, self).__init__(cache_dir)
+    self.align_tool_dir = align_tool_dir
+    self.use_sudo = use_sudo
+    self.aligner_version = aligner_version(align_tool_dir)
+
+  def ensure_score_midi(self, xml_sequence, save_path):
+    xml_hash = file_hash(xml_sequence.xml_path)
+    key = self.make_key('score_midi', xml_hash, SCORE_MIDI_VERSION)
+    if self.restore(key, {'score.mid': save_path}):
+      return
+    xml_sequence.save_to_midi(xml_sequence.notes, save_path)
+    self.store(key, {'score.mid': save_path}, inputs={'musicxml': xml_hash})
+
+  def ensure_alignment(self, xml_path, score_midi, perform_midi):
+    """Restore or produce score_fmt3x.txt, _match.txt and _corresp.txt for perform_midi."""
+    xml_hash = file_hash(xml_path)
+    perform_hash = file_hash(perform_midi)
+    key = self.make_key('alignment', xml_hash, SCORE_MIDI_VERSION, perform_hash, self.aligner_version)
+    fmt3x_path, match_path, corresp_path = alignment.output_paths(score_midi, perform_midi)
+    targets = {'score_fmt3x.txt': fmt3x_path, 'match.txt': match_path, 'corresp.txt': corresp_path}
+    if self.restore(key, targets):
+      return
+    alignment.run_aligner(score_midi, perform_midi, self.align_tool_dir, use_sudo=self.use_sudo)
+    self.store(key, targets,
+               inputs={'musicxml': xml_hash, 'perform_midi': perform_hash, 'aligner': self.aligner_version})
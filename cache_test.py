@@ -0,0 +1,85 @@
+import os
+
+import alignment
+import cache
+from alignment_test import make_corpus
+
+
+class StubSequence(object):
+  """Stands in for XmlNoteSequence: save_to_midi writes the MusicXML text and counts calls."""
+  def __init__(self, xml_path):
+    self.xml_path = xml_path
+    self.notes = []
+    self.saved = 0
+
+  def save_to_midi(self, notes, save_path):
+    self.saved += 1
+    with open(self.xml_path) as f, open(save_path, 'w') as out:
+      out.write(f.read())
+
+
+def make_cache(tmp_path, perform_names):
+  tool_dir, pairs = make_corpus(tmp_path, perform_names)
+  xml_path = os.path.join(os.path.dirname(pairs[0][0]), 'score.musicxml')
+  with open(xml_path, 'w') as f:
+    f.write('score')
+  alignment_cache = cache.AlignmentCache(str(tmp_path / 'cache'), align_tool_dir=tool_dir, use_sudo=False)
+  return alignment_cache, xml_path, pairs
+
+
+def read(path):
+  with open(path) as f:
+    return f.read()
+
+
+def test_miss_then_hit(tmp_path):
+  alignment_cache, xml_path, pairs = make_cache(tmp_path, ['a01'])
+  score_midi, perform_midi = pairs[0]
+  sequence = StubSequence(xml_path)
+  alignment_cache.ensure_score_midi(sequence, score_midi)
+  alignment_cache.ensure_alignment(xml_path, score_midi, perform_midi)
+  assert alignment_cache.stats() == {'hits': 0, 'misses': 2, 'entries': 2}
+
+  _, match_path, corresp_path = alignment.output_paths(score_midi, perform_midi)
+  first_corresp = read(corresp_path)  # the stub writes its process id here
+  for path in [score_midi, match_path, corresp_path]:
+    os.remove(path)
+  alignment_cache.ensure_score_midi(sequence, score_midi)
+  alignment_cache.ensure_alignment(xml_path, score_midi, perform_midi)
+  assert alignment_cache.stats() == {'hits': 2, 'misses': 2, 'entries': 2}
+  assert sequence.saved == 1
+  assert read(match_path) == 'a01'
+  assert read(corresp_path) == first_corresp
+  assert not [el for el in os.listdir(alignment_cache.cache_dir) if el.startswith('.staging-')]
+
+
+def test_changed_input_misses(tmp_path):
+  alignment_cache, xml_path, pairs = make_cache(tmp_path, ['a01'])
+  score_midi, perform_midi = pairs[0]
+  alignment_cache.ensure_alignment(xml_path, score_midi, perform_midi)
+  with open(perform_midi, 'w') as f:
+    f.write('a01 edited')
+  alignment_cache.ensure_alignment(xml_path, score_midi, perform_midi)
+  assert alignment_cache.stats() == {'hits': 0, 'misses': 2, 'entries': 2}
+  assert read(alignment.output_paths(score_midi, perform_midi)[1]) == 'a01 edited'
+
+
+def test_invalidate_input(tmp_path):
+  alignment_cache, xml_path, pairs = make_cache(tmp_path, ['a01', 'a02'])
+  sequence = StubSequence(xml_path)
+  alignment_cache.ensure_score_midi(sequence, pairs[0][0])
+  for score_midi, perform_midi in pairs:
+    alignment_cache.ensure_alignment(xml_path, score_midi, perform_midi)
+  assert len(alignment_cache.keys()) == 3
+
+  # only a02's alignment was produced from a02.mid
+  assert alignment_cache.invalidate_input(pairs[1][1]) == 1
+  kinds = sorted(el.split('-')[0] for el in alignment_cache.keys())
+  assert kinds == ['alignment', 'score_midi']
+  alignment_cache.ensure_alignment(xml_path, *pairs[0])
+  assert alignment_cache.hits == 1
+
+  # every entry depends on the MusicXML
+  assert alignment_cache.invalidate_input(xml_path) == 2
+  assert alignment_cache.keys() == []
+  assert alignment_cache.invalidate() == 0
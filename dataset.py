@@ -0,0 +1,231 @@
+"""Build sharded feature files from a corpus of (MusicXML, performance MIDI) pairs.
+
+  python dataset.py --data_path /dataset/chopin_cleaned --save_path ./features
+
+Every folder holding a score (musicxml_cleaned.musicxml or xml.xml) and one or more
+performance MIDI files is a piece with one item per performance. A piece's score is
+parsed, indexed and featurized once in the main process (see Piece); its performances
+are then processed in a worker pool that shares the piece, and appended to NPZ shards
+of about shard_size notes. manifest.json in save_path records finished shards and
+items, so an interrupted build resumes where the last written shard ended.
+"""
+from __future__ import division
+
+import argparse
+import json
+import ntpath
+import os
+import time
+import traceback
+from collections import OrderedDict
+from multiprocessing import Pool
+
+import numpy as np
+
+import xml_data
+import matching
+import feature
+import profiling
+from note_table import NoteTable
+
+SCORE_FILE_NAMES = ['musicxml_cleaned.musicxml', 'xml.xml']
+MANIFEST_NAME = 'manifest.json'
+
+
+def find_performance_pairs(data_path):
+  """List (xml_path, perform_midi_path) for every performance under data_path."""
+  pairs = []
+  for root, _, files in sorted(os.walk(data_path)):
+    score_names = [el for el in SCORE_FILE_NAMES if el in files]
+    if not score_names:
+      continue
+    xml_path = os.path.join(root, score_names[0])
+    for name in sorted(files):
+      if name.endswith('.mid') and name != 'score.mid':
+        pairs.append((xml_path, os.path.join(root, name)))
+  return pairs
+
+
+class Piece(object):
+  """Everything about a score that its performances share.
+
+  The MusicXML is parsed once, score.mid is written once (before any worker could race
+  on it), and the score OnsetIndex, NoteTable and PieceFeatures are built once.
+  """
+  def __init__(self, xml_path, xml_cache_dir=None):
+    self.xml_sequence = xml_data.XmlNoteSequence.load(xml_path, xml_cache_dir)
+    score_folder, _ = ntpath.split(xml_path)
+    score_midi_path = os.path.join(score_folder, 'score.mid')
+    if not os.path.isfile(score_midi_path):
+      self.xml_sequence.save_to_midi(self.xml_sequence.notes, score_midi_path)
+    self.score_index = matching.score_onset_index(self.xml_sequence)
+    self.score_table = self.xml_sequence.to_note_table()
+    self.score_features = feature.PieceFeatures(self.xml_sequence, self.score_table)
+
+  @profiling.profiled('extract')
+  def extract(self, perform_midi_path):
+    """Return (score_features, perform_features) arrays for the score-aligned notes of one performance."""
+    perform_pair = matching.PerformPair(self.xml_sequence, perform_midi_path, score_index=self.score_index)
+    score_indices, midi_indices = perform_pair.score_pair_indices()
+    perform_table = NoteTable.from_midi_notes(perform_pair.perform_notes).take(midi_indices)
+    return self.score_features.take(score_indices), feature.perform_feature_array(perform_table)
+
+
+def extract_pair_features(xml_path, perform_midi_path, xml_cache_dir=None):
+  """One-off version of Piece.extract for a single performance."""
+  return Piece(xml_path, xml_cache_dir).extract(perform_midi_path)
+
+
+_worker_piece = None
+
+
+def _init_piece_worker(piece):
+  # with the default fork start method the piece is inherited, not pickled
+  global _worker_piece
+  _worker_piece = piece
+
+
+def _process_item(item):
+  """Returns (key, features, error, profiling report of this item or None)."""
+  key, perform_midi_path = item
+  profiling.reset()
+  try:
+    features, error = _worker_piece.extract(perform_midi_path), None
+  except Exception:
+    features, error = None, traceback.format_exc()
+  return key, features, error, profiling.report() if profiling.is_enabled() else None
+
+
+class Manifest(object):
+  def __init__(self, save_path):
+    self.path = os.path.join(save_path, MANIFEST_NAME)
+    self.shards = []
+    self.completed = dict()  # item key -> shard file name
+    self.failed = dict()  # item key -> traceback of the last attempt
+    if os.path.isfile(self.path):
+      with open(self.path, 'r') as f:
+        saved = json.load(f)
+      self.shards = saved['shards']
+      self.completed = saved['completed']
+      self.failed = saved['failed']
+
+  def write(self):
+    tmp_path = self.path + '.tmp'
+    with open(tmp_path, 'w') as f:
+      json.dump({'shards': self.shards, 'completed': self.completed, 'failed': self.failed,
+                 'score_feature_keys': feature.SCORE_FEATURE_KEYS,
+                 'perform_feature_keys': feature.PERFORM_FEATURE_KEYS}, f, indent=1)
+    os.replace(tmp_path, self.path)
+
+
+class ShardWriter(object):
+  """Buffers items and writes them as shard_XXXXX.npz once shard_size notes are collected.
+
+  An item never spans two shards, so a shard can exceed shard_size by up to one item.
+  Items are marked completed in the manifest only when their shard is on disk.
+  """
+  def __init__(self, save_path, manifest, shard_size):
+    self.save_path = save_path
+    self.manifest = manifest
+    self.shard_size = shard_size
+    self._reset()
+
+  def _reset(self):
+    self.keys = []
+    self.score_features = []
+    self.perform_features = []
+    self.num_notes = 0
+
+  def add(self, key, score_features, perform_features):
+    self.keys.append(key)
+    self.score_features.append(score_features)
+    self.perform_features.append(perform_features)
+    self.num_notes += len(score_features)
+    if self.num_notes >= self.shard_size:
+      self.flush()
+
+  def flush(self):
+    if not self.keys:
+      return
+    file_name = 'shard_{:05d}.npz'.format(len(self.manifest.shards))
+    offsets = np.cumsum([0] + [len(el) for el in self.score_features]).astype(np.int64)
+    tmp_path = os.path.join(self.save_path, file_name + '.tmp.npz')
+    np.savez(tmp_path,
+             score_features=np.concatenate(self.score_features),
+             perform_features=np.concatenate(self.perform_features),
+             piece_offsets=offsets,
+             piece_keys=np.asarray(self.keys))
+    os.replace(tmp_path, os.path.join(self.save_path, file_name))
+    self.manifest.shards.append({'file': file_name, 'num_notes': int(offsets[-1]), 'keys': self.keys})
+    for key in self.keys:
+      self.manifest.completed[key] = file_name
+      self.manifest.failed.pop(key, None)
+    self.manifest.write()
+    self._reset()
+
+
+def build_dataset(data_path, save_path, num_workers=None, shard_size=100000, xml_cache_dir=None, profile_dir=None):
+  if not os.path.isdir(save_path):
+    os.makedirs(save_path)
+  if profile_dir is not None:
+    profiling.enable()
+  manifest = Manifest(save_path)
+  pieces = OrderedDict()
+  for xml_path, perform_midi_path in find_performance_pairs(data_path):
+    key = os.path.relpath(perform_midi_path, data_path)
+    if key not in manifest.completed:
+      pieces.setdefault(xml_path, []).append((key, perform_midi_path))
+  print('{} performances of {} pieces to process, {} already done'.format(
+    sum(len(el) for el in pieces.values()), len(pieces), len(manifest.completed)))
+
+  writer = ShardWriter(save_path, manifest, shard_size)
+  for xml_path, items in pieces.items():
+    profiling.reset()
+    piece_start = time.perf_counter()
+    try:
+      with profiling.span('piece'):
+        piece = Piece(xml_path, xml_cache_dir)
+    except Exception:
+      error = traceback.format_exc()
+      print('Error to process {}\n{}'.format(xml_path, error))
+      for key, _ in items:
+        manifest.failed[key] = error
+      continue
+    pool = Pool(min(num_workers or os.cpu_count(), len(items)), initializer=_init_piece_worker, initargs=(piece,))
+    try:
+      for key, features, error, item_report in pool.imap_unordered(_process_item, items):
+        if item_report is not None:
+          profiling.merge(item_report)
+        if error is not None:
+          print('Error to process {}\n{}'.format(key, error))
+          manifest.failed[key] = error
+          continue
+        writer.add(key, *features)
+    finally:
+      pool.close()
+      pool.join()
+    if profile_dir is not None:
+      piece_key = os.path.relpath(xml_path, data_path)
+      profiling.write_report(os.path.join(profile_dir, piece_key + '.json'), piece=piece_key,
+                             performances=len(items), wall_s=time.perf_counter() - piece_start)
+  writer.flush()
+  manifest.write()
+  if profile_dir is not None:
+    profiling.write_summary(profile_dir)
+  return manifest
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--data_path", default='/dataset/chopin_cleaned')
+  parser.add_argument("--save_path", default='./features')
+  parser.add_argument("--num_workers", type=int, default=None)
+  parser.add_argument("--shard_size", type=int, default=100000, help='notes per shard')
+  parser.add_argument("--xml_cache_dir", default=None)
+  parser.add_argument("--profile_dir", default=None, help='write per-piece and corpus profiling reports here')
+  args = parser.parse_args()
+
+  result = build_dataset(args.data_path, args.save_path, args.num_workers, args.shard_size, args.xml_cache_dir,
+                         args.profile_dir)
+  print('{} shards, {} performances, {} failed'.format(len(result.shards), len(result.completed),
+                                                       len(result.failed)))
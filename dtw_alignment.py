@@ -0,0 +1,234 @@
+"""In-process score-to-performance note alignment, as an alternative to AlignmentTool_v2.
+
+Score notes are grouped into chords by onset and every performed note is one step on
+the other axis, so arpeggiated or spread chords simply take several performance steps
+on the same score chord. The chord-level path is found with multi-resolution DTW
+(FastDTW): a full DTW on a heavily downsampled problem, then at each finer level a DTW
+restricted to the projected path widened by radius cells. Memory and time are linear in
+the number of notes for a fixed radius.
+
+Pairing notes by pitch inside the aligned (score chord, performance notes) groups gives
+an estimated performance time for every score chord. The final pairs come from an
+order-preserving matching per pitch against those times, banded to the onsets within
+max_time_error of each expected time; unpaired score notes are missing and unpaired
+performance notes are extra.
+"""
+from __future__ import division
+
+import numpy as np
+
+NUM_PITCHES = 128
+
+
+def _pitch_matrix(groups, pitches, num_groups):
+  matrix = np.zeros((num_groups, NUM_PITCHES), dtype=np.float32)
+  np.add.at(matrix, (groups, pitches), 1)
+  return matrix
+
+
+def _downsample(matrix):
+  if len(matrix) % 2:
+    matrix = np.concatenate([matrix, np.zeros((1, matrix.shape[1]), dtype=matrix.dtype)])
+  return matrix[0::2] + matrix[1::2]
+
+
+def _row_costs(score_row, perform, lo, hi):
+  """Share of the performed notes in perform[lo:hi] whose pitch is absent from the score chord(s)."""
+  window = perform[lo:hi]
+  present = (score_row > 0).astype(np.float32)
+  return 1.0 - (window @ present) / np.maximum(window.sum(axis=1), 1)
+
+
+def banded_dtw(score, perform, windows):
+  """DTW of score rows against perform rows inside per-row column windows.
+
+  windows is a list of (lo, hi) column ranges, one per score row, with lo and hi
+  non-decreasing, windows[0][0] == 0 and windows[-1][1] == len(perform). Steps are
+  (1, 1), (1, 0) and (0, 1). Returns the path as (rows, cols) arrays from (0, 0) to the
+  last cell.
+  """
+  run_starts = []
+  from_diag = []
+  prev_lo, prev_hi, prev_cost = 0, 0, None
+  for i, (lo, hi) in enumerate(windows):
+    costs = _row_costs(score[i], perform, lo, hi).astype(np.float64)
+    cols = np.arange(lo, hi)
+    if prev_cost is None:
+      entry = np.full(hi - lo, np.inf)
+      if lo == 0:
+        entry[0] = costs[0]
+      diag = np.zeros(hi - lo, dtype=bool)
+    else:
+      up = np.full(hi - lo, np.inf)
+      in_prev = (cols >= prev_lo) & (cols < prev_hi)
+      up[in_prev] = prev_cost[cols[in_prev] - prev_lo]
+      diag_cost = np.full(hi - lo, np.inf)
+      in_prev = (cols - 1 >= prev_lo) & (cols - 1 < prev_hi)
+      diag_cost[in_prev] = prev_cost[cols[in_prev] - 1 - prev_lo]
+      diag = diag_cost < up
+      entry = costs + np.minimum(up, diag_cost)
+    # horizontal runs: cost[j] = min over k <= j of entry[k] + sum(costs[k + 1:j + 1])
+    cumulative = np.cumsum(costs)
+    offset = entry - cumulative
+    running = np.minimum.accumulate(offset)
+    positions = np.arange(hi - lo)
+    run_start = np.maximum.accumulate(np.where(offset <= running, positions, 0))
+    prev_cost = running + cumulative
+    prev_lo, prev_hi = lo, hi
+    run_starts.append(run_start + lo)
+    from_diag.append(diag)
+
+  rows = []
+  path_cols = []
+  j = windows[-1][1] - 1
+  for i in range(len(windows) - 1, -1, -1):
+    lo = windows[i][0]
+    k = int(run_starts[i][j - lo])
+    rows.extend([i] * (j - k + 1))
+    path_cols.extend(range(j, k - 1, -1))
+    j = k - 1 if from_diag[i][k - lo] else k
+  return np.asarray(rows[::-1], dtype=np.int64), np.asarray(path_cols[::-1], dtype=np.int64)
+
+
+def _full_windows(num_rows, num_cols):
+  return [(0, num_cols)] * num_rows
+
+
+def _project_windows(rows, cols, num_rows, num_cols, radius):
+  """Windows around a path found at half resolution, widened by radius cells."""
+  lo = np.full(num_rows, num_cols, dtype=np.int64)
+  hi = np.zeros(num_rows, dtype=np.int64)
+  for row_offset in (0, 1):
+    fine_rows = np.minimum(rows * 2 + row_offset, num_rows - 1)
+    np.minimum.at(lo, fine_rows, cols * 2)
+    np.maximum.at(hi, fine_rows, np.minimum(cols * 2 + 2, num_cols))
+  lo = np.maximum(lo - radius, 0)
+  hi = np.minimum(hi + radius, num_cols)
+  # keep the windows monotone and connected
+  lo = np.minimum.accumulate(lo[::-1])[::-1]
+  hi = np.maximum.accumulate(hi)
+  lo[0] = 0
+  hi[-1] = num_cols
+  return list(zip(lo.tolist(), hi.tolist()))
+
+
+def fast_dtw(score, perform, radius=32, min_size=64):
+  if len(score) <= min_size or len(perform) <= min_size:
+    return banded_dtw(score, perform, _full_windows(len(score), len(perform)))
+  rows, cols = fast_dtw(_downsample(score), _downsample(perform), radius, min_size)
+  return banded_dtw(score, perform, _project_windows(rows, cols, len(score), len(perform), radius))
+
+
+def align_notes(score_onsets, score_pitches, perform_onsets, perform_pitches, radius=32, max_time_error=0.25):
+  """Pair score notes with performed notes.
+
+  Returns perform_to_score, an array with the matched score note index for every
+  performed note or -1 for extra notes; score notes that never appear in it are missing.
+  """
+  score_onsets = np.asarray(score_onsets, dtype=np.float64)
+  score_pitches = np.asarray(score_pitches, dtype=np.int64)
+  perform_onsets = np.asarray(perform_onsets, dtype=np.float64)
+  perform_pitches = np.asarray(perform_pitches, dtype=np.int64)
+  perform_to_score = np.full(len(perform_onsets), -1, dtype=np.int64)
+  if len(score_onsets) == 0 or len(perform_onsets) == 0:
+    return perform_to_score
+
+  score_order = np.argsort(score_onsets, kind='stable')
+  perform_order = np.argsort(perform_onsets, kind='stable')
+  sorted_onsets = score_onsets[score_order]
+  chord_of = np.concatenate([[0], np.cumsum(np.diff(sorted_onsets) > 1e-6)])
+  num_chords = int(chord_of[-1]) + 1
+  score_matrix = _pitch_matrix(chord_of, score_pitches[score_order], num_chords)
+  perform_matrix = _pitch_matrix(np.arange(len(perform_order)), perform_pitches[perform_order], len(perform_order))
+  path_chords, path_steps = fast_dtw(score_matrix, perform_matrix, radius)
+
+  # pitch pairing inside each aligned chord; path cells are sorted by chord, then step
+  chord_starts = np.searchsorted(chord_of, np.arange(num_chords + 1))
+  score_used = np.zeros(len(score_onsets), dtype=bool)
+  chord_times = np.full(num_chords, np.nan)
+  cell = 0
+  for chord in range(num_chords):
+    chord_notes = score_order[chord_starts[chord]:chord_starts[chord + 1]]
+    matched_onsets = []
+    while cell < len(path_chords) and path_chords[cell] == chord:
+      perform_idx = perform_order[path_steps[cell]]
+      cell += 1
+      if perform_to_score[perform_idx] >= 0:
+        continue
+      for score_idx in chord_notes:
+        if not score_used[score_idx] and score_pitches[score_idx] == perform_pitches[perform_idx]:
+          perform_to_score[perform_idx] = score_idx
+          score_used[score_idx] = True
+          matched_onsets.append(perform_onsets[perform_idx])
+          break
+    if matched_onsets:
+      chord_times[chord] = np.median(matched_onsets)
+
+  # the DTW pairing fixes the time warp; notes are then re-paired per pitch against it
+  known = ~np.isnan(chord_times)
+  if not known.any():
+    return perform_to_score
+  chord_times = np.interp(np.arange(num_chords), np.nonzero(known)[0], chord_times[known])
+  expected = np.empty(len(score_onsets))
+  expected[score_order] = chord_times[chord_of]
+  perform_to_score[:] = -1
+  for pitch in np.unique(score_pitches):
+    score_notes = score_order[score_pitches[score_order] == pitch]
+    perform_notes = perform_order[perform_pitches[perform_order] == pitch]
+    if len(perform_notes) == 0:
+      continue
+    for score_idx, perform_idx in _pair_in_order(expected[score_notes], perform_onsets[perform_notes],
+                                                 max_time_error):
+      perform_to_score[perform_notes[perform_idx]] = score_notes[score_idx]
+  return perform_to_score
+
+
+def _pair_in_order(expected, onsets, max_time_error):
+  """Order-preserving pairing of two sorted time lists minimizing |expected - onset|.
+
+  Leaving a note unpaired costs max_time_error / 2, and pairs further apart than
+  max_time_error are not allowed. Returns (expected index, onset index) pairs.
+
+  The DP runs over the number of onsets used so far, and row i only keeps the onsets
+  within max_time_error of expected[i] (widened so the windows never move back); past
+  the window nothing can change, so time and memory are linear in the number of
+  allowed pairs rather than len(expected) x len(onsets).
+  """
+  gap = max_time_error / 2
+  num_rows = len(expected)
+  lo = np.searchsorted(onsets, np.asarray(expected) - max_time_error, side='left')
+  hi = np.searchsorted(onsets, np.asarray(expected) + max_time_error, side='right')
+  lo = np.minimum.accumulate(lo[::-1])[::-1]
+  hi = np.maximum(np.maximum.accumulate(hi), lo)
+  # gain[i][j] = best total of (2 * gap - pair error) over rows <= i and the first lo[i] + j onsets;
+  # the cost of a pairing is gap * (num_rows + len(onsets)) minus its gain
+  gains = []
+  moves = []  # per row: 0 skip onset, 1 pair, 2 skip expected
+  prev, prev_lo, prev_hi = np.zeros(1), 0, 0
+  for i in range(num_rows):
+    positions = np.arange(lo[i], hi[i] + 1)
+    above = prev[np.minimum(positions, prev_hi) - prev_lo]
+    errors = np.abs(expected[i] - onsets[lo[i]:hi[i]])
+    paired = np.full(len(positions), -np.inf)
+    paired[1:] = above[:-1] + np.where(errors <= max_time_error, 2 * gap - errors, -np.inf)
+    entry = np.maximum(above, paired)
+    current = np.maximum.accumulate(entry)
+    row_moves = np.where(paired > above, 1, 2).astype(np.int8)
+    row_moves[1:][current[1:] > entry[1:]] = 0
+    gains.append(current)
+    moves.append(row_moves)
+    prev, prev_lo, prev_hi = current, lo[i], hi[i]
+  pairs = []
+  i, j = num_rows - 1, len(onsets)
+  while i >= 0:
+    j = min(j, hi[i])
+    move = moves[i][j - lo[i]]
+    if move == 0:
+      j -= 1
+    elif move == 1:
+      pairs.append((i, j - 1))
+      i -= 1
+      j -= 1
+    else:
+      i -= 1
+  return pairs[::-1]
@@ -0,0 +1,56 @@
+import random
+
+import numpy as np
+
+import dtw_alignment
+
+
+def synthetic_piece(num_chords, seed):
+  rng = random.Random(seed)
+  score_onsets, score_pitches = [], []
+  for chord in range(num_chords):
+    for pitch in rng.sample(range(40, 90), rng.choice([1, 1, 2, 3])):
+      score_onsets.append(chord * 0.25)
+      score_pitches.append(pitch)
+  return np.asarray(score_onsets), np.asarray(score_pitches)
+
+
+def perform(score_onsets, score_pitches, seed, tempo=1.3):
+  """Slower, rubato performance with spread chords; returns onsets, pitches and the true score index."""
+  rng = random.Random(seed)
+  onsets = score_onsets * tempo + np.cumsum(np.asarray([rng.uniform(-0.01, 0.02) for _ in score_onsets]))
+  onsets = onsets + np.asarray([rng.uniform(0, 0.03) for _ in score_onsets])
+  order = np.argsort(onsets, kind='stable')
+  return onsets[order], score_pitches[order], order
+
+
+def test_recovers_clean_performance():
+  score_onsets, score_pitches = synthetic_piece(600, 0)
+  onsets, pitches, truth = perform(score_onsets, score_pitches, 1)
+  perform_to_score = dtw_alignment.align_notes(score_onsets, score_pitches, onsets, pitches)
+  assert (perform_to_score == truth).mean() > 0.99
+
+
+def test_missing_and_extra_notes():
+  score_onsets, score_pitches = synthetic_piece(400, 2)
+  onsets, pitches, truth = perform(score_onsets, score_pitches, 3)
+  keep = np.ones(len(onsets), dtype=bool)
+  keep[::37] = False  # missed notes
+  extra_onsets = onsets[::53] + 0.005
+  extra_pitches = np.full(len(extra_onsets), 100)  # no score note has this pitch
+  onsets = np.concatenate([onsets[keep], extra_onsets])
+  pitches = np.concatenate([pitches[keep], extra_pitches])
+  truth = np.concatenate([truth[keep], np.full(len(extra_onsets), -1)])
+  perform_to_score = dtw_alignment.align_notes(score_onsets, score_pitches, onsets, pitches)
+  assert (perform_to_score[pitches == 100] == -1).all()
+  assert (perform_to_score == truth).mean() > 0.98
+
+
+def test_repeated_pitch_pairing_is_banded():
+  rng = random.Random(4)
+  expected = np.arange(5000) * 0.1
+  onsets = np.sort(expected + np.asarray([rng.uniform(-0.04, 0.04) for _ in expected]))
+  keep = np.ones(len(onsets), dtype=bool)
+  keep[::11] = False
+  pairs = dtw_alignment._pair_in_order(expected, onsets[keep], 0.25)
+  assert pairs == [(i, j) for j, i in enumerate(np.nonzero(keep)[0].tolist())]
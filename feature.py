@@ -7,6 +7,8 @@ import utils
 import numpy as np
 from musicXML_parser.mxp.notations import Notations
 import constants
+import profiling
+from note_table import NoteTable
 
 if __name__ == '__main__':
   parser = argparse.ArgumentParser()
@@ -42,60 +44,85 @@ class NoteFeatures(object):
                        notation.is_tenuto]).astype(int)
 
   def dynamics_to_category(self):
-    dynamic_embed_table = constants.dynamic_table()
-    dynamic_words = utils.direction_words_flatten(self.score_note.dynamic)
-    return dynamic_embedding(dynamic_words, dynamic_embed_table)
+    return self.score_note.dynamic_context.vector(DYNAMIC_EMBEDDER)
 
   def tempo_to_category(self):
-    tempo_embed_table = constants.tempo_table()
-    tempo_words = utils.direction_words_flatten(self.score_note.tempo)
-    return dynamic_embedding(tempo_words, tempo_embed_table, len_vec=3)
+    return self.score_note.tempo_context.vector(TEMPO_EMBEDDER)
 
 
 class ScoreFeatures(object):
+  @profiling.profiled('features.score')
   def __init__(self, xml_sequence, score_pairs):
     self.xml_sequence = xml_sequence
 
     self.measure_positions = [el.start_xml_position for el in self.xml_sequence.xml_doc.parts[0].measures]
     self.time_signatures = self.xml_sequence.meta.time_signatures
+    self.meter_map = MeterMap(self.measure_positions, self.time_signatures)
     self.note_features = [NoteFeatures(el.score_note, el.midi_note) for el in score_pairs]
+    self.note_table = NoteTable.from_xml_notes([el.score_note for el in self.note_features])
     self.add_beat_info()
     self.add_ioi_info()
 
   def add_beat_info(self):
-    for note_feature in self.note_features:
-      measure_number = note_feature.score_note.measure_number
-      measure_start = self.measure_positions[measure_number]
-      current_time_sig_idx = utils.find_le_idx([el.xml_position for el in self.time_signatures], measure_start)
-      current_time_sig = self.time_signatures[current_time_sig_idx]
-      beat_length = (current_time_sig.state.divisions / current_time_sig.denominator * 4)
-      note_feature.note_length = note_feature.score_note.note_duration.duration / beat_length
-      note_feature.beat_location = (note_feature.score_note.note_duration.xml_position - measure_start) / beat_length
+    table = self.note_table
+    self.note_lengths, self.beat_locations = self.meter_map.beat_info(table.xml_position, table.duration,
+                                                                      table.measure)
+    for note_feature, note_length, beat_location in zip(self.note_features, self.note_lengths.tolist(),
+                                                        self.beat_locations.tolist()):
+      note_feature.note_length = note_length
+      note_feature.beat_location = beat_location
 
   def add_ioi_info(self):
-    concurrent_notes = []
-    last_position = self.note_features[0].score_note.note_duration.xml_position
-    for n in range(len(self.note_features)):
-      current_feature = self.note_features[n]
-      current_position = current_feature.score_note.note_duration.xml_position
-      if last_position == current_position:
-        concurrent_notes.append(self.note_features[n])
-      else:
-        last_position = current_position
-        last_feature = concurrent_notes[-1]
-        if last_feature.score_note.measure_number == current_feature.score_note.measure_number:
-          for note in concurrent_notes:
-            note.score_ioi = current_feature.beat_location - last_feature.beat_location
-        else:
-          for note in concurrent_notes:
-            # TODO: what if time signature change?
-            note.score_ioi = (last_feature.score_note.state.time_signature.numerator *
-                              (current_feature.score_note.measure_number - last_feature.score_note.measure_number)
-                              + current_feature.beat_location
-                              - last_feature.beat_location)
-        concurrent_notes = [current_feature]
-
-
+    table = self.note_table
+    self.score_iois = self.meter_map.score_ioi(table.xml_position, table.measure, self.beat_locations)
+    for note_feature, score_ioi in zip(self.note_features, self.score_iois.tolist()):
+      note_feature.score_ioi = None if np.isnan(score_ioi) else score_ioi
+
+
+class MeterMap(object):
+  """Measure start positions and the time signature in force in each measure, as arrays.
+
+  A beat is one 1/denominator note of the measure's time signature, and
+  measure_beat_starts[m] counts the beats of all measures before m, so beat distances
+  between notes stay correct across meter changes.
+  """
+  def __init__(self, measure_positions, time_signatures):
+    self.measure_positions = np.asarray(measure_positions, dtype=np.float64)
+    time_sig_positions = np.asarray([el.xml_position for el in time_signatures], dtype=np.float64)
+    time_sig_idx = np.searchsorted(time_sig_positions, self.measure_positions, side='right') - 1
+    time_sig_idx = np.maximum(time_sig_idx, 0)
+    beat_lengths = np.asarray([el.state.divisions / el.denominator * 4 for el in time_signatures])
+    numerators = np.asarray([el.numerator for el in time_signatures], dtype=np.float64)
+    self.beat_lengths = beat_lengths[time_sig_idx]
+    self.measure_beat_starts = np.concatenate([[0.0], np.cumsum(numerators[time_sig_idx])])
+
+  def beat_info(self, xml_positions, durations, measures):
+    """Return (note_length, beat_location) arrays, both in beats."""
+    beat_lengths = self.beat_lengths[measures]
+    note_lengths = durations / beat_lengths
+    beat_locations = (xml_positions - self.measure_positions[measures]) / beat_lengths
+    return note_lengths, beat_locations
+
+  def score_ioi(self, xml_positions, measures, beat_locations):
+    """Beats from each onset group to the next one, NaN for the last group.
+
+    Notes in a run of equal xml_position form one onset group and share its IOI, measured
+    from the group's last note to the first note of the following group.
+    """
+    num_notes = len(xml_positions)
+    iois = np.full(num_notes, np.nan)
+    if num_notes == 0:
+      return iois
+    new_onset = np.concatenate([[True], xml_positions[1:] != xml_positions[:-1]])
+    group_starts = np.nonzero(new_onset)[0]
+    last_of_group = group_starts[1:] - 1
+    next_first = group_starts[1:]
+    group_iois = (self.measure_beat_starts[measures[next_first]] - self.measure_beat_starts[measures[last_of_group]]
+                  + beat_locations[next_first] - beat_locations[last_of_group])
+    group_ids = np.cumsum(new_onset) - 1
+    has_next = group_ids < len(group_starts) - 1
+    iois[has_next] = group_iois[group_ids[has_next]]
+    return iois
 
 
 '''
@@ -147,6 +174,156 @@ def dynamic_embedding(dynamic_word, embed_table, len_vec=4):
   return dynamic_vector
 
 
+class DirectionEmbedder(object):
+  """dynamic_embedding() compiled for one EmbeddingTable.
+
+  Keyword positions are hashed once and the substring pass runs over a single
+  KeywordAutomaton, so a word string is embedded in one scan. Results are cached
+  per string; a piece only has a few hundred distinct direction strings.
+  """
+  def __init__(self, embed_table, len_vec=4):
+    self.len_vec = len_vec
+    self.entries = [(el.vector_index, el.value) for el in embed_table.embed_key]
+    self.first_index = dict()
+    for index, key in enumerate(embed_table.keywords):
+      self.first_index.setdefault(key, index)
+    # payload: (position in the table, index the keyword resolves to), applied in table order
+    self.automaton = utils.KeywordAutomaton([(key, (index, self.first_index[key]))
+                                             for index, key in enumerate(embed_table.keywords)
+                                             if isinstance(key, str) and len(key) > 2])
+    self.cache = dict()
+
+  def __call__(self, dynamic_word):
+    if dynamic_word is None:
+      return self._default_vector()
+    vector = self.cache.get(dynamic_word)
+    if vector is None:
+      vector = self._embed(dynamic_word)
+      self.cache[dynamic_word] = vector
+    return list(vector)
+
+  def _default_vector(self):
+    vector = [0] * self.len_vec
+    vector[0] = 0.5
+    return vector
+
+  def _embed(self, dynamic_word):
+    vector = self._default_vector()
+    index = self.first_index.get(dynamic_word)
+    if index is not None:
+      vec_idx, value = self.entries[index]
+      vector[vec_idx] = value
+
+    for w in dynamic_word.replace(',', ' ').replace('.', ' ').split(' '):
+      index = self.first_index.get(w.lower())
+      if index:  # like dynamic_embedding, a match on the first keyword is ignored here
+        vec_idx, value = self.entries[index]
+        vector[vec_idx] = value
+
+    for _, index in sorted(self.automaton.find_all(dynamic_word)):
+      vec_idx, value = self.entries[index]
+      vector[vec_idx] = value
+    return vector
+
+
+DYNAMIC_EMBEDDER = DirectionEmbedder(constants.dynamic_table())
+TEMPO_EMBEDDER = DirectionEmbedder(constants.tempo_table(), len_vec=3)
+
+
+SCORE_FEATURE_KEYS = ['pitch', 'note_length', 'beat_location', 'score_ioi',
+                      'accent', 'fermata', 'staccato', 'tenuto',
+                      'dynamic_abs', 'dynamic_rel', 'dynamic_accent', 'dynamic_character',
+                      'tempo_abs', 'tempo_rel', 'tempo_change']
+
+PERFORM_FEATURE_KEYS = ['onset', 'duration', 'velocity']
+
+
+SCORE_IOI_COLUMN = SCORE_FEATURE_KEYS.index('score_ioi')
+
+
+def _stack_score_features(pitches, note_lengths, beat_locations, score_iois, note_features):
+  columns = [np.asarray(pitches, dtype=np.float32)[:, None],
+             note_lengths[:, None],
+             beat_locations[:, None],
+             score_iois[:, None],
+             np.asarray([el.notation for el in note_features], dtype=np.float32).reshape(-1, 4),
+             np.asarray([el.dynamic for el in note_features], dtype=np.float32).reshape(-1, 4),
+             np.asarray([el.tempo for el in note_features], dtype=np.float32).reshape(-1, 3)]
+  return np.concatenate(columns, axis=1).astype(np.float32)
+
+
+def score_feature_array(score_features):
+  """Stack a ScoreFeatures into a (notes, len(SCORE_FEATURE_KEYS)) float32 array.
+
+  score_ioi of the last onset group, which has no following onset, is NaN.
+  """
+  return _stack_score_features(score_features.note_table.pitch, score_features.note_lengths,
+                               score_features.beat_locations, score_features.score_iois,
+                               score_features.note_features)
+
+
+class PieceFeatures(object):
+  """Score-only features of every note in an XmlNoteSequence, computed once per piece.
+
+  take() gives the same rows as score_feature_array(ScoreFeatures(xml_sequence, score_pairs))
+  for any performance of the piece. Only score_ioi depends on which notes a performance
+  matched, and it is recomputed from the shared beat locations.
+
+  With lazy=True only the per-note arrays (note table, beat locations) are built up front,
+  and feature rows are computed by take() and window() for the notes asked for.
+  """
+  @profiling.profiled('features.piece')
+  def __init__(self, xml_sequence, note_table=None, lazy=False):
+    measure_positions = [el.start_xml_position for el in xml_sequence.xml_doc.parts[0].measures]
+    self.meter_map = MeterMap(measure_positions, xml_sequence.meta.time_signatures)
+    self.note_table = note_table if note_table is not None else xml_sequence.to_note_table()
+    table = self.note_table
+    self.note_lengths, self.beat_locations = self.meter_map.beat_info(table.xml_position, table.duration,
+                                                                      table.measure)
+    self.notes = xml_sequence.notes
+    self._score_iois = None
+    self.features = None
+    if not lazy:
+      self.features = self._feature_rows(np.arange(len(table)))
+
+  def __len__(self):
+    return len(self.note_table)
+
+  def _feature_rows(self, indices):
+    """Feature rows of notes[indices] with NaN score_ioi."""
+    if self.features is not None:
+      return self.features[indices]
+    table = self.note_table
+    note_features = [NoteFeatures(self.notes[el], None) for el in indices.tolist()]
+    return _stack_score_features(table.pitch[indices], self.note_lengths[indices], self.beat_locations[indices],
+                                 np.full(len(indices), np.nan), note_features)
+
+  @profiling.profiled('features.take')
+  def take(self, score_note_indices):
+    """Feature rows for xml_sequence.notes[score_note_indices], in that order."""
+    score_note_indices = np.asarray(score_note_indices, dtype=np.int64)
+    features = self._feature_rows(score_note_indices)
+    features[:, SCORE_IOI_COLUMN] = self.meter_map.score_ioi(self.note_table.xml_position[score_note_indices],
+                                                             self.note_table.measure[score_note_indices],
+                                                             self.beat_locations[score_note_indices])
+    return features
+
+  def window(self, start, end):
+    """take(np.arange(len(self)))[start:end], computing only those rows."""
+    if self._score_iois is None:
+      table = self.note_table
+      self._score_iois = self.meter_map.score_ioi(table.xml_position, table.measure, self.beat_locations)
+    features = self._feature_rows(np.arange(start, min(end, len(self))))
+    features[:, SCORE_IOI_COLUMN] = self._score_iois[start:end]
+    return features
+
+
+def perform_feature_array(perform_table):
+  """Onset and duration (seconds) and velocity of performed notes; NaN rows for missing notes."""
+  return np.stack([perform_table.time_position, perform_table.seconds, perform_table.velocity],
+                  axis=1).astype(np.float32)
+
+
 def deviation_tempo(xml_sequence, perform_pair):
   pass
 
@@ -0,0 +1,143 @@
+"""Feature store: the corpus as a few flat .npy arrays opened with memory mapping.
+
+  python feature_store.py --shard_path ./features --store_path ./feature_store
+
+A store directory holds
+  score_features.npy    float32 (total notes, len(feature.SCORE_FEATURE_KEYS))
+  perform_features.npy  float32 (total notes, len(feature.PERFORM_FEATURE_KEYS))
+  piece_offsets.npy     int64 (pieces + 1,); piece i is rows piece_offsets[i]:piece_offsets[i + 1]
+  meta.json             piece keys and feature column names
+It is built once from the shards written by dataset.py. Opening a store reads only
+meta.json and the offsets, and the OS pages feature rows in on demand, so any number of
+DataLoader workers share one copy through the page cache.
+"""
+from __future__ import division
+
+import argparse
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+SCORE_FEATURES = 'score_features.npy'
+PERFORM_FEATURES = 'perform_features.npy'
+PIECE_OFFSETS = 'piece_offsets.npy'
+META = 'meta.json'
+
+
+def build_feature_store(shard_path, store_path):
+  """Concatenate the shards listed in shard_path/manifest.json into a store at store_path.
+
+  Shards are copied one at a time into preallocated memory-mapped arrays, so memory use
+  is bounded by the largest shard. The store is written to a temporary directory and
+  renamed into place.
+  """
+  with open(os.path.join(shard_path, 'manifest.json'), 'r') as f:
+    manifest = json.load(f)
+  shards = manifest['shards']
+  if not shards:
+    raise ValueError('no shards in {}'.format(shard_path))
+  num_notes = sum(el['num_notes'] for el in shards)
+  with np.load(os.path.join(shard_path, shards[0]['file'])) as first:
+    score_dim = first['score_features'].shape[1]
+    perform_dim = first['perform_features'].shape[1]
+
+  store_path = os.path.abspath(store_path)
+  staging = tempfile.mkdtemp(prefix='.staging-', dir=os.path.dirname(store_path))
+  try:
+    score_features = np.lib.format.open_memmap(os.path.join(staging, SCORE_FEATURES), mode='w+',
+                                               dtype=np.float32, shape=(num_notes, score_dim))
+    perform_features = np.lib.format.open_memmap(os.path.join(staging, PERFORM_FEATURES), mode='w+',
+                                                 dtype=np.float32, shape=(num_notes, perform_dim))
+    piece_offsets = [0]
+    piece_keys = []
+    for shard in shards:
+      start = piece_offsets[-1]
+      with np.load(os.path.join(shard_path, shard['file'])) as data:
+        end = start + len(data['score_features'])
+        score_features[start:end] = data['score_features']
+        perform_features[start:end] = data['perform_features']
+        piece_offsets.extend((start + data['piece_offsets'][1:]).tolist())
+        piece_keys.extend(data['piece_keys'].tolist())
+    score_features.flush()
+    perform_features.flush()
+    del score_features, perform_features
+    np.save(os.path.join(staging, PIECE_OFFSETS), np.asarray(piece_offsets, dtype=np.int64))
+    with open(os.path.join(staging, META), 'w') as f:
+      json.dump({'piece_keys': piece_keys,
+                 'score_feature_keys': manifest['score_feature_keys'],
+                 'perform_feature_keys': manifest['perform_feature_keys']}, f, indent=1)
+    if os.path.isdir(store_path):
+      shutil.rmtree(store_path)
+    os.rename(staging, store_path)
+  except:
+    shutil.rmtree(staging, ignore_errors=True)
+    raise
+  return FeatureStore(store_path)
+
+
+class FeatureStore(object):
+  """Read side of a store. Feature arrays are memory-mapped copy-on-write.
+
+  Slices are views into the mapping: nothing is read from disk until the rows are
+  touched, and writing to a slice never changes the files.
+  """
+  def __init__(self, store_path):
+    self.store_path = store_path
+    with open(os.path.join(store_path, META), 'r') as f:
+      meta = json.load(f)
+    self.piece_keys = meta['piece_keys']
+    self.score_feature_keys = meta['score_feature_keys']
+    self.perform_feature_keys = meta['perform_feature_keys']
+    self.piece_offsets = np.load(os.path.join(store_path, PIECE_OFFSETS))
+    self.score_features = np.load(os.path.join(store_path, SCORE_FEATURES), mmap_mode='c')
+    self.perform_features = np.load(os.path.join(store_path, PERFORM_FEATURES), mmap_mode='c')
+
+  def __len__(self):
+    return len(self.piece_keys)
+
+  @property
+  def num_notes(self):
+    return int(self.piece_offsets[-1])
+
+  @property
+  def piece_lengths(self):
+    return np.diff(self.piece_offsets)
+
+  def piece(self, index):
+    """(score_features, perform_features) views of one piece."""
+    start, end = self.piece_offsets[index], self.piece_offsets[index + 1]
+    return self.score_features[start:end], self.perform_features[start:end]
+
+  def window_bounds(self, window_size, hop_size=None):
+    """Global (start, end) rows of every window of window_size notes inside a piece.
+
+    Windows start every hop_size notes (default window_size), plus one that ends at the
+    piece end so the tail is covered, and never cross piece boundaries. A piece shorter
+    than window_size gives one shorter window.
+    """
+    hop_size = hop_size or window_size
+    starts = []
+    ends = []
+    for start, end in zip(self.piece_offsets[:-1].tolist(), self.piece_offsets[1:].tolist()):
+      if end == start:
+        continue
+      last_start = max(end - window_size, start)
+      piece_starts = list(range(start, last_start + 1, hop_size))
+      if piece_starts[-1] != last_start:
+        piece_starts.append(last_start)
+      starts.extend(piece_starts)
+      ends.extend(min(el + window_size, end) for el in piece_starts)
+    return np.asarray(starts, dtype=np.int64), np.asarray(ends, dtype=np.int64)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--shard_path", default='./features')
+  parser.add_argument("--store_path", default='./feature_store')
+  args = parser.parse_args()
+
+  store = build_feature_store(args.shard_path, args.store_path)
+  print('{} pieces, {} notes'.format(len(store), store.num_notes))
@@ -0,0 +1,56 @@
+import numpy as np
+
+import dataset
+import feature
+import feature_store
+
+PIECE_LENGTHS = [('a', 5), ('b', 0), ('c', 3), ('d', 4), ('e', 2)]
+
+
+def write_shards(shard_path, shard_size=4):
+  """Items whose score feature rows hold their corpus-wide row number; returns the expected offsets."""
+  manifest = dataset.Manifest(shard_path)
+  writer = dataset.ShardWriter(shard_path, manifest, shard_size)
+  offsets = [0]
+  for key, length in PIECE_LENGTHS:
+    rows = np.arange(offsets[-1], offsets[-1] + length, dtype=np.float32)
+    score_features = np.repeat(rows[:, None], len(feature.SCORE_FEATURE_KEYS), axis=1)
+    perform_features = -np.repeat(rows[:, None], len(feature.PERFORM_FEATURE_KEYS), axis=1)
+    writer.add(key, score_features, perform_features)
+    offsets.append(offsets[-1] + length)
+  writer.flush()
+  return manifest, offsets
+
+
+def test_build_from_shards(tmp_path):
+  manifest, offsets = write_shards(str(tmp_path))
+  assert [el['keys'] for el in manifest.shards] == [['a'], ['b', 'c', 'd'], ['e']]
+
+  store = feature_store.build_feature_store(str(tmp_path), str(tmp_path / 'store'))
+  assert len(store) == len(PIECE_LENGTHS) and store.num_notes == offsets[-1]
+  assert store.piece_keys == [el[0] for el in PIECE_LENGTHS]
+  assert store.piece_offsets.tolist() == offsets
+  assert store.piece_lengths.tolist() == [el[1] for el in PIECE_LENGTHS]
+  assert store.score_feature_keys == feature.SCORE_FEATURE_KEYS
+  assert store.perform_feature_keys == feature.PERFORM_FEATURE_KEYS
+  assert store.score_features.shape == (offsets[-1], len(feature.SCORE_FEATURE_KEYS))
+
+  for index in range(len(store)):
+    score_features, perform_features = store.piece(index)
+    rows = list(range(offsets[index], offsets[index + 1]))
+    assert score_features[:, 0].tolist() == rows and perform_features[:, -1].tolist() == [-el for el in rows]
+  # copy-on-write: writing to a view never reaches the files
+  store.piece(0)[0][:] = 100
+  assert feature_store.FeatureStore(str(tmp_path / 'store')).score_features[0, 0] == 0
+
+
+def test_window_bounds(tmp_path):
+  write_shards(str(tmp_path))
+  store = feature_store.build_feature_store(str(tmp_path), str(tmp_path / 'store'))
+  # pieces: a 0:5, b empty, c 5:8, d 8:12, e 12:14
+  starts, ends = store.window_bounds(3)
+  assert list(zip(starts.tolist(), ends.tolist())) == [(0, 3), (2, 5), (5, 8), (8, 11), (9, 12), (12, 14)]
+  starts, ends = store.window_bounds(3, hop_size=1)
+  assert list(zip(starts.tolist(), ends.tolist())) == [(0, 3), (1, 4), (2, 5), (5, 8), (8, 11), (9, 12), (12, 14)]
+  starts, ends = store.window_bounds(4, hop_size=3)
+  assert list(zip(starts.tolist(), ends.tolist())) == [(0, 4), (1, 5), (5, 8), (8, 12), (12, 14)]
@@ -0,0 +1,81 @@
+import random
+import types
+
+import numpy as np
+
+import feature
+
+DIVISIONS = 4  # per quarter note
+
+
+def time_signature(xml_position, numerator, denominator):
+  return types.SimpleNamespace(xml_position=xml_position, numerator=numerator, denominator=denominator,
+                               state=types.SimpleNamespace(divisions=DIVISIONS))
+
+
+def reference_score_ioi(xml_positions, measures, beat_locations, numerators):
+  """ScoreFeatures.add_ioi_info before MeterMap: whole measures count the last note's numerator."""
+  iois = [None] * len(xml_positions)
+  concurrent = []
+  last_position = xml_positions[0]
+  for n in range(len(xml_positions)):
+    if xml_positions[n] == last_position:
+      concurrent.append(n)
+      continue
+    last_position = xml_positions[n]
+    last = concurrent[-1]
+    ioi = beat_locations[n] - beat_locations[last]
+    if measures[last] != measures[n]:
+      ioi += numerators[last] * (measures[n] - measures[last])
+    for m in concurrent:
+      iois[m] = ioi
+    concurrent = [n]
+  return iois
+
+
+def test_meter_change_with_pickup():
+  # pickup of one quarter, two bars of 3/4, two bars of 6/8
+  measure_positions = [0, 4, 16, 28, 40]
+  meter_map = feature.MeterMap(measure_positions, [time_signature(0, 3, 4), time_signature(28, 6, 8)])
+  xml_positions = np.asarray([0, 4, 4, 12, 24, 28, 34, 38, 40])
+  durations = np.asarray([4, 8, 8, 4, 4, 6, 4, 2, 12])
+  measures = np.asarray([0, 1, 1, 1, 2, 3, 3, 3, 4])
+
+  note_lengths, beat_locations = meter_map.beat_info(xml_positions, durations, measures)
+  assert note_lengths.tolist() == [1, 2, 2, 1, 1, 3, 2, 1, 6]
+  assert beat_locations.tolist() == [0, 0, 0, 2, 2, 0, 3, 5, 0]
+
+  iois = meter_map.score_ioi(xml_positions, measures, beat_locations)
+  # like the old formula, the pickup counts as a whole 3/4 bar; the 3/4 -> 6/8 barline
+  # counts the 3 beats of the crossed 3/4 bar, and the 6/8 barline its 6 eighths
+  assert iois[:-1].tolist() == [3, 2, 2, 3, 1, 3, 2, 1]
+  assert np.isnan(iois[-1])
+
+
+def test_ioi_spanning_several_meters():
+  measure_positions = [0, 12, 20, 32, 48]  # 3/4, 2/4, 3/4, 4/4
+  meter_map = feature.MeterMap(measure_positions, [time_signature(0, 3, 4), time_signature(12, 2, 4),
+                                                   time_signature(20, 3, 4), time_signature(32, 4, 4)])
+  xml_positions = np.asarray([8, 36])
+  measures = np.asarray([0, 3])
+  _, beat_locations = meter_map.beat_info(xml_positions, np.asarray([4, 4]), measures)
+  iois = meter_map.score_ioi(xml_positions, measures, beat_locations)
+  assert iois[0] == (3 + 2 + 3) + 1 - 2
+
+
+def test_matches_old_formula_without_meter_change():
+  rng = random.Random(0)
+  for numerator, denominator in [(4, 4), (3, 4), (6, 8), (2, 2)]:
+    measure_length = DIVISIONS * 4 * numerator // denominator
+    measure_positions = [0, DIVISIONS] + [DIVISIONS + m * measure_length for m in range(1, 30)]  # pickup
+    meter_map = feature.MeterMap(measure_positions, [time_signature(0, numerator, denominator)])
+    positions = sorted(rng.randrange(measure_positions[-1]) for _ in range(200))
+    xml_positions = np.asarray([el for el in positions for _ in range(rng.choice([1, 1, 2, 3]))])
+    measures = np.searchsorted(measure_positions, xml_positions, side='right') - 1
+    _, beat_locations = meter_map.beat_info(xml_positions, np.ones(len(xml_positions)), measures)
+
+    iois = meter_map.score_ioi(xml_positions, measures, beat_locations)
+    expected = reference_score_ioi(xml_positions.tolist(), measures.tolist(), beat_locations.tolist(),
+                                   [numerator] * len(xml_positions))
+    # the last onset group has no IOI in either
+    np.testing.assert_allclose(iois, [np.nan if el is None else el for el in expected])
@@ -0,0 +1,168 @@
+"""Rendering performances of MusicXML scores with a trained model, on CPU.
+
+  python inference.py --model_path model.pt --save_dir ./rendered examples/schumann/musicxml_cleaned.musicxml
+"""
+from __future__ import division
+
+import argparse
+import copy
+import os
+import time
+
+import numpy as np
+import torch
+
+import xml_data
+import feature
+
+
+class InferenceReport(object):
+  def __init__(self, xml_path, num_notes, num_windows, feature_seconds, model_seconds, render_seconds):
+    self.xml_path = xml_path
+    self.num_notes = num_notes
+    self.num_windows = num_windows
+    self.feature_seconds = feature_seconds
+    self.model_seconds = model_seconds
+    self.render_seconds = render_seconds
+
+  @property
+  def latency(self):
+    return self.feature_seconds + self.model_seconds + self.render_seconds
+
+  @property
+  def notes_per_second(self):
+    return self.num_notes / max(self.latency, 1e-9)
+
+  def __repr__(self):
+    return '{}: {} notes, {} windows, {:.3f}s (features {:.3f}s, model {:.3f}s, render {:.3f}s), {:.0f} notes/s'.format(
+      self.xml_path, self.num_notes, self.num_windows, self.latency, self.feature_seconds, self.model_seconds,
+      self.render_seconds, self.notes_per_second)
+
+
+class InferenceEngine(object):
+  """Runs a model over consecutive note windows of a score and renders its prediction.
+
+  model maps a float32 tensor [batch, window_size, len(feature.SCORE_FEATURE_KEYS)] to
+  [batch, window_size, len(feature.PERFORM_FEATURE_KEYS)]: onsets in seconds from the
+  window's first note, durations in seconds and MIDI velocities. Each window is anchored
+  at the score time of its first note. The last window of a piece is zero-padded.
+
+  Windows go through the model batch_size at a time, and their feature rows are computed
+  per batch. Memory still grows with the note count: the score, its note table and beat
+  locations, and the predictions array (needed whole by render()) are per piece.
+  """
+  def __init__(self, model, window_size=64, batch_size=16, num_threads=None):
+    self.model = model.eval() if hasattr(model, 'eval') else model
+    self.window_size = window_size
+    self.batch_size = batch_size
+    if num_threads:
+      torch.set_num_threads(num_threads)
+
+  def piece_features(self, xml_sequence):
+    """Lazy feature.PieceFeatures of xml_sequence; rows are built window by window in predict()."""
+    return feature.PieceFeatures(xml_sequence, lazy=True)
+
+  def _batches(self, piece_features):
+    num_notes = len(piece_features)
+    starts = list(range(0, num_notes, self.window_size))
+    for first in range(0, len(starts), self.batch_size):
+      batch_starts = starts[first:first + self.batch_size]
+      batch = np.zeros((len(batch_starts), self.window_size, len(feature.SCORE_FEATURE_KEYS)), dtype=np.float32)
+      for row, start in enumerate(batch_starts):
+        window = piece_features.window(start, start + self.window_size)
+        # the last onset group has no score_ioi
+        batch[row, :len(window)] = np.nan_to_num(window, copy=False)
+      yield batch_starts, batch
+
+  def predict(self, piece_features, timings=None):
+    """(notes, len(feature.PERFORM_FEATURE_KEYS)) predictions, window-relative onsets.
+
+    If timings is a dict, seconds spent building feature rows and in the model are added
+    to its 'features' and 'model' entries.
+    """
+    num_notes = len(piece_features)
+    predictions = np.zeros((num_notes, len(feature.PERFORM_FEATURE_KEYS)), dtype=np.float32)
+    feature_seconds = 0
+    model_seconds = 0
+    with torch.no_grad():
+      # the generator builds each batch's feature rows between model calls
+      feature_start = time.perf_counter()
+      for batch_starts, batch in self._batches(piece_features):
+        model_start = time.perf_counter()
+        output = self.model(torch.from_numpy(batch)).numpy()
+        for row, start in enumerate(batch_starts):
+          end = min(start + self.window_size, num_notes)
+          predictions[start:end] = output[row, :end - start]
+        model_end = time.perf_counter()
+        feature_seconds += model_start - feature_start
+        model_seconds += model_end - model_start
+        feature_start = model_end
+    if timings is not None:
+      timings['features'] = timings.get('features', 0) + feature_seconds
+      timings['model'] = timings.get('model', 0) + model_seconds
+    return predictions
+
+  def render(self, xml_sequence, predictions, save_path):
+    """Write xml_sequence with predicted timing and velocity through XmlNoteSequence.save_to_midi.
+
+    The sequence itself is not modified; the notes are rendered from copies.
+    """
+    notes = xml_sequence.notes
+    anchors = np.asarray([el.note_duration.time_position for el in notes[::self.window_size]])
+    onsets = np.repeat(anchors, self.window_size)[:len(notes)] + predictions[:, 0]
+    rendered = []
+    for note, onset, duration, velocity in zip(notes, onsets.tolist(), predictions[:, 1].tolist(),
+                                               predictions[:, 2].tolist()):
+      note = copy.copy(note)
+      note.note_duration = copy.copy(note.note_duration)
+      note.note_duration.time_position = onset
+      note.note_duration.seconds = duration
+      note.velocity = velocity
+      rendered.append(note)
+    xml_sequence.save_to_midi(rendered, save_path)
+
+  def run(self, xml_sequence, save_path):
+    start = time.perf_counter()
+    piece_features = self.piece_features(xml_sequence)
+    timings = {'features': time.perf_counter() - start}
+    predictions = self.predict(piece_features, timings)
+    render_start = time.perf_counter()
+    self.render(xml_sequence, predictions, save_path)
+    render_end = time.perf_counter()
+    num_windows = -(-len(piece_features) // self.window_size)
+    return InferenceReport(xml_sequence.xml_path, len(piece_features), num_windows, timings['features'],
+                           timings['model'], render_end - render_start)
+
+
+def load_model(model_path):
+  """A TorchScript archive, or a whole module saved with torch.save."""
+  try:
+    return torch.jit.load(model_path, map_location='cpu')
+  except RuntimeError:
+    return torch.load(model_path, map_location='cpu', weights_only=False)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument("xml_paths", nargs='+')
+  parser.add_argument("--model_path", required=True)
+  parser.add_argument("--save_dir", default='./rendered')
+  parser.add_argument("--window_size", type=int, default=64)
+  parser.add_argument("--batch_size", type=int, default=16)
+  parser.add_argument("--num_threads", type=int, default=None)
+  args = parser.parse_args()
+
+  if not os.path.isdir(args.save_dir):
+    os.makedirs(args.save_dir)
+  engine = InferenceEngine(load_model(args.model_path), args.window_size, args.batch_size, args.num_threads)
+  reports = []
+  for xml_path in args.xml_paths:
+    # examples/<piece>/musicxml_cleaned.musicxml -> <save_dir>/<piece>.mid
+    piece_name = os.path.basename(os.path.dirname(os.path.abspath(xml_path)))
+    report = engine.run(xml_data.XmlNoteSequence(xml_path), os.path.join(args.save_dir, piece_name + '.mid'))
+    print(report)
+    reports.append(report)
+  total_notes = sum(el.num_notes for el in reports)
+  total_seconds = sum(el.latency for el in reports)
+  print('{} pieces, {} notes in {:.3f}s, {:.0f} notes/s'.format(len(reports), total_notes, total_seconds,
+                                                             total_notes / max(total_seconds, 1e-9)))
@@ -0,0 +1,84 @@
+import types
+
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+
+import feature
+import inference
+from note_table import NoteTable
+from note_table_test import xml_note
+
+
+def context(vector):
+  return types.SimpleNamespace(vector=lambda embedder: list(vector))
+
+
+def stub_sequence(num_notes):
+  """num_notes quarter notes in 4/4 (4 divisions per quarter), the last two as a chord."""
+  notes = []
+  for i in range(num_notes):
+    note = xml_note(min(i, num_notes - 2) * 4, 4, 60 + i)
+    note.dynamic_context = context([0.5, i / 10, 0, 0])
+    note.tempo_context = context([1, 0, 0])
+    notes.append(note)
+  measures = [types.SimpleNamespace(start_xml_position=m * 16) for m in range(num_notes // 4 + 1)]
+  time_signature = types.SimpleNamespace(xml_position=0, numerator=4, denominator=4,
+                                         state=types.SimpleNamespace(divisions=4))
+  rendered = []
+  return types.SimpleNamespace(notes=notes, xml_path='score.musicxml', rendered=rendered,
+                               xml_doc=types.SimpleNamespace(parts=[types.SimpleNamespace(measures=measures)]),
+                               meta=types.SimpleNamespace(time_signatures=[time_signature]),
+                               to_note_table=lambda: NoteTable.from_xml_notes(notes),
+                               save_to_midi=lambda notes, path: rendered.append((list(notes), path)))
+
+
+class RecordingModel(object):
+  """Onsets 0.5s apart inside each window, 0.25s durations, and the pitch feature as velocity."""
+  def __init__(self):
+    self.batches = []
+
+  def __call__(self, batch):
+    batch = batch.numpy().copy()
+    self.batches.append(batch)
+    output = np.zeros(batch.shape[:2] + (len(feature.PERFORM_FEATURE_KEYS),), dtype=np.float32)
+    output[:, :, 0] = np.arange(batch.shape[1]) * 0.5
+    output[:, :, 1] = 0.25
+    output[:, :, 2] = batch[:, :, 0]
+    return torch.from_numpy(output)
+
+
+def test_lazy_windows_match_piece_features():
+  sequence = stub_sequence(10)
+  expected = feature.PieceFeatures(sequence).take(np.arange(10))
+  lazy = feature.PieceFeatures(sequence, lazy=True)
+  assert lazy.features is None
+  np.testing.assert_array_equal(np.concatenate([lazy.window(0, 4), lazy.window(4, 8), lazy.window(8, 12)]), expected)
+  np.testing.assert_array_equal(lazy.take([3, 1]), feature.PieceFeatures(sequence).take([3, 1]))
+
+
+def test_windows_batches_and_render():
+  sequence = stub_sequence(10)
+  model = RecordingModel()
+  engine = inference.InferenceEngine(model, window_size=4, batch_size=2)
+  report = engine.run(sequence, 'rendered.mid')
+  assert (report.num_notes, report.num_windows) == (10, 3)
+
+  # windows start at notes 0, 4 and 8; the last one is padded with zero rows
+  assert [el.shape for el in model.batches] == [(2, 4, len(feature.SCORE_FEATURE_KEYS)),
+                                                 (1, 4, len(feature.SCORE_FEATURE_KEYS))]
+  windows = np.concatenate(model.batches)
+  assert windows[:, :, 0].tolist() == [[60, 61, 62, 63], [64, 65, 66, 67], [68, 69, 0, 0]]
+  assert not windows[2, 2:].any()
+  assert not np.isnan(windows).any()  # the last onset group's score_ioi is zeroed
+
+  (notes, path), = sequence.rendered
+  assert path == 'rendered.mid'
+  # each window is anchored at the score time of its first note
+  anchors = [sequence.notes[el].note_duration.time_position for el in [0, 4, 8]]
+  expected_onsets = [anchors[i // 4] + (i % 4) * 0.5 for i in range(10)]
+  np.testing.assert_allclose([el.note_duration.time_position for el in notes], expected_onsets)
+  assert [el.velocity for el in notes] == [60 + i for i in range(10)]
+  assert [el.note_duration.seconds for el in notes] == [0.25] * 10
+  assert [el.note_duration.time_position for el in sequence.notes] == [min(i, 8) * 0.5 for i in range(10)]
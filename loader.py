@@ -1,8 +1,12 @@
 from __future__ import division
-from torch.utils.data import Dataset
+import numpy as np
+import torch
+from torch.utils.data import Dataset, Sampler
 from torchvision import datasets
 from torchvision import transforms
 
+from feature_store import FeatureStore
+
 
 def denorm(x):
     out = (x + 1) / 2
@@ -20,4 +24,140 @@ def dataset(set_name):
         raise Exception(set_name +': unknown dataset. choose between mnist / f-mnist')
 
     return set
-'''
\ No newline at end of file
+'''
+
+
+class NoteWindowDataset(Dataset):
+    """Windows of window_size consecutive notes from a feature_store.FeatureStore.
+
+    Item i is (score_features, perform_features) of one window, as tensors sharing
+    memory with the store's memory map. With window_size None every item is a whole
+    piece. Window bounds are computed once from the piece offsets; the store itself is
+    opened lazily, so a DataLoader worker maps the files on its first item instead of
+    receiving a pickled copy of the corpus.
+    """
+    def __init__(self, store_path, window_size=64, hop_size=None):
+        self.store_path = store_path
+        self.window_size = window_size
+        self._store = FeatureStore(store_path)
+        if window_size is None:
+            self.starts, self.ends = self._store.piece_offsets[:-1], self._store.piece_offsets[1:]
+        else:
+            self.starts, self.ends = self._store.window_bounds(window_size, hop_size)
+        self.lengths = self.ends - self.starts
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_store'] = None
+        return state
+
+    @property
+    def store(self):
+        if self._store is None:
+            self._store = FeatureStore(self.store_path)
+        return self._store
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, index):
+        start, end = self.starts[index], self.ends[index]
+        return (torch.from_numpy(self.store.score_features[start:end]),
+                torch.from_numpy(self.store.perform_features[start:end]))
+
+
+def padding_efficiency(lengths, batches):
+    """Real notes over the notes a padded [batch, max length] layout would hold."""
+    real = 0
+    padded = 0
+    for batch in batches:
+        batch_lengths = lengths[batch]
+        real += int(batch_lengths.sum())
+        padded += len(batch) * int(batch_lengths.max())
+    return real / max(padded, 1)
+
+
+class BucketBatchSampler(Sampler):
+    """Batches of items with similar length, for packed batching.
+
+    Items are sorted by length (ties broken randomly) and split into num_buckets
+    buckets of equal item count. Each bucket is shuffled and cut into batches whose
+    padded size, items * longest item, stays within max_notes; an item longer than
+    max_notes gets a batch of its own. Batch order is shuffled across buckets. The order
+    depends only on seed and the epoch given to set_epoch().
+    """
+    def __init__(self, lengths, max_notes=4096, num_buckets=8, shuffle=True, seed=0):
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.max_notes = max_notes
+        self.num_buckets = num_buckets
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        self._batches = None
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+        self._batches = None
+
+    def _make_batches(self):
+        rng = np.random.RandomState(self.seed + self.epoch)
+        tie_break = rng.permutation(len(self.lengths)) if self.shuffle else np.arange(len(self.lengths))
+        order = np.lexsort((tie_break, self.lengths))
+        batches = []
+        for bucket in np.array_split(order, min(self.num_buckets, max(len(order), 1))):
+            if self.shuffle:
+                bucket = bucket[rng.permutation(len(bucket))]
+            batch = []
+            longest = 0
+            for index in bucket.tolist():
+                length = max(longest, int(self.lengths[index]))
+                if batch and length * (len(batch) + 1) > self.max_notes:
+                    batches.append(batch)
+                    batch = []
+                    length = int(self.lengths[index])
+                batch.append(index)
+                longest = length
+            if batch:
+                batches.append(batch)
+        if self.shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+        return batches
+
+    @property
+    def batches(self):
+        if self._batches is None:
+            self._batches = self._make_batches()
+        return self._batches
+
+    def __iter__(self):
+        return iter(self.batches)
+
+    def __len__(self):
+        return len(self.batches)
+
+    def report(self):
+        """Padding efficiency of this epoch's batches, and of random batches of the same sizes."""
+        batches = self.batches
+        rng = np.random.RandomState(self.seed + self.epoch)
+        shuffled = rng.permutation(len(self.lengths))
+        boundaries = np.cumsum([len(el) for el in batches])[:-1]
+        unbucketed = np.split(shuffled, boundaries)
+        return {'batches': len(batches),
+                'notes': int(self.lengths.sum()),
+                'mean_batch_notes': float(self.lengths.sum()) / max(len(batches), 1),
+                'padding_efficiency': padding_efficiency(self.lengths, batches),
+                'unbucketed_padding_efficiency': padding_efficiency(self.lengths, unbucketed)}
+
+
+def pack_collate(items):
+    """Collate (score_features, perform_features) items without padding.
+
+    Returns (score_features, perform_features, offsets): the items concatenated along the
+    note axis, and offsets of length len(items) + 1 so item i is rows offsets[i]:offsets[i + 1].
+    """
+    lengths = [len(score) for score, _ in items]
+    offsets = torch.zeros(len(items) + 1, dtype=torch.long)
+    offsets[1:] = torch.cumsum(torch.tensor(lengths, dtype=torch.long), 0)
+    return (torch.cat([score for score, _ in items]),
+            torch.cat([perform for _, perform in items]),
+            offsets)
@@ -1,87 +1,359 @@
 import xml_data
+import alignment
+import dtw_alignment
+import segmented_alignment
+import profiling
 import os
+import math
+import array
 import ntpath
-import shutil
-import subprocess
+from functools import lru_cache
 from musicXML_parser.mxp.note import Note
 import pretty_midi
-import utils
+import numpy as np
+from note_table import NoteTable
 
-ALIGN_TOOL_DIR = '/home/ilcobo2/AlignmentTool_v2'
+NOTE_INDEX_DTYPE = np.dtype([('onset', np.float64), ('pitch', np.int64), ('index', np.int64)])
 
 
 class PerformPair(object):
-  def __init__(self, xml_sequence, perform_midi_path):
-    self.pairs = []
-    self.score_pairs = []
-    self.extra_pairs = []
+  def __init__(self, xml_sequence, perform_midi_path, batch=True, cache=None, score_index=None, aligner='external',
+               num_workers=None):
+    """aligner is 'external' (AlignmentTool_v2 through score.mid and the *_match.txt /
+    *_corresp.txt files), 'dtw' (dtw_alignment, in process, no files written) or
+    'segmented' (like 'dtw', but in segments of segmented_alignment.SEGMENT_MEASURES
+    measures aligned in parallel by num_workers processes, for long performances).
+    """
+    self.xml_sequence = xml_sequence
+    self._score_pairs = None
+    self._extra_pairs = None
+    self._pairs = None
 
+    perform_midi = pretty_midi.PrettyMIDI(perform_midi_path)
+    perform_notes = perform_midi.instruments[0].notes
+    perform_notes.sort(key=lambda note: note.start)
+    self.perform_notes = perform_notes
+
+    profiling.count('perform_notes', len(perform_notes))
+
+    with profiling.span('pair.align'):
+      if aligner == 'dtw':
+        self.match_columns, score_columns = dtw_alignment_columns(xml_sequence, perform_notes)
+      elif aligner == 'segmented':
+        self.match_columns, score_columns = dtw_alignment_columns(xml_sequence, perform_notes, segmented=True,
+                                                                  num_workers=num_workers)
+      elif aligner == 'external':
+        score_columns, self.match_columns = self._external_alignment(perform_midi_path, cache)
+      else:
+        raise ValueError('unknown aligner: {}'.format(aligner))
+    self._match_pairs = None
+
+    self.perform_index = OnsetIndex([el.start for el in perform_notes], [el.pitch for el in perform_notes],
+                                    include_end=True)
+    if score_index is None:
+      score_index = score_onset_index(xml_sequence)
+    self.score_index = score_index
+
+    # the in-process aligners already know the xml_sequence.notes index of every score note
+    score_ids_are_indices = aligner in ('dtw', 'segmented')
+    with profiling.span('pair.resolve'):
+      if batch:
+        self._resolve_batch(score_columns, score_ids_are_indices)
+      else:
+        self._resolve_each(score_columns.to_dict(), score_ids_are_indices)
+    profiling.count('pairs', len(self.match_columns))
+
+  def _external_alignment(self, perform_midi_path, cache):
+    xml_sequence = self.xml_sequence
     score_folder, _ = ntpath.split(xml_sequence.xml_path)
     xml_midi_path = os.path.join(score_folder, 'score.mid')
-    if not os.path.isfile(xml_midi_path):
-      xml_sequence.save_to_midi(xml_sequence.notes, xml_midi_path)
-
-    if not os.path.isfile(os.path.join(score_folder, 'score_fmt3x.txt')):
+    if cache is not None:
+      cache.ensure_score_midi(xml_sequence, xml_midi_path)
       try:
-        match(xml_midi_path, perform_midi_path)
+        cache.ensure_alignment(xml_sequence.xml_path, xml_midi_path, perform_midi_path)
       except:
-        pass
-    score_maps = read_corresp(perform_midi_path.replace('.mid', '_corresp.txt'))
-    match_pairs = read_match(perform_midi_path.replace('.mid', '_match.txt'))
+        print('Error to process {}'.format(perform_midi_path))
+    else:
+      if not os.path.isfile(xml_midi_path):
+        xml_sequence.save_to_midi(xml_sequence.notes, xml_midi_path)
 
-    perform_midi = pretty_midi.PrettyMIDI(perform_midi_path)
-    perform_notes = perform_midi.instruments[0].notes
-    perform_notes.sort(key=lambda note: note.start)
+      # performances of one piece share score_fmt3x.txt, so check this performance's own outputs
+      if not alignment.has_alignment(perform_midi_path):
+        try:
+          match(xml_midi_path, perform_midi_path)
+        except:
+          pass
+    return (read_corresp_columns(perform_midi_path.replace('.mid', '_corresp.txt')),
+            read_match_columns(perform_midi_path.replace('.mid', '_match.txt')))
+
+  @property
+  def match_pairs(self):
+    if self._match_pairs is None:
+      self._match_pairs = self.match_columns.to_pairs()
+    return self._match_pairs
+
+  @property
+  def score_pairs(self):
+    if self._score_pairs is None:
+      self._materialize()
+    return self._score_pairs
+
+  @property
+  def extra_pairs(self):
+    if self._extra_pairs is None:
+      self._materialize()
+    return self._extra_pairs
+
+  @property
+  def pairs(self):
+    if self._pairs is None:
+      self._pairs = self.score_pairs + self.extra_pairs
+    return self._pairs
+
+  def score_pair_indices(self):
+    """(score note, midi note) index arrays of score_pairs, -1 for unperformed notes."""
+    score_indices = np.asarray([el.score_note_idx for el in self.score_pairs], dtype=np.int64)
+    midi_indices = np.asarray([-1 if el.midi_note_idx is None else el.midi_note_idx for el in self.score_pairs],
+                              dtype=np.int64)
+    return score_indices, midi_indices
+
+  def to_note_tables(self, score_table=None):
+    """Row-aligned (score, performance) NoteTables of score_pairs.
 
-    for pair in match_pairs:
+    Score notes without a performed note get FLAG_MISSING rows in the performance table.
+    score_table is the NoteTable of xml_sequence.notes, if the caller already has one.
+    """
+    score_indices, midi_indices = self.score_pair_indices()
+    if score_table is None:
+      score_table = self.xml_sequence.to_note_table()
+    score_table = score_table.take(score_indices)
+    perform_table = NoteTable.from_midi_notes(self.perform_notes).take(midi_indices)
+    return score_table, perform_table
+
+  def _resolve_each(self, score_maps, score_ids_are_indices=False):
+    score_pairs = []
+    extra_pairs = []
+    for pair in self.match_pairs:
       if pair.perform_second is not None:
-        cand_idx = utils.find_le_idx([el.start for el in perform_notes], pair.perform_second - 0.01)
-        if cand_idx is None:
-          cand_idx = 0
-        for n in range(cand_idx, len(perform_notes)):
-          cand_note = perform_notes[n]
-          if cand_note.start - pair.perform_second > 0.01:
-            break
-          if cand_note.pitch == pair.perform_pitch:
-            pair.midi_note = cand_note
-            break
-        if pair.midi_note is None:
-          print(cand_idx)
-          raise RuntimeError('No matching perform_second: {:.4f}, perform note: {}'.format(perform_notes[cand_idx].start, pair.__dict__))
+        cand_idx, note_idx = self.perform_index.find(pair.perform_second, pair.perform_pitch)
+        if note_idx is None:
+          self._raise_perform_error(pair, cand_idx)
+        pair.midi_note_idx = note_idx
+        pair.midi_note = self.perform_notes[note_idx]
       if pair.score_id is not None:
         score_info = score_maps[pair.score_id]
         pair.score_pitch = score_info[0]
         pair.score_second = score_info[1]
-        cand_idx = utils.find_le_idx([el.note_duration.time_position for el in xml_sequence.notes],
-                                     pair.score_second - 0.01)
-
-        if cand_idx is None:
-          cand_idx = 0
-        for n in range(cand_idx, len(xml_sequence.notes)):
-          cand_note = xml_sequence.notes[n]
-          if cand_note.note_duration.time_position - pair.score_second >= 0.01:
-            break
-          if cand_note.pitch[1] == pair.score_pitch:
-            pair.score_note = cand_note
-            break
-
-        if pair.score_note is None:
-          print(cand_idx)
-          raise RuntimeError('No matching score_second: {:.4f}, perform note: {}'.
-                             format(xml_sequence.notes[cand_idx].note_duration.time_position, pair.__dict__))
+        if score_ids_are_indices:
+          note_idx = int(pair.score_id)
+        else:
+          cand_idx, note_idx = self.score_index.find(pair.score_second, pair.score_pitch)
+          if note_idx is None:
+            self._raise_score_error(pair, cand_idx)
+        pair.score_note_idx = note_idx
+        pair.score_note = self.xml_sequence.notes[note_idx]
       if pair.score_note is not None:
-        self.score_pairs.append(pair)
+        score_pairs.append(pair)
       else:
-        self.extra_pairs.append(pair)
+        extra_pairs.append(pair)
+
+    self.midi_note_indices = np.asarray([-1 if el.midi_note_idx is None else el.midi_note_idx
+                                         for el in self.match_pairs], dtype=np.int64)
+    self.score_note_indices = np.asarray([-1 if el.score_note_idx is None else el.score_note_idx
+                                          for el in self.match_pairs], dtype=np.int64)
+    self._score_pairs = score_pairs
+    self._extra_pairs = extra_pairs
+    self.sort_pairs()
+
+  def _resolve_batch(self, score_columns, score_ids_are_indices=False):
+    """Resolve every match pair in one vectorized pass.
+
+    Only the index arrays are computed here; Pair objects are created and linked to
+    their notes on first access of pairs / score_pairs / extra_pairs. With
+    score_ids_are_indices the score ids are used as xml_sequence.notes indices as they
+    are, instead of being looked up by onset and pitch.
+    """
+    perform_seconds = self.match_columns.onsets
+    perform_pitches = self.match_columns.pitches
+    score_pitches, score_seconds = score_columns.lookup(self.match_columns.score_ids)
 
+    has_perform = ~np.isnan(perform_seconds)
+    has_score = ~np.isnan(score_seconds)
+    perform_cand, self.midi_note_indices = self.perform_index.find_all(perform_seconds, perform_pitches)
+    if score_ids_are_indices:
+      self.score_note_indices = np.where(has_score, self.match_columns.score_ids, -1).astype(np.int64)
+      score_cand = self.score_note_indices
+    else:
+      score_cand, self.score_note_indices = self.score_index.find_all(score_seconds, score_pitches)
+    self.score_pitches = score_pitches
+    self.score_seconds = score_seconds
+
+    perform_failed = has_perform & (self.midi_note_indices < 0)
+    score_failed = has_score & (self.score_note_indices < 0)
+    failed = np.nonzero(perform_failed | score_failed)[0]
+    if len(failed):
+      i = failed[0]
+      pair = self._link_pair(i)
+      if perform_failed[i]:
+        self._raise_perform_error(pair, perform_cand[i])
+      self._raise_score_error(pair, score_cand[i])
+
+  def _link_pair(self, i):
+    pair = self.match_pairs[i]
+    midi_idx = self.midi_note_indices[i]
+    score_idx = self.score_note_indices[i]
+    if pair.score_id is not None:
+      pair.score_pitch = int(self.score_pitches[i])
+      pair.score_second = float(self.score_seconds[i])
+    if midi_idx >= 0:
+      pair.midi_note_idx = int(midi_idx)
+      pair.midi_note = self.perform_notes[midi_idx]
+    if score_idx >= 0:
+      pair.score_note_idx = int(score_idx)
+      pair.score_note = self.xml_sequence.notes[score_idx]
+    return pair
+
+  def _materialize(self):
+    score_pairs = []
+    extra_pairs = []
+    for i in range(len(self.match_columns)):
+      pair = self._link_pair(i)
+      if pair.score_note is not None:
+        score_pairs.append(pair)
+      else:
+        extra_pairs.append(pair)
+    self._score_pairs = score_pairs
+    self._extra_pairs = extra_pairs
     self.sort_pairs()
-    self.pairs = self.score_pairs + self.extra_pairs
+
+  def _raise_perform_error(self, pair, cand_idx):
+    raise RuntimeError('No matching perform_second: {:.4f}, perform note: {}'.
+                       format(self.perform_notes[cand_idx].start, pair.__dict__))
+
+  def _raise_score_error(self, pair, cand_idx):
+    raise RuntimeError('No matching score_second: {:.4f}, perform note: {}'.
+                       format(self.xml_sequence.notes[cand_idx].note_duration.time_position, pair.__dict__))
 
   def sort_pairs(self):
-    self.score_pairs.sort(key=lambda x: (x.score_note.note_duration.xml_position,
-                                         x.score_note.note_duration.grace_order,
-                                         -x.score_note.pitch[1]))
-    self.extra_pairs.sort(key=lambda x: (x.midi_note.start, -x.midi_note.pitch))
+    self._score_pairs.sort(key=lambda x: (x.score_note.note_duration.xml_position,
+                                          x.score_note.note_duration.grace_order,
+                                          -x.score_note.pitch[1]))
+    self._extra_pairs.sort(key=lambda x: (x.midi_note.start, -x.midi_note.pitch))
+    self._pairs = None
+
+
+def score_onset_index(xml_sequence):
+  """OnsetIndex of xml_sequence.notes; depends on the score only, so one can serve every performance."""
+  return OnsetIndex([el.note_duration.time_position for el in xml_sequence.notes],
+                    [el.pitch[1] for el in xml_sequence.notes],
+                    include_end=False)
+
+
+class OnsetIndex(object):
+  """Onset lookup over a note list, built once per piece.
+
+  Onsets are kept in a sorted NumPy array and every note is also hashed into a
+  (pitch, onset bucket) map whose bucket width equals the tolerance, so a note can be
+  resolved by a binary search plus a constant number of bucket probes.
+
+  The matching rule is the one PerformPair has always used: start from the rightmost
+  note whose onset is <= second - tolerance and take the first note (in onset order)
+  with the requested pitch, stopping once onset - second exceeds the tolerance
+  (or reaches it, when include_end is False).
+  """
+  def __init__(self, onsets, pitches, tolerance=0.01, include_end=True):
+    onsets = np.asarray(onsets, dtype=np.float64)
+    order = np.argsort(onsets, kind='stable')
+    self.table = np.zeros(len(onsets), dtype=NOTE_INDEX_DTYPE)
+    self.table['onset'] = onsets[order]
+    self.table['pitch'] = np.asarray(pitches, dtype=np.int64)[order]
+    self.table['index'] = order
+    self.onsets = self.table['onset']
+    self.pitches = self.table['pitch']
+    self.order = self.table['index']
+    self.tolerance = tolerance
+    self.include_end = include_end
+
+    self.buckets = dict()
+    for pos, (onset, pitch) in enumerate(zip(self.onsets.tolist(), self.pitches.tolist())):
+      self.buckets.setdefault((pitch, self._bucket(onset)), []).append(pos)
+
+  def __len__(self):
+    return len(self.onsets)
+
+  def _bucket(self, second):
+    return int(math.floor(second / self.tolerance))
+
+  def _in_window(self, onset, second):
+    if self.include_end:
+      return onset - second <= self.tolerance
+    return onset - second < self.tolerance
+
+  def find(self, second, pitch):
+    """Return (cand_idx, note_idx) as indices into the original note list.
+
+    cand_idx is the note the search started from (used for error reporting) and
+    note_idx is the matched note, or None if no note of that pitch is in the window.
+    """
+    if len(self.onsets) == 0:
+      return None, None
+    start = int(np.searchsorted(self.onsets, second - self.tolerance, side='right')) - 1
+    if start < 0:
+      start = 0
+
+    best = None
+    if self.pitches[start] == pitch and self._in_window(self.onsets[start], second):
+      best = start
+    else:
+      # every note after start has onset > second - tolerance, so one extra bucket
+      # on each side of the window absorbs floating point rounding of the bucket edges
+      for bucket in range(self._bucket(second - self.tolerance) - 1, self._bucket(second + self.tolerance) + 2):
+        for pos in self.buckets.get((pitch, bucket), ()):
+          if pos > start and (best is None or pos < best) and self._in_window(self.onsets[pos], second):
+            best = pos
+
+    cand_idx = int(self.order[start])
+    if best is None:
+      return cand_idx, None
+    return cand_idx, int(self.order[best])
+
+  def find_all(self, seconds, pitches):
+    """Vectorized find() over arrays of query seconds and pitches.
+
+    NaN seconds mark rows without a query. Returns (cand_idx, note_idx) arrays with -1
+    where there is nothing to report.
+    """
+    seconds = np.asarray(seconds, dtype=np.float64)
+    pitches = np.asarray(pitches, dtype=np.int64)
+    cand_idx = np.full(len(seconds), -1, dtype=np.int64)
+    note_idx = np.full(len(seconds), -1, dtype=np.int64)
+    rows = np.nonzero(~np.isnan(seconds))[0]
+    if len(self.onsets) == 0 or len(rows) == 0:
+      return cand_idx, note_idx
+
+    query = seconds[rows]
+    query_pitches = pitches[rows]
+    start = np.searchsorted(self.onsets, query - self.tolerance, side='right') - 1
+    start = np.maximum(start, 0)
+    # one position of slack; the exact window test is applied below
+    stop = np.minimum(np.searchsorted(self.onsets, query + self.tolerance, side='right') + 1, len(self.onsets))
+
+    best = np.full(len(rows), -1, dtype=np.int64)
+    for offset in range(int((stop - start).max())):
+      pos = start + offset
+      open_rows = np.nonzero((best < 0) & (pos < stop))[0]
+      if len(open_rows) == 0:
+        break
+      cand = pos[open_rows]
+      diff = self.onsets[cand] - query[open_rows]
+      in_window = diff <= self.tolerance if self.include_end else diff < self.tolerance
+      hit = in_window & (self.pitches[cand] == query_pitches[open_rows])
+      best[open_rows[hit]] = cand[hit]
+
+    cand_idx[rows] = self.order[start]
+    matched = best >= 0
+    note_idx[rows[matched]] = self.order[best[matched]]
+    return cand_idx, note_idx
 
 
 class Pair(object):
@@ -97,83 +369,215 @@ class Pair(object):
     self.perform_second = None
 
 
-def match(score_midi, perform_midi):
-  score_midi = os.path.abspath(score_midi)
-  perform_midi = os.path.abspath(perform_midi)
-  shutil.copy(perform_midi, os.path.join(ALIGN_TOOL_DIR, 'perform.mid'))
-  shutil.copy(score_midi, os.path.join(ALIGN_TOOL_DIR, 'score.mid'))
-  current_path = os.getcwd()
-  os.chdir(ALIGN_TOOL_DIR)
+@profiling.profiled('pair.align.external')
+def match(score_midi, perform_midi, align_tool_dir=alignment.ALIGN_TOOL_DIR):
   try:
-    subprocess.check_call(["sudo", "sh", "MIDIToMIDIAlign.sh", "score", "perform"])
+    alignment.run_aligner(score_midi, perform_midi, align_tool_dir)
   except:
     print('Error to process {}'.format(perform_midi))
+
+
+@profiling.profiled('pair.align.dtw')
+def dtw_alignment_columns(xml_sequence, perform_notes, segmented=False, num_workers=None):
+  """Align with dtw_alignment and return (MatchColumns, ScoreColumns) as read from aligner files.
+
+  Score ids are indices into xml_sequence.notes. Overlapped notes are left out, as
+  save_to_midi leaves them out of the score.mid the external aligner sees. Extra notes get
+  error_index 3 and matched notes 0; missing score notes follow the performed notes.
+  segmented aligns with segmented_alignment, cutting the score at measure boundaries, in
+  num_workers processes.
+  """
+  score_ids = np.asarray([i for i, el in enumerate(xml_sequence.notes) if not el.is_overlapped], dtype=np.int64)
+  score_pitches = np.asarray([xml_sequence.notes[i].pitch[1] for i in score_ids], dtype=np.int64)
+  score_seconds = np.asarray([xml_sequence.notes[i].note_duration.time_position for i in score_ids],
+                             dtype=np.float64)
+  onsets = np.asarray([el.start for el in perform_notes], dtype=np.float64)
+  pitches = np.asarray([el.pitch for el in perform_notes], dtype=np.int64)
+  if segmented:
+    segments = segmented_alignment.measure_segments([xml_sequence.notes[i].measure_number for i in score_ids])
+    perform_to_score = segmented_alignment.align_segmented(score_seconds, score_pitches, segments, onsets, pitches,
+                                                           num_workers=num_workers)
   else:
-    score_subfolder, _ = ntpath.split(score_midi)
-    shutil.move('score_fmt3x.txt', os.path.join(score_subfolder, 'score_fmt3x.txt'))
-    shutil.move('perform_match.txt', perform_midi.replace('.mid', '_match.txt'))
-    shutil.move('perform_corresp.txt', perform_midi.replace('.mid', '_corresp.txt'))
-    os.chdir(current_path)
+    perform_to_score = dtw_alignment.align_notes(score_seconds, score_pitches, onsets, pitches)
 
+  matched = perform_to_score >= 0
+  missing = np.ones(len(score_ids), dtype=bool)
+  missing[perform_to_score[matched]] = False
+  num_missing = int(missing.sum())
+  match_columns = MatchColumns(
+    perform_ids=np.concatenate([np.arange(len(perform_notes)), np.full(num_missing, -1)]).astype(np.int64),
+    onsets=np.concatenate([onsets, np.full(num_missing, np.nan)]),
+    offsets=np.concatenate([np.asarray([el.end for el in perform_notes], dtype=np.float64),
+                            np.full(num_missing, np.nan)]),
+    pitches=np.concatenate([pitches, np.zeros(num_missing, dtype=np.int64)]),
+    velocities=np.concatenate([np.asarray([el.velocity for el in perform_notes], dtype=np.int64),
+                               np.zeros(num_missing, dtype=np.int64)]),
+    score_ids=np.concatenate([np.where(matched, score_ids[np.maximum(perform_to_score, 0)], -1),
+                              score_ids[missing]]).astype(np.int64),
+    error_index=np.concatenate([np.where(matched, 0, 3), np.full(num_missing, -1)]).astype(np.int64))
+  return match_columns, ScoreColumns(score_ids, score_pitches, score_seconds)
 
-def read_corresp(corresp_file):
-  score_map = dict()
-  f = open(corresp_file, 'r')
-  lines = f.readlines()
-  f.close()
-  for line in lines[1:]:
-    els = line.split()
-    if els[5] == '*':
-      continue
-    second = float(els[6])
-    id = els[5]
-    pitch = int(els[8])
-    score_map[id] = (pitch, second)
-
-  return score_map
 
+class MatchColumns(object):
+  """Columns of a *_match.txt file, one row per line.
 
-def read_fmt3x(fmt3x_file):
-  score_map = dict()
-  f = open(fmt3x_file, 'r')
-  lines = f.readlines()
-  f.close()
-  tpqn = float(lines[0].split()[-1])
-  for line in lines[2:]:
-    els = line.split()
-    second = int(els[0]) / tpqn
-    n_notes = int(els[8])
-    for n in range(n_notes):
-      id = els[-(1+n)].split('-')[-1]
-      pitch_word = els[-(1 + 2*n_notes + n)]
-      pitch = pitch_word_to_pitch(pitch_word)
+  //Missing rows have perform_id -1, NaN onset/offset and pitch/velocity 0;
+  rows without a score note have score_id -1. error_index holds the aligner's
+  error flag (0: correct, 1: pitch error, 3: extra note) and -1 for missing rows.
+  """
+  def __init__(self, perform_ids, onsets, offsets, pitches, velocities, score_ids, error_index):
+    self.perform_ids = perform_ids
+    self.onsets = onsets
+    self.offsets = offsets
+    self.pitches = pitches
+    self.velocities = velocities
+    self.score_ids = score_ids
+    self.error_index = error_index
 
-      score_map[id] = (pitch, second)
+  def __len__(self):
+    return len(self.score_ids)
 
-  return score_map
+  def to_pairs(self):
+    pairs = []
+    for onset, pitch, score_id in zip(self.onsets.tolist(), self.pitches.tolist(), self.score_ids.tolist()):
+      pair = Pair()
+      if onset == onset:  # not NaN
+        pair.perform_second = onset
+        pair.perform_pitch = pitch
+      if score_id >= 0:
+        pair.score_id = str(score_id)
+      pairs.append(pair)
+    return pairs
 
 
-def read_match(match_file):
-  matches = []
-  f = open(match_file, 'r')
-  lines = f.readlines()
-  f.close()
-  for line in lines[4:]:
-    pair = Pair()
-    els = line.split()
-    if els[0] == '//Missing':
-      pair.score_id = els[-1].split('-')[-1]
-    else:
-      pair.perform_second = float(els[1])
-      pair.perform_pitch = pitch_word_to_pitch(els[3])
-      if els[9] != '*':
-        pair.score_id = els[9].split('-')[-1]
+class ScoreColumns(object):
+  """Score note id, pitch and onset (seconds) columns of a corresp or fmt3x file."""
+  def __init__(self, ids, pitches, seconds):
+    self.ids = ids
+    self.pitches = pitches
+    self.seconds = seconds
+    self._row_of_id = None
+
+  def __len__(self):
+    return len(self.ids)
+
+  def to_dict(self):
+    return dict(zip([str(el) for el in self.ids.tolist()], zip(self.pitches.tolist(), self.seconds.tolist())))
+
+  def lookup(self, ids):
+    """Return (pitches, seconds) for an array of score ids; -1 ids give (0, NaN)."""
+    ids = np.asarray(ids, dtype=np.int64)
+    if self._row_of_id is None:
+      size = int(self.ids.max()) + 1 if len(self.ids) else 0
+      self._row_of_id = np.full(size, -1, dtype=np.int64)
+      # later rows win, as they would in a dict built line by line
+      self._row_of_id[self.ids] = np.arange(len(self.ids))
+    valid = ids >= 0
+    rows = np.full(len(ids), -1, dtype=np.int64)
+    in_range = valid & (ids < len(self._row_of_id))
+    rows[in_range] = self._row_of_id[ids[in_range]]
+    unknown = valid & (rows < 0)
+    if unknown.any():
+      raise KeyError(str(ids[np.argmax(unknown)]))
+    pitches = np.zeros(len(ids), dtype=np.int64)
+    seconds = np.full(len(ids), np.nan)
+    pitches[valid] = self.pitches[rows[valid]]
+    seconds[valid] = self.seconds[rows[valid]]
+    return pitches, seconds
+
+
+def _note_id(word):
+  return int(word.split('-')[-1])
+
+
+@profiling.profiled('read_corresp')
+def read_corresp_columns(corresp_file):
+  ids = array.array('q')
+  pitches = array.array('q')
+  seconds = array.array('d')
+  with open(corresp_file, 'r') as f:
+    next(f, None)
+    for line in f:
+      els = line.split()
+      if els[5] == '*':
+        continue
+      ids.append(int(els[5]))
+      seconds.append(float(els[6]))
+      pitches.append(int(els[8]))
+  return ScoreColumns(np.frombuffer(ids, dtype=np.int64), np.frombuffer(pitches, dtype=np.int64),
+                      np.frombuffer(seconds, dtype=np.float64))
+
+
+@profiling.profiled('read_fmt3x')
+def read_fmt3x_columns(fmt3x_file):
+  ids = array.array('q')
+  pitches = array.array('q')
+  seconds = array.array('d')
+  with open(fmt3x_file, 'r') as f:
+    tpqn = float(next(f).split()[-1])
+    next(f, None)
+    for line in f:
+      els = line.split()
+      second = int(els[0]) / tpqn
+      n_notes = int(els[8])
+      for n in range(n_notes):
+        ids.append(_note_id(els[-(1 + n)]))
+        pitches.append(pitch_word_to_pitch(els[-(1 + 2 * n_notes + n)]))
+        seconds.append(second)
+  return ScoreColumns(np.frombuffer(ids, dtype=np.int64), np.frombuffer(pitches, dtype=np.int64),
+                      np.frombuffer(seconds, dtype=np.float64))
+
+
+@profiling.profiled('read_match')
+def read_match_columns(match_file):
+  perform_ids = array.array('q')
+  onsets = array.array('d')
+  offsets = array.array('d')
+  pitches = array.array('q')
+  velocities = array.array('q')
+  score_ids = array.array('q')
+  error_index = array.array('q')
+  nan = float('nan')
+  with open(match_file, 'r') as f:
+    for _ in range(4):
+      next(f, None)
+    for line in f:
+      els = line.split()
+      if els[0] == '//Missing':
+        perform_ids.append(-1)
+        onsets.append(nan)
+        offsets.append(nan)
+        pitches.append(0)
+        velocities.append(0)
+        score_ids.append(_note_id(els[-1]))
+        error_index.append(-1)
       else:
-        pass
-    matches.append(pair)
-  return matches
+        perform_ids.append(int(els[0]))
+        onsets.append(float(els[1]))
+        offsets.append(float(els[2]))
+        pitches.append(pitch_word_to_pitch(els[3]))
+        velocities.append(int(els[4]))
+        score_ids.append(_note_id(els[9]) if els[9] != '*' else -1)
+        error_index.append(int(els[10]))
+  return MatchColumns(np.frombuffer(perform_ids, dtype=np.int64), np.frombuffer(onsets, dtype=np.float64),
+                      np.frombuffer(offsets, dtype=np.float64), np.frombuffer(pitches, dtype=np.int64),
+                      np.frombuffer(velocities, dtype=np.int64), np.frombuffer(score_ids, dtype=np.int64),
+                      np.frombuffer(error_index, dtype=np.int64))
+
+
+def read_corresp(corresp_file):
+  return read_corresp_columns(corresp_file).to_dict()
+
+
+def read_fmt3x(fmt3x_file):
+  return read_fmt3x_columns(fmt3x_file).to_dict()
+
+
+def read_match(match_file):
+  return read_match_columns(match_file).to_pairs()
 
 
+@lru_cache(maxsize=None)
 def pitch_word_to_pitch(word):
   if len(word) == 3:
     if word[1] == '#':
@@ -185,4 +589,4 @@ def pitch_word_to_pitch(word):
       raise ValueError
   else:
     alter = 0
-  return Note.pitch_to_midi_pitch(word[0], alter, word[-1])
\ No newline at end of file
+  return Note.pitch_to_midi_pitch(word[0], alter, word[-1])
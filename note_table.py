@@ -0,0 +1,134 @@
+"""Columnar (struct-of-arrays) storage for score and performance notes."""
+from __future__ import division
+
+import numpy as np
+
+FLAG_GRACE = 1 << 0
+FLAG_AFTER_GRACE = 1 << 1
+FLAG_OVERLAPPED = 1 << 2
+FLAG_ACCENT = 1 << 3
+FLAG_STRONG_ACCENT = 1 << 4
+FLAG_FERMATA = 1 << 5
+FLAG_STACCATO = 1 << 6
+FLAG_TENUTO = 1 << 7
+FLAG_TRILL = 1 << 8
+FLAG_MISSING = 1 << 9  # row stands for a note that has no counterpart (see NoteTable.take)
+
+# xml_position and duration are in MusicXML divisions, time_position and seconds in seconds.
+# Performance notes have no xml columns and store -1 there.
+COLUMNS = [('xml_position', np.int32, -1),
+           ('duration', np.int32, -1),
+           ('time_position', np.float64, np.nan),
+           ('seconds', np.float32, np.nan),
+           ('pitch', np.uint8, 0),
+           ('velocity', np.float32, np.nan),
+           ('voice', np.int8, -1),
+           ('staff', np.int8, -1),
+           ('measure', np.int32, -1),
+           ('flags', np.uint16, FLAG_MISSING)]
+
+COLUMN_NAMES = [el[0] for el in COLUMNS]
+
+
+def _score_note_flags(note):
+  notations = note.note_notations
+  flags = 0
+  if note.note_duration.is_grace_note:
+    flags |= FLAG_GRACE
+  if note.note_duration.after_grace_note:
+    flags |= FLAG_AFTER_GRACE
+  if note.is_overlapped:
+    flags |= FLAG_OVERLAPPED
+  if notations.is_accent:
+    flags |= FLAG_ACCENT
+  if notations.is_strong_accent:
+    flags |= FLAG_STRONG_ACCENT
+  if notations.is_fermata:
+    flags |= FLAG_FERMATA
+  if notations.is_staccato:
+    flags |= FLAG_STACCATO
+  if notations.is_tenuto:
+    flags |= FLAG_TENUTO
+  if notations.is_trill:
+    flags |= FLAG_TRILL
+  return flags
+
+
+class NoteTable(object):
+  """Notes as one NumPy array per column (see COLUMNS).
+
+  Basic slicing (table[10:20]) returns a table of views that shares memory with the
+  original; index arrays go through take() and copy, as in NumPy.
+  """
+  def __init__(self, columns):
+    self.columns = columns
+    lengths = set(len(el) for el in columns.values())
+    if len(lengths) > 1:
+      raise ValueError('columns differ in length: {}'.format(sorted(lengths)))
+
+  def __getattr__(self, name):
+    columns = self.__dict__.get('columns')
+    if columns is not None and name in columns:
+      return columns[name]
+    raise AttributeError(name)
+
+  def __len__(self):
+    return len(self.columns['pitch'])
+
+  def __getitem__(self, key):
+    if not isinstance(key, slice):
+      raise TypeError('NoteTable supports slices only; use take() for index arrays')
+    return NoteTable(dict((name, column[key]) for name, column in self.columns.items()))
+
+  @property
+  def nbytes(self):
+    return sum(column.nbytes for column in self.columns.values())
+
+  def has_flag(self, flag):
+    return (self.columns['flags'] & flag) != 0
+
+  def take(self, indices):
+    """Rows at indices; negative indices give empty rows flagged FLAG_MISSING."""
+    indices = np.asarray(indices, dtype=np.int64)
+    missing = indices < 0
+    if not len(self):
+      if not missing.all():
+        raise IndexError('index {} is out of bounds for an empty NoteTable'.format(indices[~missing][0]))
+      return NoteTable.empty(len(indices))
+    columns = dict()
+    for name, dtype, fill in COLUMNS:
+      column = self.columns[name][np.where(missing, 0, indices)]
+      column[missing] = fill
+      columns[name] = column
+    return NoteTable(columns)
+
+  @classmethod
+  def empty(cls, length):
+    return cls(dict((name, np.full(length, fill, dtype=dtype)) for name, dtype, fill in COLUMNS))
+
+  @classmethod
+  def from_xml_notes(cls, notes):
+    table = cls.empty(len(notes))
+    columns = table.columns
+    columns['xml_position'][:] = [el.note_duration.xml_position for el in notes]
+    columns['duration'][:] = [el.note_duration.duration for el in notes]
+    columns['time_position'][:] = [el.note_duration.time_position for el in notes]
+    columns['seconds'][:] = [el.note_duration.seconds for el in notes]
+    columns['pitch'][:] = [el.pitch[1] for el in notes]
+    columns['velocity'][:] = [el.velocity for el in notes]
+    columns['voice'][:] = [el.voice for el in notes]
+    columns['staff'][:] = [el.staff for el in notes]
+    columns['measure'][:] = [el.measure_number for el in notes]
+    columns['flags'][:] = [_score_note_flags(el) for el in notes]
+    return table
+
+  @classmethod
+  def from_midi_notes(cls, notes):
+    table = cls.empty(len(notes))
+    columns = table.columns
+    columns['time_position'][:] = [el.start for el in notes]
+    columns['seconds'][:] = [el.end - el.start for el in notes]
+    columns['pitch'][:] = [el.pitch for el in notes]
+    columns['velocity'][:] = [el.velocity for el in notes]
+    columns['flags'][:] = 0
+    return table
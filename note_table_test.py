@@ -0,0 +1,90 @@
+import types
+
+import numpy as np
+import pretty_midi
+import pytest
+
+import note_table
+from note_table import NoteTable
+
+
+def xml_note(xml_position, duration, pitch, grace=False, staccato=False, fermata=False, overlapped=False):
+  notations = types.SimpleNamespace(is_accent=False, is_strong_accent=False, is_fermata=fermata,
+                                    is_staccato=staccato, is_tenuto=False, is_trill=False)
+  note_duration = types.SimpleNamespace(xml_position=xml_position, duration=duration, time_position=xml_position / 8,
+                                        seconds=duration / 8, is_grace_note=grace, after_grace_note=False)
+  return types.SimpleNamespace(note_duration=note_duration, pitch=('C4', pitch), velocity=64, voice=1, staff=2,
+                               measure_number=xml_position // 16, is_overlapped=overlapped, note_notations=notations)
+
+
+def midi_table(num_notes):
+  return NoteTable.from_midi_notes([pretty_midi.Note(velocity=40 + i, pitch=60 + i, start=i * 0.5, end=i * 0.5 + 0.25)
+                                    for i in range(num_notes)])
+
+
+def test_from_xml_notes():
+  table = NoteTable.from_xml_notes([xml_note(0, 8, 60, staccato=True), xml_note(8, 0, 62, grace=True),
+                                    xml_note(16, 16, 64, fermata=True, overlapped=True)])
+  assert table.xml_position.tolist() == [0, 8, 16]
+  assert table.duration.tolist() == [8, 0, 16]
+  assert table.time_position.tolist() == [0, 1, 2]
+  assert table.seconds.tolist() == [1, 0, 2]
+  assert table.pitch.tolist() == [60, 62, 64]
+  assert table.velocity.tolist() == [64] * 3
+  assert table.voice.tolist() == [1] * 3 and table.staff.tolist() == [2] * 3
+  assert table.measure.tolist() == [0, 0, 1]
+  assert table.flags.tolist() == [note_table.FLAG_STACCATO, note_table.FLAG_GRACE,
+                                  note_table.FLAG_FERMATA | note_table.FLAG_OVERLAPPED]
+  assert not table.has_flag(note_table.FLAG_MISSING).any()
+
+
+def test_from_midi_notes():
+  table = midi_table(3)
+  assert table.time_position.tolist() == [0, 0.5, 1]
+  assert table.seconds.tolist() == [0.25] * 3
+  assert table.pitch.tolist() == [60, 61, 62]
+  assert table.velocity.tolist() == [40, 41, 42]
+  assert table.flags.tolist() == [0] * 3
+  # performance notes have no xml columns
+  assert table.xml_position.tolist() == [-1] * 3 and table.measure.tolist() == [-1] * 3
+
+
+def test_slices_share_memory():
+  table = midi_table(10)
+  window = table[2:6]
+  assert len(window) == 4 and window.pitch.tolist() == [62, 63, 64, 65]
+  for name in note_table.COLUMN_NAMES:
+    assert np.shares_memory(window.columns[name], table.columns[name])
+  window.velocity[0] = 100
+  assert table.velocity[2] == 100
+  with pytest.raises(TypeError):
+    table[[1, 2]]
+
+
+def test_take_fills_missing_rows():
+  table = midi_table(4)
+  taken = table.take([3, -1, 0])
+  assert taken.pitch.tolist() == [63, 0, 60]
+  assert taken.has_flag(note_table.FLAG_MISSING).tolist() == [False, True, False]
+  for name, _, fill in note_table.COLUMNS:
+    if name == 'flags':
+      continue
+    value = taken.columns[name][1]
+    assert np.isnan(value) if np.isnan(fill) else value == fill
+  assert not np.shares_memory(taken.pitch, table.pitch)
+
+
+def test_take_from_empty_table():
+  table = midi_table(0)
+  taken = table.take([-1, -1])
+  assert len(taken) == 2 and taken.has_flag(note_table.FLAG_MISSING).all()
+  assert len(table.take([])) == 0
+  with pytest.raises(IndexError):
+    table.take([-1, 0])
+  with pytest.raises(IndexError):
+    midi_table(2).take([2])
+
+
+def test_columns_must_have_equal_length():
+  with pytest.raises(ValueError):
+    NoteTable({'pitch': np.zeros(2), 'velocity': np.zeros(3)})
@@ -0,0 +1,186 @@
+import math
+import os
+import random
+import types
+
+import numpy as np
+
+import matching
+import utils
+from perform_pair_test import mock_note, write_alignment, write_performance
+
+EXAMPLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'examples', 'ballade1')
+
+
+def linear_find(onsets, pitches, second, pitch, include_end, tolerance=0.01):
+  """The per-pair scan PerformPair used before OnsetIndex, over the notes in onset order."""
+  order = sorted(range(len(onsets)), key=lambda i: onsets[i])
+  sorted_onsets = [onsets[i] for i in order]
+  cand_idx = utils.find_le_idx(sorted_onsets, second - tolerance)
+  if cand_idx is None:
+    cand_idx = 0
+  for n in range(cand_idx, len(sorted_onsets)):
+    diff = sorted_onsets[n] - second
+    if diff > tolerance or (not include_end and diff >= tolerance):
+      break
+    if pitches[order[n]] == pitch:
+      return order[cand_idx], order[n]
+  return order[cand_idx], None
+
+
+def random_notes(rng, num_notes):
+  """Chords on a 5ms grid, so queries land exactly on the tolerance edges."""
+  onsets = []
+  pitches = []
+  while len(onsets) < num_notes:
+    onset = rng.randrange(400) * 0.005
+    for pitch in rng.sample(range(60, 66), rng.choice([1, 2, 3])):
+      onsets.append(onset)
+      pitches.append(pitch)
+  return onsets, pitches
+
+
+def random_queries(rng, onsets, num_queries):
+  seconds = []
+  pitches = []
+  for _ in range(num_queries):
+    if rng.random() < 0.8:
+      seconds.append(rng.choice(onsets) + rng.choice([-0.01, -0.005, 0, 0.005, 0.01, 0.015]))
+    else:
+      seconds.append(rng.uniform(-0.1, 2.1))
+    pitches.append(rng.randrange(59, 67))
+  return seconds, pitches
+
+
+def test_find_matches_linear_scan():
+  rng = random.Random(0)
+  for trial in range(40):
+    onsets, pitches = random_notes(rng, 60)
+    if trial % 2:
+      rng.shuffle(onsets)  # grace notes are listed in score order, not onset order
+    for include_end in [True, False]:
+      index = matching.OnsetIndex(onsets, pitches, include_end=include_end)
+      seconds, query_pitches = random_queries(rng, onsets, 50)
+      for second, pitch in zip(seconds, query_pitches):
+        assert index.find(second, pitch) == linear_find(onsets, pitches, second, pitch, include_end)
+
+
+def test_grace_note_before_its_principal_note():
+  # list order (xml_position, grace_order) puts the grace note first, with a later onset
+  onsets = [1.05, 1.0, 1.0, 2.0]
+  pitches = [62, 60, 64, 60]
+  index = matching.OnsetIndex(onsets, pitches, include_end=False)
+  assert index.find(1.05, 62) == (2, 0)
+  assert index.find(1.0, 60) == (1, 1)
+  for second, pitch in [(1.05, 62), (1.0, 60), (1.0, 64), (1.04, 62), (2.0, 60)]:
+    assert index.find(second, pitch) == linear_find(onsets, pitches, second, pitch, False)
+
+
+def test_find_all_matches_find():
+  rng = random.Random(1)
+  for trial in range(20):
+    onsets, pitches = random_notes(rng, 80)
+    if trial % 2:
+      rng.shuffle(onsets)
+    for include_end in [True, False]:
+      index = matching.OnsetIndex(onsets, pitches, include_end=include_end)
+      seconds, query_pitches = random_queries(rng, onsets, 100)
+      seconds[::7] = [float('nan')] * len(seconds[::7])  # rows without a performed or score note
+      cand_idx, note_idx = index.find_all(seconds, query_pitches)
+      for second, pitch, cand, note in zip(seconds, query_pitches, cand_idx.tolist(), note_idx.tolist()):
+        if math.isnan(second):
+          assert (cand, note) == (-1, -1)
+          continue
+        expected_cand, expected_note = index.find(second, pitch)
+        assert (cand, note) == (expected_cand, -1 if expected_note is None else expected_note)
+
+
+def test_empty_index():
+  index = matching.OnsetIndex([], [])
+  assert index.find(1.0, 60) == (None, None)
+  cand_idx, note_idx = index.find_all([1.0, float('nan')], [60, 60])
+  assert cand_idx.tolist() == [-1, -1] and note_idx.tolist() == [-1, -1]
+
+
+def line_read_corresp(corresp_file):
+  score_map = dict()
+  with open(corresp_file, 'r') as f:
+    lines = f.readlines()
+  for line in lines[1:]:
+    els = line.split()
+    if els[5] == '*':
+      continue
+    score_map[els[5]] = (int(els[8]), float(els[6]))
+  return score_map
+
+
+def line_read_fmt3x(fmt3x_file):
+  score_map = dict()
+  with open(fmt3x_file, 'r') as f:
+    lines = f.readlines()
+  tpqn = float(lines[0].split()[-1])
+  for line in lines[2:]:
+    els = line.split()
+    second = int(els[0]) / tpqn
+    n_notes = int(els[8])
+    for n in range(n_notes):
+      score_map[els[-(1 + n)].split('-')[-1]] = (matching.pitch_word_to_pitch(els[-(1 + 2 * n_notes + n)]), second)
+  return score_map
+
+
+def line_read_match(match_file):
+  rows = []
+  with open(match_file, 'r') as f:
+    lines = f.readlines()
+  for line in lines[4:]:
+    els = line.split()
+    if els[0] == '//Missing':
+      rows.append((None, None, els[-1].split('-')[-1]))
+    else:
+      score_id = els[9].split('-')[-1] if els[9] != '*' else None
+      rows.append((float(els[1]), matching.pitch_word_to_pitch(els[3]), score_id))
+  return rows
+
+
+def test_column_readers_match_line_parsers():
+  corresp_path = os.path.join(EXAMPLE_DIR, 'Ali01_corresp.txt')
+  fmt3x_path = os.path.join(EXAMPLE_DIR, 'score_fmt3x.txt')
+  match_path = os.path.join(EXAMPLE_DIR, 'Ali01_match.txt')
+  assert matching.read_corresp(corresp_path) == line_read_corresp(corresp_path)
+  assert matching.read_fmt3x(fmt3x_path) == line_read_fmt3x(fmt3x_path)
+  pairs = matching.read_match(match_path)
+  assert [(el.perform_second, el.perform_pitch, el.score_id) for el in pairs] == line_read_match(match_path)
+
+  match_columns = matching.read_match_columns(match_path)
+  assert len(match_columns) == len(pairs)
+  missing = match_columns.perform_ids < 0
+  assert np.isnan(match_columns.onsets[missing]).all() and (match_columns.error_index[missing] == -1).all()
+  score_columns = matching.read_corresp_columns(corresp_path)
+  pitches, seconds = score_columns.lookup(match_columns.score_ids)
+  score_map = line_read_corresp(corresp_path)
+  for score_id, pitch, second in zip(match_columns.score_ids.tolist(), pitches.tolist(), seconds.tolist()):
+    if score_id < 0:
+      assert math.isnan(second)
+    else:
+      assert (pitch, second) == score_map[str(score_id)]
+
+
+def test_batch_resolution_matches_per_pair(tmp_path, monkeypatch):
+  rng = random.Random(2)
+  # resolution starts from the note before the window, which matches whenever it has the
+  # pitch, so neighbouring score notes get different pitches here
+  pitches = [40 + (i * 7) % 50 for i in range(200)]
+  notes = [mock_note(pitch, i * 0.5) for i, pitch in enumerate(pitches)]
+  xml_sequence = types.SimpleNamespace(notes=notes, xml_path=str(tmp_path / 'score.musicxml'))
+  (tmp_path / 'score.mid').write_text('')
+  perform_midi_path = write_performance(str(tmp_path / 'a01.mid'),
+                                        [(pitch, 1 + i * 0.5 + rng.uniform(0, 0.2)) for i, pitch in enumerate(pitches)])
+  monkeypatch.setattr(matching, 'match', write_alignment)
+
+  batch = matching.PerformPair(xml_sequence, perform_midi_path)
+  each = matching.PerformPair(xml_sequence, perform_midi_path, batch=False)
+  assert batch.score_pair_indices()[0].tolist() == list(range(len(notes)))
+  for batch_indices, each_indices in zip(batch.score_pair_indices(), each.score_pair_indices()):
+    assert batch_indices.tolist() == each_indices.tolist()
+  assert batch.midi_note_indices.tolist() == each.midi_note_indices.tolist()
+  assert batch.score_note_indices.tolist() == each.score_note_indices.tolist()
@@ -0,0 +1,70 @@
+"""Pedal control change post-processing for rendered and performed MIDI.
+
+  python pedal.py performance.mid filtered.mid
+"""
+from __future__ import division
+
+import argparse
+
+import numpy as np
+import pretty_midi
+
+PEDAL_THRESHOLD = 75  # values below this count as pedal off
+DISKLAVIER_MIN_INTERVAL = 0.3  # seconds
+
+
+def filter_pedals(control_changes, quantize=True, disklavier=True, threshold=PEDAL_THRESHOLD,
+                  min_interval=DISKLAVIER_MIN_INTERVAL):
+  """Return new, time-sorted ControlChanges with the pedal post-processing applied.
+
+  quantize: values below threshold become 0.
+  disklavier: drop a pedal-on event that follows the previous pedal-off of the same
+  controller by less than min_interval seconds, which the Disklavier cannot reproduce.
+  Events before min_interval are left alone and do not count as a previous off.
+
+  The input list and its ControlChange objects are not modified. Ties in time keep their
+  input order.
+  """
+  numbers = np.asarray([el.number for el in control_changes], dtype=np.int64)
+  values = np.asarray([el.value for el in control_changes], dtype=np.int64)
+  times = np.asarray([el.time for el in control_changes], dtype=np.float64)
+  order = np.argsort(times, kind='stable')
+  numbers, values, times = numbers[order], values[order], times[order]
+
+  is_off = values < threshold
+  if quantize:
+    values = np.where(is_off, 0, values)
+
+  keep = np.ones(len(times), dtype=bool)
+  if disklavier:
+    considered = times >= min_interval
+    for number in np.unique(numbers):
+      rows = np.nonzero(numbers == number)[0]
+      off_times = np.where(is_off[rows] & considered[rows], times[rows], -np.inf)
+      previous_off = np.maximum.accumulate(off_times)
+      previous_off[np.isneginf(previous_off)] = 0
+      too_soon = ~is_off[rows] & considered[rows] & (times[rows] - previous_off < min_interval)
+      keep[rows[too_soon]] = False
+
+  return [pretty_midi.ControlChange(number=int(number), value=int(value), time=float(time))
+          for number, value, time in zip(numbers[keep], values[keep], times[keep])]
+
+
+def filter_midi_pedals(midi, quantize=True, disklavier=True):
+  """Apply filter_pedals to every instrument of a PrettyMIDI object, in place."""
+  for instrument in midi.instruments:
+    instrument.control_changes = filter_pedals(instrument.control_changes, quantize, disklavier)
+  return midi
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument("input_midi")
+  parser.add_argument("output_midi")
+  parser.add_argument("--no_quantize", action='store_true')
+  parser.add_argument("--no_disklavier", action='store_true')
+  args = parser.parse_args()
+
+  performance = pretty_midi.PrettyMIDI(args.input_midi)
+  filter_midi_pedals(performance, not args.no_quantize, not args.no_disklavier)
+  performance.write(args.output_midi)
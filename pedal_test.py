@@ -0,0 +1,52 @@
+import random
+
+import pretty_midi
+
+import pedal
+
+
+def reference_filter(control_changes, threshold=75, min_interval=0.3):
+  """Per-controller quantize + disklavier pass, one event at a time."""
+  events = sorted(control_changes, key=lambda x: x.time)
+  previous_off_time = dict()
+  kept = []
+  for event in events:
+    value = 0 if event.value < threshold else event.value
+    if event.time >= min_interval:
+      if value < threshold:
+        previous_off_time[event.number] = event.time
+      elif event.time - previous_off_time.get(event.number, 0) < min_interval:
+        continue
+    kept.append((event.number, value, event.time))
+  return kept
+
+
+def random_pedals(num_events, seed):
+  rng = random.Random(seed)
+  return [pretty_midi.ControlChange(number=rng.choice([64, 67]), value=rng.randrange(128),
+                                    time=round(rng.uniform(0, num_events * 0.1), 2))
+          for _ in range(num_events)]
+
+
+def test_filter_matches_reference():
+  for seed in range(20):
+    control_changes = random_pedals(300, seed)
+    filtered = pedal.filter_pedals(control_changes)
+    assert [(el.number, el.value, el.time) for el in filtered] == reference_filter(control_changes)
+
+
+def test_consecutive_too_soon_events_are_all_dropped():
+  # list.remove while iterating used to skip the event after each removal
+  control_changes = [pretty_midi.ControlChange(64, 0, 1.0),
+                     pretty_midi.ControlChange(64, 127, 1.1),
+                     pretty_midi.ControlChange(64, 127, 1.2),
+                     pretty_midi.ControlChange(64, 127, 1.5)]
+  filtered = pedal.filter_pedals(control_changes)
+  assert [(el.value, el.time) for el in filtered] == [(0, 1.0), (127, 1.5)]
+
+
+def test_input_is_not_modified():
+  control_changes = random_pedals(50, 0)
+  before = [(el.number, el.value, el.time) for el in control_changes]
+  pedal.filter_pedals(control_changes)
+  assert [(el.number, el.value, el.time) for el in control_changes] == before
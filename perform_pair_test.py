@@ -0,0 +1,100 @@
+import os
+import types
+
+import pretty_midi
+
+import alignment
+import matching
+
+
+def mock_note(pitch, second, is_overlapped=False):
+  note_duration = types.SimpleNamespace(time_position=second, xml_position=int(second * 100), grace_order=0)
+  return types.SimpleNamespace(pitch=('X', pitch), note_duration=note_duration, is_overlapped=is_overlapped,
+                               measure_number=0)
+
+
+def write_performance(path, notes):
+  performance = pretty_midi.PrettyMIDI()
+  instrument = pretty_midi.Instrument(program=0)
+  for pitch, start in notes:
+    instrument.notes.append(pretty_midi.Note(64, pitch, start, start + 0.3))
+  performance.instruments.append(instrument)
+  performance.write(path)
+  return path
+
+
+def test_dtw_pairs_keep_aligned_score_indices(tmp_path):
+  # notes 0 and 1 are duplicates; mark_duplicate_notes marks the earlier one as overlapped
+  notes = [mock_note(60, 0.0, is_overlapped=True), mock_note(60, 0.0), mock_note(64, 0.5)]
+  xml_sequence = types.SimpleNamespace(notes=notes, xml_path=str(tmp_path / 'score.musicxml'))
+  perform_midi_path = write_performance(str(tmp_path / 'perform.mid'), [(60, 1.0), (64, 1.6)])
+  for aligner in ['dtw', 'segmented']:
+    for batch in [True, False]:
+      perform_pair = matching.PerformPair(xml_sequence, perform_midi_path, batch=batch, aligner=aligner)
+      score_indices, midi_indices = perform_pair.score_pair_indices()
+      assert score_indices.tolist() == [1, 2]
+      assert midi_indices.tolist() == [0, 1]
+      assert not any(el.score_note.is_overlapped for el in perform_pair.score_pairs)
+
+
+def write_alignment(score_midi, perform_midi):
+  """Stand-in for matching.match: one score note per performed note, as AlignmentTool_v2 would write them."""
+  _, match_path, corresp_path = alignment.output_paths(score_midi, perform_midi)
+  notes = pretty_midi.PrettyMIDI(perform_midi).instruments[0].notes
+  with open(match_path, 'w') as f:
+    f.write('//Version: ScorePerfmMatch_v170104\n// Score: ./score_hmm.txt\n// Perfm: ./perform_spr.txt\n'
+            '// fmt3x: ./score_fmt3x.txt\n')
+    for i, note in enumerate(notes):
+      f.write('{}\t{}\t{}\t{}\t64\t0\t0\t0\t0\tP1-1-{}\t0\t0\n'.format(i, note.start, note.end,
+                                                                     pretty_midi.note_number_to_name(note.pitch), i))
+  with open(corresp_path, 'w') as f:
+    f.write('// alignID alignOntime alignSitch alignPitch alignOnvel refID refOntime refSitch refPitch refOnvel\n')
+    for i, note in enumerate(notes):
+      f.write('{}\t{}\tX\t{}\t64\t{}\t{}\tX\t{}\t64\t\n'.format(i, note.start, note.pitch, i, i * 0.5, note.pitch))
+
+
+def test_external_aligner_runs_for_every_unaligned_performance(tmp_path, monkeypatch):
+  notes = [mock_note(60, 0.0), mock_note(64, 0.5)]
+  xml_sequence = types.SimpleNamespace(notes=notes, xml_path=str(tmp_path / 'score.musicxml'))
+  (tmp_path / 'score.mid').write_text('')
+  (tmp_path / 'score_fmt3x.txt').write_text('')  # written by an earlier performance's alignment
+  perform_midi_paths = [write_performance(str(tmp_path / name), [(60, 1.0 + i), (64, 1.6 + i)])
+                        for i, name in enumerate(['a01.mid', 'a02.mid'])]
+  aligned = []
+
+  def stub_match(score_midi, perform_midi):
+    aligned.append(perform_midi)
+    write_alignment(score_midi, perform_midi)
+  monkeypatch.setattr(matching, 'match', stub_match)
+
+  for perform_midi_path in perform_midi_paths + perform_midi_paths:
+    perform_pair = matching.PerformPair(xml_sequence, perform_midi_path)
+    assert perform_pair.score_pair_indices()[0].tolist() == [0, 1]
+  assert aligned == perform_midi_paths
+
+
+def test_existing_alignment_is_reused_after_score_midi_is_written(tmp_path, monkeypatch):
+  notes = [mock_note(60, 0.0), mock_note(64, 0.5)]
+  score_midi_path = str(tmp_path / 'score.mid')
+  xml_sequence = types.SimpleNamespace(notes=notes, xml_path=str(tmp_path / 'score.musicxml'),
+                                       save_to_midi=lambda notes, path: open(path, 'w').close())
+  perform_midi_path = write_performance(str(tmp_path / 'a01.mid'), [(60, 1.0), (64, 1.6)])
+  write_alignment(score_midi_path, perform_midi_path)
+  # shipped alignments are older than the score.mid PerformPair writes next to them
+  for path in [perform_midi_path, perform_midi_path.replace('.mid', '_match.txt'),
+               perform_midi_path.replace('.mid', '_corresp.txt')]:
+    os.utime(path, (1000000000, 1000000000))
+  aligned = []
+  monkeypatch.setattr(matching, 'match', lambda score_midi, perform_midi: aligned.append(perform_midi))
+
+  perform_pair = matching.PerformPair(xml_sequence, perform_midi_path)
+  assert os.path.getmtime(score_midi_path) > os.path.getmtime(perform_midi_path.replace('.mid', '_match.txt'))
+  assert perform_pair.score_pair_indices()[0].tolist() == [0, 1]
+  assert aligned == []
+
+  # a performance re-recorded after its alignment is aligned again
+  os.utime(perform_midi_path, (1000000100, 1000000100))
+  monkeypatch.setattr(matching, 'match', lambda score_midi, perform_midi: (aligned.append(perform_midi),
+                                                                           write_alignment(score_midi, perform_midi)))
+  matching.PerformPair(xml_sequence, perform_midi_path)
+  assert aligned == [perform_midi_path]
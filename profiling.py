@@ -0,0 +1,219 @@
+"""Timing spans and counters for the score -> pair -> feature pipeline.
+
+  python profiling.py ./profile  # summarize the per-piece reports written by dataset.py --profile_dir
+
+Stages are wrapped in named spans (span() or @profiled) and sizes are recorded with
+count(). Everything is off until enable() is called; a disabled span() returns a shared
+no-op context and a disabled @profiled function calls straight through, so leaving the
+instrumentation in costs one global check per stage.
+
+Recorded spans and counters live in one module-level Profile per process. report()
+turns it into a JSON-ready dict, reset() starts a new one (one per piece in
+dataset.py), and corpus_summary() aggregates many reports into per-stage totals and
+percentiles across pieces. Span names use '.' for nesting ('xml_sequence.meta' runs
+inside 'xml_sequence'), so the totals of a span and its children overlap.
+"""
+from __future__ import division
+
+import argparse
+import functools
+import json
+import os
+import time
+
+import numpy as np
+
+SUMMARY_NAME = 'summary.json'
+
+
+class Profile(object):
+  def __init__(self):
+    self.spans = dict()  # name -> [calls, total seconds, max seconds]
+    self.counters = dict()
+
+  def add_span(self, name, elapsed, calls=1):
+    entry = self.spans.get(name)
+    if entry is None:
+      self.spans[name] = [calls, elapsed, elapsed]
+    else:
+      entry[0] += calls
+      entry[1] += elapsed
+      entry[2] = max(entry[2], elapsed)
+
+  def add_count(self, name, value=1):
+    self.counters[name] = self.counters.get(name, 0) + value
+
+  def merge(self, report):
+    """Add the spans and counters of a report() dict, e.g. one sent back by a worker process."""
+    for name, span_report in report['spans'].items():
+      self.add_span(name, span_report['total_s'], span_report['calls'])
+      entry = self.spans[name]
+      entry[2] = max(entry[2], span_report['max_s'])
+    for name, value in report['counters'].items():
+      self.add_count(name, value)
+
+  def report(self, **info):
+    spans = {name: {'calls': calls, 'total_s': total, 'max_s': longest}
+             for name, (calls, total, longest) in sorted(self.spans.items())}
+    report = dict(info)
+    report.update({'spans': spans, 'counters': dict(sorted(self.counters.items()))})
+    return report
+
+
+_enabled = False
+_profile = Profile()
+
+
+class _NullSpan(object):
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span(object):
+  __slots__ = ('name', 'start')
+
+  def __init__(self, name):
+    self.name = name
+
+  def __enter__(self):
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, *exc_info):
+    _profile.add_span(self.name, time.perf_counter() - self.start)
+    return False
+
+
+def enable():
+  global _enabled
+  _enabled = True
+
+
+def disable():
+  global _enabled
+  _enabled = False
+
+
+def is_enabled():
+  return _enabled
+
+
+def reset():
+  """Drop everything recorded so far and return it as a report."""
+  global _profile
+  previous = _profile.report()
+  _profile = Profile()
+  return previous
+
+
+def span(name):
+  """Context manager timing its block under name."""
+  if not _enabled:
+    return _NULL_SPAN
+  return _Span(name)
+
+
+def profiled(name):
+  """Decorator timing every call of the function under name."""
+  def decorate(fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+      if not _enabled:
+        return fn(*args, **kwargs)
+      with _Span(name):
+        return fn(*args, **kwargs)
+    return wrapper
+  return decorate
+
+
+def count(name, value=1):
+  if _enabled:
+    _profile.add_count(name, value)
+
+
+def merge(report):
+  if _enabled:
+    _profile.merge(report)
+
+
+def report(**info):
+  """The current profile as a dict; info (e.g. piece=...) is stored alongside."""
+  return _profile.report(**info)
+
+
+def write_report(path, **info):
+  directory = os.path.dirname(path)
+  if directory and not os.path.isdir(directory):
+    os.makedirs(directory)
+  tmp_path = path + '.tmp'
+  with open(tmp_path, 'w') as f:
+    json.dump(report(**info), f, indent=1)
+  os.replace(tmp_path, path)
+
+
+def corpus_summary(reports):
+  """Aggregate per-piece reports.
+
+  For every span: total seconds over the corpus, the number of pieces it ran in, and the
+  median, 90th percentile and maximum of its per-piece total. Counters are summed.
+  """
+  per_piece = dict()
+  counters = dict()
+  calls = dict()
+  for piece_report in reports:
+    for name, span_report in piece_report['spans'].items():
+      per_piece.setdefault(name, []).append(span_report['total_s'])
+      calls[name] = calls.get(name, 0) + span_report['calls']
+    for name, value in piece_report['counters'].items():
+      counters[name] = counters.get(name, 0) + value
+  spans = dict()
+  for name, totals in sorted(per_piece.items()):
+    totals = np.asarray(totals)
+    spans[name] = {'calls': calls[name], 'pieces': len(totals), 'total_s': float(totals.sum()),
+                   'p50_s': float(np.percentile(totals, 50)), 'p90_s': float(np.percentile(totals, 90)),
+                   'max_s': float(totals.max())}
+  return {'pieces': len(reports), 'spans': spans, 'counters': dict(sorted(counters.items()))}
+
+
+def read_reports(report_dir):
+  """Every per-piece report under report_dir (the summary itself excluded)."""
+  reports = []
+  for root, _, files in sorted(os.walk(report_dir)):
+    for name in sorted(files):
+      if name.endswith('.json') and not (root == report_dir and name == SUMMARY_NAME):
+        with open(os.path.join(root, name), 'r') as f:
+          reports.append(json.load(f))
+  return reports
+
+
+def write_summary(report_dir):
+  summary = corpus_summary(read_reports(report_dir))
+  with open(os.path.join(report_dir, SUMMARY_NAME), 'w') as f:
+    json.dump(summary, f, indent=1)
+  return summary
+
+
+def print_summary(summary):
+  print('{} pieces'.format(summary['pieces']))
+  print('{:<32}{:>8}{:>8}{:>12}{:>10}{:>10}{:>10}'.format('span', 'calls', 'pieces', 'total (s)', 'p50', 'p90',
+                                                         'max'))
+  for name, span_report in sorted(summary['spans'].items(), key=lambda x: -x[1]['total_s']):
+    print('{:<32}{:>8}{:>8}{:>12.3f}{:>10.3f}{:>10.3f}{:>10.3f}'.format(
+      name, span_report['calls'], span_report['pieces'], span_report['total_s'], span_report['p50_s'],
+      span_report['p90_s'], span_report['max_s']))
+  for name, value in summary['counters'].items():
+    print('{:<32}{:>8}'.format(name, value))
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument("report_dir")
+  args = parser.parse_args()
+
+  print_summary(write_summary(args.report_dir))
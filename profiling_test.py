@@ -0,0 +1,65 @@
+import json
+import os
+
+import profiling
+
+
+def setup_function(_):
+  profiling.reset()
+
+
+def teardown_function(_):
+  profiling.disable()
+  profiling.reset()
+
+
+@profiling.profiled('double')
+def double(value):
+  return value * 2
+
+
+def test_disabled_records_nothing():
+  profiling.disable()
+  with profiling.span('block'):
+    pass
+  assert double(2) == 4
+  profiling.count('notes', 10)
+  assert profiling.report() == {'spans': {}, 'counters': {}}
+
+
+def test_spans_and_counters():
+  profiling.enable()
+  for _ in range(3):
+    with profiling.span('block'):
+      double(1)
+  profiling.count('notes', 10)
+  profiling.count('notes', 5)
+  report = profiling.report(piece='a')
+  assert report['piece'] == 'a'
+  assert report['spans']['block']['calls'] == 3
+  assert report['spans']['double']['calls'] == 3
+  assert report['spans']['block']['total_s'] >= report['spans']['double']['total_s']
+  assert report['counters'] == {'notes': 15}
+
+
+def test_merge_and_corpus_summary(tmpdir):
+  profiling.enable()
+  with profiling.span('block'):
+    pass
+  profiling.count('notes', 1)
+  worker_report = profiling.reset()
+  profiling.merge(worker_report)
+  profiling.merge(worker_report)
+  profiling.write_report(os.path.join(str(tmpdir), 'piece_a.json'), piece='a')
+  profiling.reset()
+  profiling.count('notes', 3)
+  profiling.write_report(os.path.join(str(tmpdir), 'nested', 'piece_b.json'), piece='b')
+
+  summary = profiling.write_summary(str(tmpdir))
+  assert summary['pieces'] == 2
+  assert summary['counters'] == {'notes': 5}
+  assert summary['spans']['block']['calls'] == 2
+  assert summary['spans']['block']['pieces'] == 1
+  with open(os.path.join(str(tmpdir), profiling.SUMMARY_NAME)) as f:
+    assert json.load(f) == summary
+  assert profiling.write_summary(str(tmpdir))['pieces'] == 2  # the summary is not read back as a piece
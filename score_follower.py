@@ -0,0 +1,217 @@
+"""Online score following: align performed notes to a score one event at a time.
+
+  python score_follower.py --xml_path score.musicxml --perform_midi performance.mid --speed 4
+
+ScoreFollower keeps forward costs over a fixed window of score chords around its current
+position and a running tempo estimate, so the work per event is bounded by the window
+size no matter how long the piece is. replay() feeds a MIDI file through a follower at real-time
+or accelerated speed and reports per-event latency percentiles.
+"""
+from __future__ import division
+
+import argparse
+import time
+
+import numpy as np
+import pretty_midi
+
+import matching
+
+
+class ScoreFollower(object):
+  """Incremental score-to-performance alignment.
+
+  score_onsets are in score seconds (note_duration.time_position). Emitted pairs carry
+  score_ids[i] as score_note_idx for row i of score_onsets / score_pitches (i itself
+  when score_ids is None). score_notes, if given, is indexed by score_note_idx and
+  attached to the pairs as score_note.
+
+  The follower keeps a cost for every score chord in a window around its current
+  position, a Viterbi-style forward pass with one step per performed note. Moving from
+  chord c to chord d between two notes dt seconds apart costs timing_weight seconds per
+  second of difference between dt and the score interval scaled by the running tempo.
+  Lateness is weighted by late_weight, since players stretch far more often than they
+  rush. Each chord jumped over costs skip_penalty, each chord moved back back_penalty,
+  and a note whose pitch the chord does not hold (or no longer has unplayed) costs
+  pitch_penalty. The note is matched to the cheapest chord when that chord has an
+  unplayed note of its pitch, and is extra otherwise. The window spans look_back chords
+  before and look_ahead chords after the position, so the work per event is constant.
+  """
+  def __init__(self, score_onsets, score_pitches, score_notes=None, score_ids=None, look_back=4, look_ahead=16,
+               timing_weight=4.0, late_weight=0.25, skip_penalty=0.5, back_penalty=1.0, pitch_penalty=1.5,
+               tempo_smoothing=0.2):
+    score_onsets = np.asarray(score_onsets, dtype=np.float64)
+    score_pitches = np.asarray(score_pitches, dtype=np.int64)
+    self.score_notes = score_notes
+    self.score_ids = np.arange(len(score_onsets)) if score_ids is None else np.asarray(score_ids, dtype=np.int64)
+    order = np.argsort(score_onsets, kind='stable')
+    sorted_onsets = score_onsets[order]
+    new_chord = np.concatenate([[True], np.diff(sorted_onsets) > 1e-6])
+    self.chord_times = sorted_onsets[new_chord]
+    chord_of = np.cumsum(new_chord) - 1
+    # chord -> pitch -> unplayed score note indices
+    self.unplayed = [dict() for _ in range(len(self.chord_times))]
+    self.chord_pitches = [set() for _ in range(len(self.chord_times))]
+    for score_idx, chord in zip(order.tolist(), chord_of.tolist()):
+      pitch = int(score_pitches[score_idx])
+      self.unplayed[chord].setdefault(pitch, []).append(score_idx)
+      self.chord_pitches[chord].add(pitch)
+
+    self.look_back = look_back
+    self.look_ahead = look_ahead
+    self.timing_weight = timing_weight
+    self.late_weight = late_weight
+    self.skip_penalty = skip_penalty
+    self.back_penalty = back_penalty
+    self.pitch_penalty = pitch_penalty
+    self.tempo_smoothing = tempo_smoothing
+
+    self.position = 0
+    self.tempo = 1.0  # performance seconds per score second
+    self.anchor = None  # (score chord, performance second) of the latest match
+    self.window = None  # chord indices of the current costs
+    self.costs = None
+    self.last_onset = None
+    self.pairs = []
+    self.num_events = 0
+
+  @classmethod
+  def from_xml_sequence(cls, xml_sequence, **kwargs):
+    """Follower over the notes that are not overlapped; score_note_idx indexes xml_sequence.notes."""
+    score_ids = [i for i, el in enumerate(xml_sequence.notes) if not el.is_overlapped]
+    notes = [xml_sequence.notes[i] for i in score_ids]
+    return cls([el.note_duration.time_position for el in notes], [el.pitch[1] for el in notes], xml_sequence.notes,
+               score_ids, **kwargs)
+
+  def _emission(self, window, pitch):
+    costs = np.empty(len(window))
+    for i, chord in enumerate(window.tolist()):
+      if self.unplayed[chord].get(pitch):
+        costs[i] = 0
+      elif pitch in self.chord_pitches[chord]:
+        costs[i] = self.pitch_penalty / 2
+      else:
+        costs[i] = self.pitch_penalty
+    return costs
+
+  def _step(self, pitch, onset):
+    """Advance the forward costs by one note and return the cheapest chord."""
+    first = max(self.position - self.look_back, 0)
+    window = np.arange(first, min(self.position + self.look_ahead + 1, len(self.chord_times)))
+    if self.costs is None:
+      transition = self.skip_penalty * window.astype(np.float64)
+    else:
+      dt = onset - self.last_onset
+      expected = (self.chord_times[window][None, :] - self.chord_times[self.window][:, None]) * self.tempo
+      lateness = dt - expected
+      timing = self.timing_weight * np.where(lateness > 0, lateness * self.late_weight, -lateness)
+      jump = window[None, :] - self.window[:, None]
+      moves = self.skip_penalty * np.maximum(jump - 1, 0) + self.back_penalty * np.maximum(-jump, 0)
+      transition = (self.costs[:, None] + timing + moves).min(axis=0)
+    costs = transition + self._emission(window, pitch)
+    self.costs = costs - costs.min()
+    self.window = window
+    self.last_onset = onset
+    return int(window[np.argmin(costs)])
+
+  def _update_tempo(self, chord, onset):
+    if self.anchor is not None:
+      anchor_chord, anchor_second = self.anchor
+      score_interval = self.chord_times[chord] - self.chord_times[anchor_chord]
+      if score_interval > 0 and onset > anchor_second:
+        local_tempo = (onset - anchor_second) / score_interval
+        # pauses and fermatas are not tempo changes
+        if self.tempo / 2 <= local_tempo <= self.tempo * 2:
+          self.tempo += self.tempo_smoothing * (local_tempo - self.tempo)
+    if self.anchor is None or chord > self.anchor[0]:
+      self.anchor = (chord, onset)
+
+  def on_note(self, pitch, onset, midi_note=None):
+    """Consume one performed note and return its Pair (score_note None for extra notes).
+
+    midi_note_idx is the event number, counting from 0.
+    """
+    pair = matching.Pair()
+    pair.perform_pitch = pitch
+    pair.perform_second = onset
+    pair.midi_note = midi_note
+    pair.midi_note_idx = self.num_events
+    self.num_events += 1
+
+    chord = self._step(pitch, onset)
+    self.position = chord
+    score_indices = self.unplayed[chord].get(pitch)
+    if score_indices:
+      pair.score_note_idx = int(self.score_ids[score_indices.pop(0)])
+      pair.score_pitch = pitch
+      pair.score_second = float(self.chord_times[chord])
+      if self.score_notes is not None:
+        pair.score_note = self.score_notes[pair.score_note_idx]
+      self._update_tempo(chord, onset)
+    self.pairs.append(pair)
+    return pair
+
+  def missing_pairs(self):
+    """Pairs for score notes before the current position that were never played."""
+    pairs = []
+    for chord in range(self.position):
+      for pitch, score_indices in self.unplayed[chord].items():
+        for score_idx in score_indices:
+          pair = matching.Pair()
+          pair.score_note_idx = int(self.score_ids[score_idx])
+          pair.score_pitch = pitch
+          pair.score_second = float(self.chord_times[chord])
+          if self.score_notes is not None:
+            pair.score_note = self.score_notes[pair.score_note_idx]
+          pairs.append(pair)
+    return pairs
+
+
+def latency_summary(latencies):
+  latencies = np.asarray(latencies) * 1000
+  if len(latencies) == 0:
+    return {'events': 0}
+  return {'events': len(latencies),
+          'p50_ms': float(np.percentile(latencies, 50)),
+          'p90_ms': float(np.percentile(latencies, 90)),
+          'p99_ms': float(np.percentile(latencies, 99)),
+          'max_ms': float(latencies.max())}
+
+
+def replay(follower, perform_notes, speed=1.0):
+  """Feed perform_notes to follower in onset order, at speed times real time.
+
+  speed None feeds events back to back. Returns (pairs, latency summary); latency is the
+  time spent inside on_note for each event.
+  """
+  notes = sorted(perform_notes, key=lambda note: note.start)
+  pairs = []
+  latencies = []
+  start_clock = time.perf_counter()
+  first_onset = notes[0].start if notes else 0
+  for note in notes:
+    if speed:
+      wait = (note.start - first_onset) / speed - (time.perf_counter() - start_clock)
+      if wait > 0:
+        time.sleep(wait)
+    event_start = time.perf_counter()
+    pairs.append(follower.on_note(note.pitch, note.start, note))
+    latencies.append(time.perf_counter() - event_start)
+  return pairs, latency_summary(latencies)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--xml_path", required=True)
+  parser.add_argument("--perform_midi", required=True)
+  parser.add_argument("--speed", type=float, default=1.0, help='0 feeds events without waiting')
+  args = parser.parse_args()
+
+  import xml_data
+  score_follower = ScoreFollower.from_xml_sequence(xml_data.XmlNoteSequence(args.xml_path))
+  performance = pretty_midi.PrettyMIDI(args.perform_midi)
+  replay_pairs, summary = replay(score_follower, performance.instruments[0].notes, args.speed or None)
+  matched = sum(1 for el in replay_pairs if el.score_note_idx is not None)
+  print('{} events, {} matched, {} missing so far'.format(len(replay_pairs), matched,
+                                                          len(score_follower.missing_pairs())))
+  print(summary)
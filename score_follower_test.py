@@ -0,0 +1,62 @@
+import random
+import types
+
+import numpy as np
+import pretty_midi
+
+import score_follower
+
+
+def synthetic_performance(num_chords, seed, tempo=1.2):
+  rng = random.Random(seed)
+  score_onsets, score_pitches = [], []
+  for chord in range(num_chords):
+    for pitch in rng.sample(range(40, 90), rng.choice([1, 1, 2, 3])):
+      score_onsets.append(chord * 0.25)
+      score_pitches.append(pitch)
+  score_onsets = np.asarray(score_onsets)
+  onsets = score_onsets * tempo + np.asarray([rng.uniform(0, 0.03) for _ in score_onsets])
+  order = np.argsort(onsets, kind='stable')
+  notes = [pretty_midi.Note(64, score_pitches[i], onsets[i], onsets[i] + 0.2) for i in order]
+  return score_onsets, np.asarray(score_pitches), notes, order
+
+
+def test_follows_performance():
+  score_onsets, score_pitches, notes, truth = synthetic_performance(500, 0)
+  follower = score_follower.ScoreFollower(score_onsets, score_pitches)
+  pairs, summary = score_follower.replay(follower, notes, speed=None)
+  matched = np.asarray([-1 if el.score_note_idx is None else el.score_note_idx for el in pairs])
+  assert (matched == truth).mean() > 0.99
+  assert summary['events'] == len(notes)
+  assert follower.missing_pairs() == []
+
+
+def test_extra_notes_and_skipped_chords():
+  score_onsets, score_pitches, notes, truth = synthetic_performance(300, 1)
+  skipped = set(np.nonzero(score_onsets == score_onsets[120])[0].tolist())
+  played = [el for el, score_idx in zip(notes, truth) if score_idx not in skipped]
+  played.insert(50, pretty_midi.Note(64, 100, played[50].start + 0.01, played[50].start + 0.1))
+  follower = score_follower.ScoreFollower(score_onsets, score_pitches)
+  pairs, _ = score_follower.replay(follower, played, speed=None)
+  assert [el.score_note_idx for el in pairs if el.perform_pitch == 100] == [None]
+  assert skipped == set(el.score_note_idx for el in follower.missing_pairs())
+
+
+def test_pairs_index_xml_sequence_notes():
+  score_onsets, score_pitches, notes, truth = synthetic_performance(100, 2)
+  xml_notes = []
+  for onset, pitch in zip(score_onsets.tolist(), score_pitches.tolist()):
+    note_duration = types.SimpleNamespace(time_position=onset)
+    xml_notes.append(types.SimpleNamespace(pitch=('X', pitch), note_duration=note_duration, is_overlapped=False))
+  # an overlapped twin before the first note shifts every later index by one
+  twin = types.SimpleNamespace(pitch=xml_notes[0].pitch, note_duration=xml_notes[0].note_duration, is_overlapped=True)
+  xml_sequence = types.SimpleNamespace(notes=[twin] + xml_notes)
+
+  follower = score_follower.ScoreFollower.from_xml_sequence(xml_sequence)
+  pairs, _ = score_follower.replay(follower, notes[:-10], speed=None)
+  matched = np.asarray([-1 if el.score_note_idx is None else el.score_note_idx for el in pairs])
+  assert (matched == truth[:-10] + 1).mean() > 0.99
+  assert all(el.score_note is xml_sequence.notes[el.score_note_idx] for el in pairs if el.score_note is not None)
+  assert 0 not in matched
+  missing = follower.missing_pairs()
+  assert all(el.score_note is xml_sequence.notes[el.score_note_idx] for el in missing)
@@ -0,0 +1,124 @@
+"""Segmented alignment for long performances.
+
+The score is cut into segments at measure boundaries. A ScoreFollower pass over the
+performance, with constant memory, finds where each segment starts in the performance.
+Each segment is then aligned with dtw_alignment independently, padded on both the score
+and the performance side so that anchor errors and notes near the boundaries are
+covered, and the segment results are stitched back into one note pairing. Peak alignment
+memory is that of the largest segment, and segments run in parallel.
+"""
+from __future__ import division
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import dtw_alignment
+import score_follower
+
+SEGMENT_MEASURES = 16
+
+
+def measure_segments(measure_numbers, segment_measures=SEGMENT_MEASURES):
+  """Segment id of every note: consecutive runs of segment_measures measures."""
+  return np.asarray(measure_numbers, dtype=np.int64) // segment_measures
+
+
+def segment_anchors(score_onsets, score_pitches, score_segments, perform_onsets, perform_pitches):
+  """Performance second at which each segment starts, as an array of len(segments) + 1.
+
+  The first entry is -inf and the last +inf. Each inner anchor is the 5th percentile of
+  the onsets the follower matched into that segment; segments without matches take the
+  next anchor, and the anchors are made non-decreasing.
+  """
+  follower = score_follower.ScoreFollower(score_onsets, score_pitches)
+  num_segments = int(score_segments.max()) + 1
+  matched_onsets = [[] for _ in range(num_segments)]
+  for perform_idx in np.argsort(perform_onsets, kind='stable').tolist():
+    pair = follower.on_note(int(perform_pitches[perform_idx]), float(perform_onsets[perform_idx]))
+    if pair.score_note_idx is not None:
+      matched_onsets[score_segments[pair.score_note_idx]].append(pair.perform_second)
+  anchors = np.full(num_segments + 1, np.inf)
+  anchors[0] = -np.inf
+  for segment in range(num_segments - 1, 0, -1):
+    onsets = matched_onsets[segment]
+    anchors[segment] = np.percentile(onsets, 5) if onsets else anchors[segment + 1]
+  return np.maximum.accumulate(anchors)
+
+
+def _align_segment(args):
+  score_onsets, score_pitches, perform_onsets, perform_pitches, radius = args
+  return dtw_alignment.align_notes(score_onsets, score_pitches, perform_onsets, perform_pitches, radius=radius)
+
+
+def _segment_jobs(score_onsets, score_segments, perform_onsets, anchors, margin):
+  """(score rows, core score mask, perform rows) of every padded segment.
+
+  The performance range is the segment's anchor range widened by margin seconds. The
+  score range is widened by the same margin converted to score seconds with the
+  segment's average tempo, so both sides of the DTW cover roughly the same music.
+  """
+  bounds = anchors.copy()
+  bounds[0] = perform_onsets.min()
+  bounds[-1] = perform_onsets.max()
+  jobs = []
+  for segment in range(len(anchors) - 1):
+    core = score_segments == segment
+    score_start, score_end = score_onsets[core].min(), score_onsets[core].max()
+    tempo = max(bounds[segment + 1] - bounds[segment], 1e-3) / max(score_end - score_start, 1e-3)
+    score_rows = np.nonzero((score_onsets >= score_start - margin / tempo) &
+                            (score_onsets <= score_end + margin / tempo))[0]
+    perform_rows = np.nonzero((perform_onsets >= anchors[segment] - margin) &
+                              (perform_onsets < anchors[segment + 1] + margin))[0]
+    jobs.append((score_rows, core[score_rows], perform_rows))
+  return jobs
+
+
+def align_segmented(score_onsets, score_pitches, score_segments, perform_onsets, perform_pitches, margin=5.0,
+                    num_workers=None, radius=32):
+  """dtw_alignment.align_notes, one segment at a time.
+
+  score_segments gives the segment id of every score note (see measure_segments). Each
+  segment keeps only the matches of its own score notes; a performed note matched in two
+  segments keeps the match from the segment whose anchor range is nearest to it.
+  num_workers 1 runs the segments in this process, as does any call from a daemon
+  process (e.g. a multiprocessing.Pool worker), which may not start children.
+  Returns perform_to_score like align_notes.
+  """
+  score_onsets = np.asarray(score_onsets, dtype=np.float64)
+  score_pitches = np.asarray(score_pitches, dtype=np.int64)
+  perform_onsets = np.asarray(perform_onsets, dtype=np.float64)
+  perform_pitches = np.asarray(perform_pitches, dtype=np.int64)
+  perform_to_score = np.full(len(perform_onsets), -1, dtype=np.int64)
+  if len(score_onsets) == 0 or len(perform_onsets) == 0:
+    return perform_to_score
+  _, score_segments = np.unique(score_segments, return_inverse=True)
+  anchors = segment_anchors(score_onsets, score_pitches, score_segments, perform_onsets, perform_pitches)
+
+  jobs = _segment_jobs(score_onsets, score_segments, perform_onsets, anchors, margin)
+  args = [(score_onsets[score_rows], score_pitches[score_rows], perform_onsets[perform_rows],
+           perform_pitches[perform_rows], radius) for score_rows, _, perform_rows in jobs]
+  in_process = num_workers == 1 or multiprocessing.current_process().daemon
+  if in_process:
+    results = map(_align_segment, args)
+  else:
+    executor = ProcessPoolExecutor(max_workers=num_workers)
+    results = executor.map(_align_segment, args)
+
+  # seconds between each performed note and the anchor range of the segment it was matched in
+  distance = np.full(len(perform_onsets), np.inf)
+  try:
+    for segment, ((score_rows, core, perform_rows), segment_result) in enumerate(zip(jobs, results)):
+      matched = segment_result >= 0
+      matched[matched] = core[segment_result[matched]]
+      perform_idx = perform_rows[matched]
+      onsets = perform_onsets[perform_idx]
+      segment_distance = np.maximum(np.maximum(anchors[segment] - onsets, onsets - anchors[segment + 1]), 0)
+      take = segment_distance < distance[perform_idx]
+      perform_to_score[perform_idx[take]] = score_rows[segment_result[matched]][take]
+      distance[perform_idx[take]] = segment_distance[take]
+  finally:
+    if not in_process:
+      executor.shutdown()
+  return perform_to_score
@@ -0,0 +1,46 @@
+import multiprocessing
+
+import numpy as np
+
+import dtw_alignment
+import segmented_alignment
+from dtw_alignment_test import perform, synthetic_piece
+
+
+def test_matches_unsegmented_alignment():
+  score_onsets, score_pitches = synthetic_piece(800, 4)
+  onsets, pitches, truth = perform(score_onsets, score_pitches, 5)
+  segments = segmented_alignment.measure_segments(score_onsets // 1.0)  # one measure per second of score
+  perform_to_score = segmented_alignment.align_segmented(score_onsets, score_pitches, segments, onsets, pitches,
+                                                         num_workers=1)
+  assert (perform_to_score == truth).mean() > 0.99
+  whole = dtw_alignment.align_notes(score_onsets, score_pitches, onsets, pitches)
+  assert (perform_to_score == whole).mean() > 0.99
+
+
+def test_score_notes_are_matched_once():
+  score_onsets, score_pitches = synthetic_piece(300, 6)
+  onsets, pitches, _ = perform(score_onsets, score_pitches, 7)
+  segments = segmented_alignment.measure_segments(score_onsets // 1.0, segment_measures=4)
+  perform_to_score = segmented_alignment.align_segmented(score_onsets, score_pitches, segments, onsets, pitches,
+                                                         num_workers=2)
+  matched = perform_to_score[perform_to_score >= 0]
+  assert len(np.unique(matched)) == len(matched)
+
+
+def _align_in_pool_worker(seed):
+  score_onsets, score_pitches = synthetic_piece(200, seed)
+  onsets, pitches, truth = perform(score_onsets, score_pitches, seed + 1)
+  segments = segmented_alignment.measure_segments(score_onsets // 1.0, segment_measures=4)
+  perform_to_score = segmented_alignment.align_segmented(score_onsets, score_pitches, segments, onsets, pitches)
+  return (perform_to_score == truth).mean()
+
+
+def test_runs_inside_pool_workers():
+  # pool workers are daemonic and may not start a process pool of their own
+  pool = multiprocessing.Pool(2)
+  try:
+    assert min(pool.map(_align_in_pool_worker, [8, 9])) > 0.99
+  finally:
+    pool.close()
+    pool.join()
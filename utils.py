@@ -14,9 +14,6 @@ def extract_directions_by_keywords(directions, keywords):
 
 
 def check_direction_by_keywords(dir, keywords):
-  def _standardize(word):
-    return word.replace(',', '').replace('.', '').lower()
-
   if dir.type['type'] in keywords:
     return True
   elif dir.type['type'] == 'words':
@@ -35,6 +32,43 @@ def check_direction_by_keywords(dir, keywords):
         return True
 
 
+def _standardize(word):
+  return word.replace(',', '').replace('.', '').lower()
+
+
+class DirectionClassifier(object):
+  """Tags directions with every keyword category they match, in one pass per direction.
+
+  categories is a list of (name, keywords). A direction matches a category exactly when
+  check_direction_by_keywords(direction, keywords) would be true.
+  """
+  def __init__(self, categories):
+    self.names = [el[0] for el in categories]
+    self.exact = dict()
+    substrings = []
+    for name, keywords in categories:
+      for key in keywords:
+        self.exact.setdefault(key, set()).add(name)
+        if len(key) > 2:
+          substrings.append((key, name))
+    self.automaton = KeywordAutomaton(substrings)
+
+  def classify(self, direction):
+    type_name = direction.type['type']
+    matched = set(self.exact.get(type_name, ()))
+    if type_name == 'words':
+      content = direction.type['content']
+      standardized = _standardize(content)
+      matched.update(self.exact.get(standardized, ()))
+      for w in standardized.split(' '):
+        matched.update(self.exact.get(w, ()))
+      matched.update(self.automaton.find_all(content))
+    return matched
+
+  def classify_all(self, directions):
+    return [self.classify(el) for el in directions]
+
+
 def find_index_list_of_list(element, in_list):
   # isuni = isinstance(element, unicode) # for python 2.7
   if element in in_list:
@@ -58,4 +92,91 @@ def direction_words_flatten(note_attribute):
         flatten_words = flatten_words + ' ' + rel.type['content']
       else:
         flatten_words = flatten_words + ' ' + rel.type['type']
-  return flatten_words
\ No newline at end of file
+  return flatten_words
+
+class DirectionContext(object):
+  """Absolute direction plus covering relative directions, shared by every note with the same state.
+
+  The flattened word string and the embedding vectors are computed on first use and then
+  kept, so feature extraction for the notes sharing a context is a lookup.
+  """
+  def __init__(self, absolute, relative):
+    self.absolute = absolute
+    self.relative = tuple(relative)
+    self._words = None
+    self._vectors = dict()
+
+  @property
+  def words(self):
+    if self._words is None:
+      self._words = direction_words_flatten(self)
+    return self._words
+
+  def vector(self, embedder):
+    vector = self._vectors.get(embedder)
+    if vector is None:
+      vector = embedder(self.words)
+      self._vectors[embedder] = vector
+    return list(vector)
+
+  def __getstate__(self):
+    # embedders are per process; only the direction state is persisted
+    return {'absolute': self.absolute, 'relative': self.relative}
+
+  def __setstate__(self, state):
+    self.__init__(state['absolute'], state['relative'])
+
+
+def intern_direction_context(contexts, note_attribute):
+  """Return the DirectionContext for note_attribute (a note's dynamic or tempo), creating it once.
+
+  contexts is the intern table; relative directions are compared by identity.
+  """
+  key = (note_attribute.absolute, tuple(id(el) for el in note_attribute.relative))
+  context = contexts.get(key)
+  if context is None:
+    context = DirectionContext(note_attribute.absolute, note_attribute.relative)
+    contexts[key] = context
+  return context
+
+
+class KeywordAutomaton(object):
+  """Aho-Corasick automaton reporting every keyword that occurs as a substring of a text.
+
+  Each keyword maps to a payload; find_all() returns the payloads of all keywords found,
+  in a single pass over the text.
+  """
+  def __init__(self, keywords):
+    self.goto = [dict()]
+    self.fail = [0]
+    self.output = [[]]
+    for keyword, payload in keywords:
+      state = 0
+      for char in keyword:
+        if char not in self.goto[state]:
+          self.goto.append(dict())
+          self.fail.append(0)
+          self.output.append([])
+          self.goto[state][char] = len(self.goto) - 1
+        state = self.goto[state][char]
+      self.output[state].append(payload)
+
+    queue = list(self.goto[0].values())
+    for state in queue:
+      for char, next_state in self.goto[state].items():
+        queue.append(next_state)
+        fallback = self.fail[state]
+        while fallback and char not in self.goto[fallback]:
+          fallback = self.fail[fallback]
+        self.fail[next_state] = self.goto[fallback].get(char, 0)
+        self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+  def find_all(self, text):
+    found = []
+    state = 0
+    for char in text:
+      while state and char not in self.goto[state]:
+        state = self.fail[state]
+      state = self.goto[state].get(char, 0)
+      found.extend(self.output[state])
+    return found
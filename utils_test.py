@@ -0,0 +1,67 @@
+import random
+import types
+from collections import Counter
+
+import constants
+import utils
+
+# the categories of xml_data.DIRECTION_CLASSIFIER (xml_data itself needs musicXML_parser)
+CATEGORIES = [('abs_tempo', constants.ABS_TEMPOS),
+              ('rel_tempo', constants.REL_TEMPOS),
+              ('abs_dynamic', constants.ABS_DYNAMICS + ['dynamic']),
+              ('rel_dynamic', constants.REL_DYNAMCIS)]
+
+WORDS = ['Allegro', 'allegro ma non troppo', 'Tempo I', 'tempo i.', 'a tempo', 'sempre più mosso', 'poco più mosso',
+         'rit.', 'Ritardando', 'rall, poco a poco', 'cresc.', 'CRESC', 'dim. e rit.', 'dimin', 'sotto voce',
+         'mezza voce', 'con fuoco', 'Smorzando', 'p', 'P', 'f', 'sf', 'sfz.', 'molto, espressivo', 'Freely, with expression',
+         'Freely, with expression.', 'agitato e appassionato', 'stretto', 'leggiero', '', ' ', 'acc', 'accelerando']
+
+
+def stub_direction(type_name, content):
+  return types.SimpleNamespace(type={'type': type_name, 'content': content})
+
+
+def stub_directions(rng, num_random):
+  directions = [stub_direction('words', el) for el in WORDS]
+  directions += [stub_direction('dynamic', el) for el in ['p', 'ff', 'sfz', 'fp']]
+  directions += [stub_direction(type_name, content) for type_name in ['crescendo', 'diminuendo', 'pedal', 'none']
+                 for content in ['start', 'stop']]
+  fragments = [el for _, keywords in CATEGORIES for el in keywords] + ['molto', 'poco', 'e', 'sempre']
+  for _ in range(num_random):
+    words = [rng.choice(fragments) for _ in range(rng.randrange(1, 4))]
+    words = [el.upper() if rng.random() < 0.2 else el for el in words]
+    content = rng.choice([' ', ', ', '. ']).join(words) + rng.choice(['', '.', ','])
+    directions.append(stub_direction('words', content))
+  return directions
+
+
+def test_classifier_matches_keyword_checks():
+  classifier = utils.DirectionClassifier(CATEGORIES)
+  for direction in stub_directions(random.Random(0), 2000):
+    categories = classifier.classify(direction)
+    for name, keywords in CATEGORIES:
+      assert (name in categories) == bool(utils.check_direction_by_keywords(direction, keywords)), \
+          (direction.type, name)
+  assert classifier.classify_all([stub_direction('crescendo', 'start'), stub_direction('pedal', 'start')]) == \
+      [{'rel_dynamic'}, set()]
+
+
+def brute_force_find_all(keywords, text):
+  found = []
+  for keyword, payload in keywords:
+    found += [payload] * sum(text.startswith(keyword, i) for i in range(len(text)))
+  return found
+
+
+def test_automaton_reports_overlapping_keywords():
+  keywords = [(el, el) for el in ['he', 'she', 'his', 'hers']]
+  automaton = utils.KeywordAutomaton(keywords)
+  assert Counter(automaton.find_all('ushers')) == Counter(['she', 'he', 'hers'])
+  assert automaton.find_all('') == [] and automaton.find_all('xyz') == []
+
+  rng = random.Random(1)
+  for _ in range(200):
+    keywords = [(''.join(rng.choice('ab') for _ in range(rng.randrange(1, 5))), i) for i in range(rng.randrange(1, 6))]
+    automaton = utils.KeywordAutomaton(keywords)
+    text = ''.join(rng.choice('abc') for _ in range(rng.randrange(30)))
+    assert Counter(automaton.find_all(text)) == Counter(brute_force_find_all(keywords, text))
@@ -3,6 +3,9 @@
 
 from __future__ import division
 import copy
+import heapq
+import os
+import pickle
 import warnings
 import utils
 from utils import find_le_idx
@@ -11,20 +14,99 @@ import constants
 import pretty_midi
 from midi_utils import midi_utils
 from fractions import Fraction
+from cache import file_hash
+from note_table import NoteTable
+import pedal
+import profiling
+
+# bump whenever XmlMeta / XmlNotes / _apply_meta_to_notes change their output,
+# so cached sequences built by older code are rebuilt
+PROCESSING_VERSION = 3
 
 
 class XmlNoteSequence(object):
+  @profiling.profiled('xml_sequence')
   def __init__(self, xml_file):
     self.xml_path = xml_file
-    self.xml_doc = MusicXMLDocument(xml_file)
+    with profiling.span('xml_sequence.parse'):
+      self.xml_doc = MusicXMLDocument(xml_file)
     self.notes = []
     self.rests = []
-    self.meta = XmlMeta(self.xml_doc)
-    self._process_notes()
-    self._apply_meta_to_notes()
+    with profiling.span('xml_sequence.meta'):
+      self.meta = XmlMeta(self.xml_doc)
+    with profiling.span('xml_sequence.notes'):
+      self._process_notes()
+    with profiling.span('xml_sequence.apply_meta'):
+      self._apply_meta_to_notes()
 
     self.total_length = self.cal_total_xml_length(self.notes)
     self.num_notes = len(self.notes)
+    profiling.count('score_notes', self.num_notes)
+    profiling.count('directions', len(self.meta.directions))
+
+  @classmethod
+  def load(cls, xml_file, cache_dir=None):
+    """Build the sequence for xml_file, going through the on-disk cache if cache_dir is given."""
+    if cache_dir is None:
+      return cls(xml_file)
+    xml_hash = file_hash(xml_file)
+    cache_path = os.path.join(cache_dir, '{}-v{}.pkl'.format(xml_hash, PROCESSING_VERSION))
+    if os.path.isfile(cache_path):
+      try:
+        with profiling.span('xml_sequence.from_cache'):
+          sequence = cls.from_cache(cache_path, xml_file, xml_hash)
+        profiling.count('xml_cache_hits')
+        return sequence
+      except (ValueError, EOFError, pickle.UnpicklingError, AttributeError, ImportError) as e:
+        # stale, truncated or corrupt, or pickled from classes that have since changed
+        warnings.warn("Rebuilding stale XmlNoteSequence cache {}: {}".format(cache_path, e), RuntimeWarning)
+    profiling.count('xml_cache_misses')
+    sequence = cls(xml_file)
+    try:
+      if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+      sequence.to_cache(cache_path, xml_hash)
+    except Exception as e:
+      # unpicklable parser state or a disk error: the sequence itself is still good
+      warnings.warn("Could not write XmlNoteSequence cache {}: {}".format(cache_path, e), RuntimeWarning)
+    return sequence
+
+  def to_cache(self, cache_path, xml_hash=None):
+    if xml_hash is None:
+      xml_hash = file_hash(self.xml_path)
+    tmp_path = '{}.{}.tmp'.format(cache_path, os.getpid())
+    try:
+      with open(tmp_path, 'wb') as f:
+        pickle.dump({'version': PROCESSING_VERSION, 'xml_hash': xml_hash, 'sequence': self}, f,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+      os.replace(tmp_path, cache_path)
+    except BaseException:
+      if os.path.isfile(tmp_path):
+        os.remove(tmp_path)
+      raise
+
+  @classmethod
+  def from_cache(cls, cache_path, xml_file=None, xml_hash=None):
+    """Load a sequence written by to_cache().
+
+    If xml_file is given, the cache must have been built from its current content, and
+    the loaded sequence's xml_path is pointed at it. Raises ValueError for stale caches.
+    """
+    with open(cache_path, 'rb') as f:
+      cached = pickle.load(f)
+    if cached['version'] != PROCESSING_VERSION:
+      raise ValueError('processing version {} != {}'.format(cached['version'], PROCESSING_VERSION))
+    sequence = cached['sequence']
+    if xml_file is not None:
+      if xml_hash is None:
+        xml_hash = file_hash(xml_file)
+      if cached['xml_hash'] != xml_hash:
+        raise ValueError('{} changed since the cache was written'.format(xml_file))
+      sequence.xml_path = xml_file
+    return sequence
+
+  def to_note_table(self):
+    return NoteTable.from_xml_notes(self.notes)
 
   def _process_notes(self):
     processed_notes = XmlNotes(self.xml_doc)
@@ -57,37 +139,69 @@ class XmlNoteSequence(object):
     time_signatures = self.meta.time_signatures
     abs_dynamics = self.meta.abs_dynamics
     abs_tempos = self.meta.abs_tempo
+    time_signature_positions = [el.xml_position for el in time_signatures]
+    abs_dynamic_positions = [el.xml_position for el in abs_dynamics]
+    abs_tempo_positions = [el.xml_position for el in abs_tempos]
 
-    for note in self.notes:
+    dynamic_contexts = dict()
+    tempo_contexts = dict()
+    rel_dynamics_of_notes = self._covering_directions(self.notes, self.meta.rel_dynamics, include_end=True)
+    rel_tempos_of_notes = self._covering_directions(self.notes, self.meta.rel_tempo, include_end=False)
+
+    for note, rel_dynamics, rel_tempos in zip(self.notes, rel_dynamics_of_notes, rel_tempos_of_notes):
       note_position = note.note_duration.xml_position
 
-      idx = find_le_idx([el.xml_position for el in abs_dynamics], note_position)
+      idx = find_le_idx(abs_dynamic_positions, note_position)
       if idx is not None:
         note.dynamic.absolute = abs_dynamics[idx].type['content']
 
-      idx = find_le_idx([el.xml_position for el in abs_tempos], note_position)
+      idx = find_le_idx(abs_tempo_positions, note_position)
       if idx is not None:
         note.tempo.absolute = abs_tempos[idx].type['content']
 
-      idx = find_le_idx([el.xml_position for el in time_signatures], note_position)
+      idx = find_le_idx(time_signature_positions, note_position)
       if idx is not None:
         note.tempo.time_numerator = time_signatures[idx].numerator
         note.tempo.time_denominator = time_signatures[idx].denominator
 
-      # have to improve algorithm
-      for rel in self.meta.rel_dynamics:
-        try:
-          rel.end_xml_position
-        except:
-          print(rel.__dict__)
-        if rel.xml_position <= note_position <= rel.end_xml_position:
-          note.dynamic.relative.append(rel)
+      note.dynamic.relative.extend(rel_dynamics)
       if len(note.dynamic.relative) > 1:
         note = _divide_cresc_staff(note)
 
-      for rel in self.meta.rel_tempo:
-        if rel.xml_position <= note_position < rel.end_xml_position:
-          note.tempo.relative.append(rel)
+      note.tempo.relative.extend(rel_tempos)
+
+      note.dynamic_context = utils.intern_direction_context(dynamic_contexts, note.dynamic)
+      note.tempo_context = utils.intern_direction_context(tempo_contexts, note.tempo)
+
+  @staticmethod
+  def _covering_directions(notes, directions, include_end):
+    """For each note, the directions whose span covers its xml_position, in directions order.
+
+    A span runs from xml_position to end_xml_position, inclusive of the end if include_end.
+    Notes and directions are swept together in position order, keeping the open spans in
+    a heap keyed on their end, so this runs in O((notes + directions) log n).
+    """
+    direction_order = sorted(range(len(directions)), key=lambda i: directions[i].xml_position)
+    note_order = sorted(range(len(notes)), key=lambda i: notes[i].note_duration.xml_position)
+    covering = [None] * len(notes)
+    open_spans = []
+    next_direction = 0
+    previous_position = None
+    current = []
+    for i in note_order:
+      position = notes[i].note_duration.xml_position
+      if position != previous_position:
+        while next_direction < len(direction_order) and \
+            directions[direction_order[next_direction]].xml_position <= position:
+          idx = direction_order[next_direction]
+          heapq.heappush(open_spans, (directions[idx].end_xml_position, idx))
+          next_direction += 1
+        while open_spans and (open_spans[0][0] < position if include_end else open_spans[0][0] <= position):
+          heapq.heappop(open_spans)
+        current = [directions[idx] for idx in sorted(el[1] for el in open_spans)]
+        previous_position = position
+      covering[i] = current
+    return covering
 
   @staticmethod
   def cal_total_xml_length(xml_notes):
@@ -105,6 +219,7 @@ class XmlNoteSequence(object):
     return latest_end
 
   @staticmethod
+  @profiling.profiled('xml_sequence.save_to_midi')
   def save_to_midi(xml_notes, save_path, quantize_pedal=True, disklavier=True):
     mid = pretty_midi.PrettyMIDI()
     program = pretty_midi.instrument_name_to_program('Acoustic Grand Piano')
@@ -136,33 +251,23 @@ class XmlNoteSequence(object):
     mid.instruments.append(instrument)
 
     mid = midi_utils.save_note_pedal_to_CC(mid)
-    if quantize_pedal:
-      pedals = mid.instruments[0].control_changes
-      for pedal in pedals:
-        if pedal.value < 75:
-          pedal.value = 0
-
-    if disklavier:
-      pedals = mid.instruments[0].control_changes
-      pedals.sort(key=lambda x: x.time)
-      previous_off_time = 0
-      for pedal in pedals:
-        if pedal.time < 0.3:
-          continue
-        if pedal.value < 75:
-          previous_off_time = pedal.time
-        else:
-          time_passed = pedal.time - previous_off_time
-          if time_passed < 0.3:
-            pedals.remove(pedal)
-      mid.instruments[0].control_changes = pedals
+    mid.instruments[0].control_changes = pedal.filter_pedals(mid.instruments[0].control_changes,
+                                                             quantize_pedal, disklavier)
     mid.write(save_path)
 
 
+DIRECTION_CLASSIFIER = utils.DirectionClassifier([('abs_tempo', constants.ABS_TEMPOS),
+                                                   ('rel_tempo', constants.REL_TEMPOS),
+                                                   # 'dynamic' picks up every <dynamics> mark by its direction type
+                                                   ('abs_dynamic', constants.ABS_DYNAMICS + ['dynamic']),
+                                                   ('rel_dynamic', constants.REL_DYNAMCIS)])
+
+
 class XmlMeta(object):
   def __init__(self, xml_doc):
     self.xml_doc = xml_doc
     self.directions, self.time_signatures = self.extract_directions()
+    self.direction_categories = DIRECTION_CLASSIFIER.classify_all(self.directions)
     self.abs_dynamics, self.rel_dynamics = self.get_dynamics()
     self.abs_tempo, self.rel_tempo = self.get_tempos()
 
@@ -175,24 +280,17 @@ class XmlMeta(object):
 
     directions.sort(key=lambda x: x.xml_position)
     cleaned_direction = []
-    for i in range(len(directions)):
-      direction = directions[i]
+    wedge_types = dict()  # wedge number -> type of the latest crescendo / diminuendo with that number
+    for direction in directions:
       if direction.type is not None:
         if direction.type['type'] == "none":
-          for j in range(i):
-            prev_dir = directions[i - j - 1]
-            if 'number' in prev_dir.type.keys():
-              prev_key = prev_dir.type['type']
-              prev_num = prev_dir.type['number']
-            else:
-              continue
-            if prev_num == direction.type['number']:
-              if prev_key == "crescendo":
-                direction.type['type'] = 'crescendo'
-                break
-              elif prev_key == "diminuendo":
-                direction.type['type'] = 'diminuendo'
-                break
+          if direction.type['number'] in wedge_types:
+            direction.type['type'] = wedge_types[direction.type['number']]
+          else:
+            warnings.warn("wedge stop without a preceding wedge. xml_position: {}, number: {}".format(
+              direction.xml_position, direction.type['number']), RuntimeWarning)
+        if 'number' in direction.type and direction.type['type'] in ['crescendo', 'diminuendo']:
+          wedge_types[direction.type['number']] = direction.type['type']
         cleaned_direction.append(direction)
       else:
         warnings.warn("direction with empty type.\n{}".format(vars(direction.xml_direction)), RuntimeWarning)
@@ -200,9 +298,13 @@ class XmlMeta(object):
     time_signatures = self.xml_doc.get_time_signatures()
     return cleaned_direction, time_signatures
 
+  def _directions_in_category(self, category):
+    return [direction for direction, categories in zip(self.directions, self.direction_categories)
+            if category in categories]
+
   def get_tempos(self):
-    absolute_tempos = utils.extract_directions_by_keywords(self.directions, constants.ABS_TEMPOS)
-    relative_tempos = utils.extract_directions_by_keywords(self.directions, constants.REL_TEMPOS)
+    absolute_tempos = self._directions_in_category('abs_tempo')
+    relative_tempos = self._directions_in_category('rel_tempo')
 
     absolute_tempos_position = [tmp.xml_position for tmp in absolute_tempos]
     num_abs_tempos = len(absolute_tempos)
@@ -234,16 +336,25 @@ class XmlMeta(object):
 
   def get_dynamics(self):
     def _merge_start_end_of_direction(directions):
-      for i in range(len(directions)):
-        current_direction = directions[i]
+      # spans are paired with a stack per (type, number, staff), so nested spans close innermost first
+      open_spans = dict()
+      for current_direction in directions:
         type_name = current_direction.type['type']
-        if type_name in ['crescendo', 'diminuendo', 'pedal'] and current_direction.type['content'] == "stop":
-          for j in range(i):
-            prev_dir = directions[i - j - 1]
-            prev_type_name = prev_dir.type['type']
-            if type_name == prev_type_name and prev_dir.type['content'] == "start" and current_direction.staff == prev_dir.staff:
-              prev_dir.end_xml_position = current_direction.xml_position
-              break
+        if type_name not in ['crescendo', 'diminuendo', 'pedal']:
+          continue
+        key = (type_name, current_direction.type.get('number'), current_direction.staff)
+        if current_direction.type['content'] == "start":
+          open_spans.setdefault(key, []).append(current_direction)
+        elif current_direction.type['content'] == "stop":
+          if open_spans.get(key):
+            open_spans[key].pop().end_xml_position = current_direction.xml_position
+          else:
+            warnings.warn("{} stop without an open start. xml_position: {}, staff: {}".format(
+              type_name, current_direction.xml_position, current_direction.staff), RuntimeWarning)
+      for spans in open_spans.values():
+        for unclosed in spans:
+          warnings.warn("{} start is never stopped. xml_position: {}, staff: {}".format(
+            unclosed.type['type'], unclosed.xml_position, unclosed.staff), RuntimeWarning)
       dir_dummy = []
       for current_direction in directions:
         type_name = current_direction.type['type']
@@ -255,11 +366,8 @@ class XmlMeta(object):
       directions = dir_dummy
       return directions
 
-    temp_abs_key = constants.ABS_DYNAMICS
-    temp_abs_key.append('dynamic')  # TODO: what's the purpose?
-
-    absolute_dynamics = utils.extract_directions_by_keywords(self.directions, temp_abs_key)
-    relative_dynamics = utils.extract_directions_by_keywords(self.directions, constants.REL_DYNAMCIS)
+    absolute_dynamics = self._directions_in_category('abs_dynamic')
+    relative_dynamics = self._directions_in_category('rel_dynamic')
     abs_dynamic_dummy = []
     for abs in absolute_dynamics:
       if abs.type['content'] in ['sf', 'fz', 'sfz', 'sffz']:
@@ -378,29 +486,30 @@ class XmlNotes(object):
 
   def mark_after_grace_note_to_chord_notes(self):
     after_grace_notes = [el for el in self.notes if el.note_duration.after_grace_note]
+    chords = dict()
+    for note in self.notes:
+      chords.setdefault((note.note_duration.xml_position, note.voice), []).append(note)
     for note in after_grace_notes:
-      onset = note.note_duration.xml_position
-      voice = note.voice
-      chords = [el for el in self.notes if (el.note_duration.xml_position == onset and el.voice == voice)]
-      for chord_note in chords:
+      for chord_note in chords[(note.note_duration.xml_position, note.voice)]:
         chord_note.note_duration.after_grace_note = True
 
   def remove_tied_notes(self):
     removed_forward = []
+    tie_starts = dict()  # pitch -> latest kept note with tied_start
     for i in range(len(self.notes)):
       current_note = self.notes[i]
       if current_note.note_notations.tied_stop:
-        for j in reversed(range(len(removed_forward))):
-          if removed_forward[j].note_notations.tied_start and \
-             removed_forward[j].pitch[1] == current_note.pitch[1]:
-            removed_forward[j].note_duration.seconds += current_note.note_duration.seconds
-            removed_forward[j].note_duration.duration += current_note.note_duration.duration
-            removed_forward[j].note_duration.midi_ticks += current_note.note_duration.midi_ticks
-            break
-          if j == 0:
-            warnings.warn("Any note found to match tied_stop. note: {:d}".format(i), RuntimeWarning)
+        tie_start = tie_starts.get(current_note.pitch[1])
+        if tie_start is not None:
+          tie_start.note_duration.seconds += current_note.note_duration.seconds
+          tie_start.note_duration.duration += current_note.note_duration.duration
+          tie_start.note_duration.midi_ticks += current_note.note_duration.midi_ticks
+        elif removed_forward:
+          warnings.warn("Any note found to match tied_stop. note: {:d}".format(i), RuntimeWarning)
       else:
-        removed_forward.append(self.notes[i])
+        removed_forward.append(current_note)
+        if current_note.note_notations.tied_start:
+          tie_starts[current_note.pitch[1]] = current_note
     self.notes = removed_forward
 
   def mark_duplicate_notes(self):
@@ -0,0 +1,181 @@
+import os
+import pickle
+import sys
+import types
+import warnings
+
+import numpy as np
+import pytest
+
+import xml_data
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'examples')
+
+
+class Renamed(object):
+  """Pickled, then removed, like a class renamed since the cache was written."""
+
+
+def fake_init(self, xml_file):
+  self.xml_path = xml_file
+  self.notes = ['note']
+  self.num_notes = 1
+
+
+@pytest.fixture
+def xml_file(tmp_path, monkeypatch):
+  monkeypatch.setattr(xml_data.XmlNoteSequence, '__init__', fake_init)
+  path = tmp_path / 'score.musicxml'
+  path.write_text('<score-partwise/>')
+  return str(path)
+
+
+def cache_path(cache_dir, xml_file):
+  return str(cache_dir / '{}-v{}.pkl'.format(xml_data.file_hash(xml_file), xml_data.PROCESSING_VERSION))
+
+
+def test_cache_round_trip(tmp_path, xml_file):
+  sequence = xml_data.XmlNoteSequence(xml_file)
+  sequence.to_cache(str(tmp_path / 'sequence.pkl'))
+  loaded = xml_data.XmlNoteSequence.from_cache(str(tmp_path / 'sequence.pkl'), xml_file)
+  assert loaded.notes == ['note'] and loaded.xml_path == xml_file
+
+  with open(xml_file, 'w') as f:
+    f.write('<score-partwise version="3.1"/>')
+  with pytest.raises(ValueError):
+    xml_data.XmlNoteSequence.from_cache(str(tmp_path / 'sequence.pkl'), xml_file)
+
+
+def test_load_reuses_cache(tmp_path, xml_file):
+  first = xml_data.XmlNoteSequence.load(xml_file, str(tmp_path / 'cache'))
+  first.notes.append('cached')
+  assert xml_data.XmlNoteSequence.load(xml_file, str(tmp_path / 'cache')).notes == ['note']
+  with open(cache_path(tmp_path / 'cache', xml_file), 'rb') as f:
+    assert pickle.load(f)['sequence'].notes == ['note']
+
+
+@pytest.mark.parametrize('content', ['truncated', 'garbage', 'renamed_class'])
+def test_load_rebuilds_unreadable_cache(tmp_path, xml_file, monkeypatch, content):
+  cache_dir = tmp_path / 'cache'
+  xml_data.XmlNoteSequence.load(xml_file, str(cache_dir))
+  path = cache_path(cache_dir, xml_file)
+  if content == 'truncated':
+    with open(path, 'rb') as f:
+      data = f.read()
+    with open(path, 'wb') as f:
+      f.write(data[:len(data) // 2])
+  elif content == 'garbage':
+    with open(path, 'wb') as f:
+      f.write(b'not a pickle')
+  else:
+    with open(path, 'wb') as f:
+      pickle.dump({'version': xml_data.PROCESSING_VERSION, 'xml_hash': xml_data.file_hash(xml_file),
+                   'sequence': Renamed()}, f)
+    monkeypatch.delattr(sys.modules[__name__], 'Renamed')
+
+  with warnings.catch_warnings(record=True) as caught:
+    warnings.simplefilter('always')
+    sequence = xml_data.XmlNoteSequence.load(xml_file, str(cache_dir))
+  assert sequence.notes == ['note']
+  assert any('Rebuilding' in str(el.message) for el in caught)
+  # the rebuilt sequence replaced the unreadable file
+  assert xml_data.XmlNoteSequence.from_cache(path, xml_file).notes == ['note']
+
+
+def test_load_returns_sequence_when_cache_write_fails(tmp_path, xml_file, monkeypatch):
+  def failing_dump(obj, f, protocol=None):
+    f.write(b'partial')
+    raise pickle.PicklingError("can't pickle parser state")
+  monkeypatch.setattr(pickle, 'dump', failing_dump)
+  cache_dir = tmp_path / 'cache'
+
+  with pytest.warns(RuntimeWarning, match='Could not write'):
+    sequence = xml_data.XmlNoteSequence.load(xml_file, str(cache_dir))
+  assert sequence.notes == ['note']
+  assert os.listdir(str(cache_dir)) == []
+
+
+def test_cache_round_trip_of_parsed_example(tmp_path):
+  pytest.importorskip('musicXML_parser')
+  xml_file = os.path.join(EXAMPLES_DIR, 'ballade1', 'musicxml_cleaned.musicxml')
+  sequence = xml_data.XmlNoteSequence(xml_file)
+  sequence.to_cache(str(tmp_path / 'sequence.pkl'))
+  loaded = xml_data.XmlNoteSequence.from_cache(str(tmp_path / 'sequence.pkl'), xml_file)
+
+  expected = sequence.to_note_table()
+  table = loaded.to_note_table()
+  for name, column in expected.columns.items():
+    np.testing.assert_array_equal(table.columns[name], column, err_msg=name)
+  assert loaded.num_notes == sequence.num_notes and loaded.total_length == sequence.total_length
+  assert [(el.xml_position, el.type) for el in loaded.meta.directions] == \
+      [(el.xml_position, el.type) for el in sequence.meta.directions]
+  assert loaded.meta.direction_categories == sequence.meta.direction_categories
+  assert [(el.xml_position, el.numerator, el.denominator) for el in loaded.meta.time_signatures] == \
+      [(el.xml_position, el.numerator, el.denominator) for el in sequence.meta.time_signatures]
+  assert [el.type for el in loaded.meta.abs_dynamics] == [el.type for el in sequence.meta.abs_dynamics]
+  assert [el.type for el in loaded.meta.abs_tempo] == [el.type for el in sequence.meta.abs_tempo]
+
+
+def direction(xml_position, type_name, content, number=None, staff=1):
+  direction_type = {'type': type_name, 'content': content}
+  if number is not None:
+    direction_type['number'] = number
+  return types.SimpleNamespace(xml_position=xml_position, type=direction_type, staff=staff, xml_direction=None)
+
+
+def xml_meta(directions):
+  """XmlMeta of a one-measure document holding directions, opened with a p at 0."""
+  directions = [direction(0, 'dynamic', 'p')] + directions
+  measure = types.SimpleNamespace(directions=directions)
+  xml_doc = types.SimpleNamespace(parts=[types.SimpleNamespace(measures=[measure])], get_time_signatures=lambda: [])
+  return xml_data.XmlMeta(xml_doc)
+
+
+def spans(meta):
+  return [(el.type['type'], el.xml_position, el.end_xml_position) for el in meta.rel_dynamics]
+
+
+def test_nested_wedges_close_innermost_first():
+  with warnings.catch_warnings():
+    warnings.simplefilter('error')
+    meta = xml_meta([direction(10, 'crescendo', 'start', 1), direction(20, 'crescendo', 'start', 1),
+                     direction(30, 'crescendo', 'stop', 1), direction(40, 'crescendo', 'stop', 1),
+                     direction(50, 'diminuendo', 'start', 1), direction(55, 'diminuendo', 'start', 2),
+                     direction(60, 'diminuendo', 'stop', 1), direction(70, 'diminuendo', 'stop', 2)])
+  assert spans(meta) == [('crescendo', 10, 40), ('crescendo', 20, 30), ('diminuendo', 50, 60),
+                         ('diminuendo', 55, 70)]
+
+
+def test_wedges_pair_per_staff():
+  with warnings.catch_warnings():
+    warnings.simplefilter('error')
+    meta = xml_meta([direction(10, 'crescendo', 'start', 1, staff=1), direction(15, 'crescendo', 'start', 1, staff=2),
+                     direction(20, 'crescendo', 'stop', 1, staff=2), direction(30, 'crescendo', 'stop', 1, staff=1)])
+  assert spans(meta) == [('crescendo', 10, 30), ('crescendo', 15, 20)]
+
+
+def test_stop_without_start_keeps_closed_spans():
+  with pytest.warns(RuntimeWarning, match='stop without an open start') as caught:
+    meta = xml_meta([direction(5, 'diminuendo', 'stop', 1), direction(10, 'crescendo', 'start', 1),
+                     direction(20, 'crescendo', 'stop', 1), direction(30, 'crescendo', 'stop', 1)])
+  assert len([el for el in caught if 'stop without an open start' in str(el.message)]) == 2
+  assert spans(meta) == [('crescendo', 10, 20)]
+
+
+def test_unclosed_start_falls_back_to_next_dynamic():
+  with pytest.warns(RuntimeWarning, match='never stopped'):
+    meta = xml_meta([direction(10, 'crescendo', 'start', 1), direction(50, 'dynamic', 'f'),
+                     direction(60, 'diminuendo', 'start', 1)])
+  assert spans(meta) == [('crescendo', 10, 50), ('diminuendo', 60, float('inf'))]
+
+
+def test_none_wedge_stop_takes_its_wedge_type():
+  with warnings.catch_warnings():
+    warnings.simplefilter('error')
+    meta = xml_meta([direction(10, 'crescendo', 'start', 1), direction(15, 'diminuendo', 'start', 2),
+                     direction(20, 'none', 'stop', 1), direction(25, 'none', 'stop', 2)])
+  assert spans(meta) == [('crescendo', 10, 20), ('diminuendo', 15, 25)]
+
+  with pytest.warns(RuntimeWarning, match='wedge stop without a preceding wedge'):
+    meta = xml_meta([direction(20, 'none', 'stop', 3)])
+  assert meta.directions[-1].type['type'] == 'none'